@@ -1,14 +1,31 @@
 # check compatibility
+import logging
+
 import py4web
 
 assert py4web.check_compatible("0.1.20190709.1")
 
+from .grid_helpers import PY4WEB_VERSION
+
+if py4web.__version__ != PY4WEB_VERSION:
+    logging.getLogger("py4web").warning(
+        "the keyset grids were checked against py4web %s, run the tests with %s",
+        PY4WEB_VERSION,
+        py4web.__version__,
+    )
+
 # by importing db you expose it to the _dashboard/dbadmin
 from .models import db
 
 # by importing controllers you expose the actions defined in it
 from . import controllers
 
+# by importing tasks you define the background jobs
+from . import tasks
+
+# the processes serving the app run the jobs, see settings.JOB_WORKERS
+tasks.start_workers()
+
 # optional parameters
 __version__ = "0.0.0"
 __author__ = "you <you@example.com>"
@@ -0,0 +1,222 @@
+"""
+This file defines the benchmark of the grid pages, run in-process against the app
+
+    python benchmark.py --generate 100k --output baseline.json
+    python benchmark.py --output after.json --compare baseline.json
+
+Every action of controllers.py is requested through the py4web WSGI app, without
+a server, with a few variants each (sorted, searched, last page).  For each
+endpoint the p50/p99 latency, the queries per request (from the X-SQL-Queries
+header of the SQL profiler) and the peak RSS of the process are recorded in a
+JSON file.  --compare prints the change from an earlier run and exits with an
+error when an endpoint got slower than --tolerance.
+
+The benchmark uses the database configured in settings.py.  To measure at scale
+point it to a scratch database in settings_private.py, e.g.
+
+    DB_URI = "sqlite://bench_100k.db"
+    DB_FAKE_MIGRATE = False
+
+and fill it with --generate SCALE (10k, 100k, 1m, 10m order lines, see fake_data.py).
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import resource
+import sqlite3
+import sys
+import time
+from wsgiref.util import setup_testing_defaults
+
+APP_FOLDER = os.path.dirname(os.path.abspath(__file__))
+APP_NAME = os.path.basename(APP_FOLDER)
+
+# endpoint -> query strings requested, "last" is the Last link of the first page
+ENDPOINTS = {
+    "basic_grid": ["", "orderby=~district.name"],
+    "columns": ["", "orderby=~customer.contact", "last"],
+    "search": ["", "search_type=0&search_string=maria", "search_type=3&search_string=north"],
+    "crud": ["", "search_type=2&search_string=owner", "last"],
+    "action_buttons": ["", "orderby=~product.unit_price", "last"],
+    "advanced_columns": ["", "orderby=district.name", "last"],
+    "advanced_search": ["", "sq_search_by_name_or_contact=maria", "sq_search_by_title=Owner"],
+}
+
+
+def call(app, path, query=""):
+    """
+    GET /APP_NAME/path?query through the WSGI app
+
+    Returns
+    -------
+    (seconds, status, headers, body)
+    """
+    environ = dict()
+    setup_testing_defaults(environ)
+    environ["PATH_INFO"] = "/%s/%s" % (APP_NAME, path)
+    environ["QUERY_STRING"] = query
+    response = dict()
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split()[0])
+        response["headers"] = dict(headers)
+
+    started = time.perf_counter()
+    body = b"".join(app(environ, start_response))
+    return time.perf_counter() - started, response["status"], response["headers"], body
+
+
+def last_page_query(app, path):
+    """The query string of the Last link on the first page of a grid"""
+    body = call(app, path)[3].decode("utf8")
+    marker = body.find(">Last</a>")
+    start = body.rfind('href="', 0, marker)
+    if marker < 0 or start < 0:
+        return ""
+    href = body[start + 6 : body.find('"', start + 6)].replace("&amp;", "&")
+    return href.partition("?")[2]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def run(app, requests, endpoints=ENDPOINTS):
+    """
+    Benchmark the endpoints
+
+    Parameters
+    ----------
+    app: the WSGI app
+    requests: number of timed requests per query string, after one warm up request
+    endpoints: dict of path -> list of query strings
+
+    Returns
+    -------
+    dict of path -> dict(p50_ms, p99_ms, queries, peak_rss_mb, statuses)
+    """
+    results = dict()
+    for path, queries in endpoints.items():
+        latencies = []
+        query_counts = []
+        statuses = set()
+        for query in queries:
+            if query == "last":
+                query = last_page_query(app, path)
+            call(app, path, query)
+            for _ in range(requests):
+                seconds, status, headers, _ = call(app, path, query)
+                latencies.append(seconds * 1000)
+                query_counts.append(int(headers.get("X-SQL-Queries", 0)))
+                statuses.add(status)
+        results[path] = dict(
+            p50_ms=round(percentile(latencies, 0.5), 2),
+            p99_ms=round(percentile(latencies, 0.99), 2),
+            queries=round(sum(query_counts) / len(query_counts), 1),
+            # ru_maxrss is in KB on Linux
+            peak_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            statuses=sorted(statuses),
+        )
+        print(
+            "%-18s p50 %8.2fms  p99 %8.2fms  %5.1f queries  %7.1fMB  %s"
+            % (
+                path,
+                results[path]["p50_ms"],
+                results[path]["p99_ms"],
+                results[path]["queries"],
+                results[path]["peak_rss_mb"],
+                results[path]["statuses"],
+            )
+        )
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print the change of every endpoint from a previous run
+
+    Returns
+    -------
+    the list of endpoints whose p50 grew by more than tolerance (a fraction)
+    """
+    slower = []
+    print("\n%-18s %22s %22s %14s" % ("compared to baseline", "p50 ms", "p99 ms", "queries"))
+    for path, result in results.items():
+        before = baseline["endpoints"].get(path)
+        if not before:
+            continue
+        change = result["p50_ms"] / before["p50_ms"] - 1 if before["p50_ms"] else 0
+        if change > tolerance:
+            slower.append(path)
+        print(
+            "%-18s %8.2f -> %8.2f %+4.0f%% %8.2f -> %8.2f %5.1f -> %5.1f%s"
+            % (
+                path,
+                before["p50_ms"],
+                result["p50_ms"],
+                change * 100,
+                before["p99_ms"],
+                result["p99_ms"],
+                before["queries"],
+                result["queries"],
+                "  SLOWER" if path in slower else "",
+            )
+        )
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the grid pages")
+    parser.add_argument("--generate", metavar="SCALE", help="fill the empty database first")
+    parser.add_argument("--requests", type=int, default=20, help="timed requests per page")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p50 growth")
+    parser.add_argument("endpoints", nargs="*", help="only benchmark these actions")
+    args = parser.parse_args()
+
+    from py4web.core import wsgi
+
+    # the background jobs are left to the web processes
+    os.environ.setdefault("JOB_WORKERS", "0")
+    # the queries per request are read from the profiler headers
+    os.environ.setdefault("SQL_PROFILER", "1")
+    app = wsgi(apps_folder=os.path.dirname(APP_FOLDER), yes=True)
+    db = importlib.import_module("apps.%s.models" % APP_NAME).db
+    if args.generate:
+        fake_data = importlib.import_module("apps.%s.fake_data" % APP_NAME)
+        fake_data.generate(db, args.generate)
+
+    counts = {name: db(db[name]).count() for name in ("customer", "order", "order_detail")}
+    db.commit()
+    endpoints = {
+        path: queries
+        for path, queries in ENDPOINTS.items()
+        if not args.endpoints or path in args.endpoints
+    }
+    print("rows: %s" % counts)
+    results = dict(
+        created=time.strftime("%Y-%m-%d %H:%M:%S"),
+        python=platform.python_version(),
+        sqlite=sqlite3.sqlite_version,
+        rows=counts,
+        requests=args.requests,
+        endpoints=run(app, args.requests, endpoints),
+    )
+
+    if args.output:
+        with open(args.output, "w") as stream:
+            json.dump(results, stream, indent=2)
+    if args.compare:
+        with open(args.compare) as stream:
+            slower = compare(results["endpoints"], json.load(stream), args.tolerance)
+        if slower:
+            sys.exit("slower than the baseline: %s" % ", ".join(slower))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+This file defines the command loading a CSV or JSON lines file into a table of the app
+
+    python bulk_import.py customer customers.csv
+    python bulk_import.py order orders.jsonl
+    python bulk_import.py order_detail lines.csv --batch 10000 --rejects rejected.jsonl
+
+The columns are field names.  References may be given by id or by name (districts,
+shippers, categories, products and customers), orders referenced by the lines of
+the same feed should come with their id.  Rows failing validation are skipped and
+written to --rejects with their errors, see importer.py.  The database is the one
+configured in settings.py.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+
+APP_FOLDER = os.path.dirname(os.path.abspath(__file__))
+APP_NAME = os.path.basename(APP_FOLDER)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk load a table from a file")
+    parser.add_argument("table", help="the table to load")
+    parser.add_argument("path", help="CSV file with a header line, or JSON lines (.jsonl)")
+    parser.add_argument("--batch", type=int, default=5000, help="rows per transaction")
+    parser.add_argument("--rejects", help="write the rejected rows to this JSON lines file")
+    args = parser.parse_args()
+
+    from py4web.core import wsgi
+
+    # the background jobs are left to the web processes
+    os.environ.setdefault("JOB_WORKERS", "0")
+    # loads the app, so the models are defined and the indexes exist
+    wsgi(apps_folder=os.path.dirname(APP_FOLDER), yes=True)
+    models = importlib.import_module("apps.%s.models" % APP_NAME)
+    importer = importlib.import_module("apps.%s.importer" % APP_NAME)
+    if args.table not in models.db.tables:
+        sys.exit("unknown table %s" % args.table)
+
+    started = time.time()
+    report = importer.import_rows(
+        models.db,
+        args.table,
+        importer.read_rows(args.path),
+        batch_size=args.batch,
+        max_rejects=sys.maxsize if args.rejects else 20,
+        log=print,
+    )
+    print(
+        "%s rows inserted, %s rejected in %.1fs"
+        % (report["inserted"], report["rejected"], time.time() - started)
+    )
+    if args.rejects:
+        with open(args.rejects, "w") as stream:
+            for reject in report["rejects"]:
+                stream.write(json.dumps(reject, default=str) + "\n")
+    else:
+        for reject in report["rejects"]:
+            print("line %(line)s: %(errors)s" % reject)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""
+This file defines the helpers used to cache database results in common.cache
+
+Every table is given a version counter that is bumped whenever a row is
+inserted, updated or deleted through the DAL.  Cached values are stored together
+with the versions of the tables they were built from and are recomputed as soon
+as one of those versions changes, so there is no need to guess an expiration.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from pydal import Field
+
+
+class TransactionCallbacks:
+    """
+    Callbacks run once the transaction of the current thread commits or rolls back
+
+    The adapter of a DAL is shared by every thread, only its connection is thread
+    local, so the callbacks are kept in a threading.local.  A callback added again
+    under the same key before the transaction ends is only run once.
+    Use after_transaction(db, key, callback) rather than this class directly.
+    """
+
+    def __init__(self, adapter):
+        self.local = threading.local()
+        # wrapped once, when the first callback of the adapter is added
+        for name in ("commit", "rollback"):
+            setattr(adapter, name, self._end_transaction(getattr(adapter, name)))
+
+    def add(self, key, callback):
+        callbacks = getattr(self.local, "callbacks", None)
+        if callbacks is None:
+            callbacks = self.local.callbacks = dict()
+        callbacks[key] = callback
+
+    def _end_transaction(self, method):
+        def end_transaction(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            finally:
+                callbacks = getattr(self.local, "callbacks", None)
+                self.local.callbacks = None
+                for callback in (callbacks or {}).values():
+                    callback()
+
+        return end_transaction
+
+
+_transaction_callbacks_lock = threading.Lock()
+
+
+def after_transaction(db, key, callback):
+    """
+    Run callback() once the transaction of the current thread on db commits or rolls back
+
+        after_transaction(db, ("prices", 7), lambda: prices.invalidate(7))
+
+    Parameters
+    ----------
+    db: the DAL the transaction is on
+    key: hashable, the callbacks added under the same key run once per transaction
+    callback: function without arguments
+    """
+    adapter = db._adapter
+    callbacks = adapter.__dict__.get("_transaction_callbacks")
+    if callbacks is None:
+        with _transaction_callbacks_lock:
+            callbacks = adapter.__dict__.get("_transaction_callbacks")
+            if callbacks is None:
+                callbacks = adapter._transaction_callbacks = TransactionCallbacks(adapter)
+    callbacks.add(key, callback)
+
+
+class TableVersions:
+    """
+    Per-table version counters bumped by every insert, update and delete done through the DAL
+
+        table_versions = TableVersions()
+        table_versions.track(db.customer, db.district)
+        table_versions("customer", "district")  # -> (3, 0)
+
+    The counters are bumped when the row is written and again when the transaction
+    of the writing thread commits or rolls back, so a value cached by another thread
+    while the write was still uncommitted does not outlive the transaction.
+    Versions live in process memory, like common.cache itself.
+
+    Given a db, every write is also counted in a table_version table, in the
+    transaction of the write, and stored(*tablenames) reads those counters: they
+    see the writes of every process, e.g. of the other web server processes or of
+    bulk_import.py, at the cost of one more statement per write and one select per read.
+
+    Parameters
+    ----------
+    db: optional DAL to also count the writes in
+    tablename: the table the counters are stored in
+    """
+
+    def __init__(self, db=None, tablename="table_version"):
+        self.versions = dict()
+        self.lock = threading.Lock()
+        self.db = db
+        self.table = None
+        if db is not None:
+            self.table = db.define_table(
+                tablename,
+                Field("tablename", length=128, unique=True),
+                Field("version", "integer", default=0),
+            )
+
+    def __call__(self, *tablenames):
+        return tuple(self.versions.get(tablename, 0) for tablename in tablenames)
+
+    def track(self, *tables):
+        for table in tables:
+            if table is self.table:
+                continue
+            table._after_insert.append(lambda f, i, t=table: self.written(t))
+            table._after_update.append(lambda s, f, t=table: self.written(t))
+            table._after_delete.append(lambda s, t=table: self.written(t))
+
+    def bump(self, *tablenames):
+        with self.lock:
+            for tablename in tablenames:
+                self.versions[tablename] = self.versions.get(tablename, 0) + 1
+
+    def written(self, table):
+        tablename = table._tablename
+        self.bump(tablename)
+        after_transaction(table._db, (id(self), tablename), lambda: self.bump(tablename))
+        if self.table is not None:
+            self.count(tablename)
+
+    def count(self, tablename):
+        """Add one to the stored counter of tablename, in the current transaction"""
+        table = self.table
+        self.db.executesql(
+            "INSERT INTO %(table)s (%(name)s, %(version)s) VALUES (%(value)s, 1) "
+            "ON CONFLICT (%(name)s) DO UPDATE SET %(version)s = %(version)s + 1;"
+            % dict(
+                table=table._rname,
+                name=table.tablename._rname,
+                version=table.version._rname,
+                value=self.db._adapter.represent(tablename, "string"),
+            )
+        )
+
+    def stored(self, *tablenames):
+        """The counters of tablenames stored in the database, needs a db"""
+        table = self.table
+        rows = self.db(table.tablename.belongs(tablenames)).select(
+            table.tablename, table.version, cacheable=True
+        )
+        versions = {row.tablename: row.version for row in rows}
+        return tuple(versions.get(tablename, 0) for tablename in tablenames)
+
+
+def versioned_cache(cache, versions, *tablenames, expiration=None):
+    """
+    Build a pydal cache=(cache_model, time_expire) tuple storing selects in a py4web Cache
+
+    Cached results are dropped as soon as one of tablenames is written
+
+        IS_IN_DB(db, "district.id", cache=versioned_cache(cache, table_versions, "district"))
+        db(query).select(cache=versioned_cache(cache, table_versions, "customer"), cacheable=True)
+
+    Parameters
+    ----------
+    cache: the py4web Cache to store results in
+    versions: the TableVersions tracking tablenames
+    tablenames: the tables the cached selects read from
+    expiration: optional maximum age in seconds, None keeps results until a write
+
+    Returns
+    -------
+    (cache_model, expiration) as expected by the pydal select cache argument
+    """
+
+    def cache_model(key, f, time_expire=expiration):
+        def monitor():
+            if time_expire:
+                return versions(*tablenames), int(time.time() // time_expire)
+            return versions(*tablenames)
+
+        return cache.get(key, f, expiration=0, monitor=monitor)
+
+    return cache_model, expiration
+
+
+class DimensionTable:
+    """
+    The rows of a small, rarely written table kept in memory, e.g. the districts
+
+        districts = DimensionTable(db.district, table_versions)
+        districts.label(3)  # -> "North"
+        districts.ids(lambda name: "nor" in name.lower())  # -> [3, 7]
+
+    Represents can show the name of a reference without joining or querying the
+    table.  The rows are loaded with one select on first use and loaded again
+    after the table is written (see TableVersions).
+
+    Parameters
+    ----------
+    table: the table to keep
+    versions: the TableVersions tracking table
+    label: the field naming the rows
+    """
+
+    def __init__(self, table, versions, label="name"):
+        self.table = table
+        self.versions = versions
+        self.label_field = label
+        self.version = None
+        self.by_id = dict()
+
+    def rows(self):
+        """dict of id -> row"""
+        version = self.versions(self.table._tablename)
+        if version != self.version:
+            rows = self.table._db(self.table).select(orderby=self.table._id)
+            self.by_id = {row.id: row for row in rows}
+            self.version = version
+        return self.by_id
+
+    def label(self, id, default=""):
+        row = self.rows().get(id)
+        return row[self.label_field] if row else default
+
+    def ids(self, match):
+        """The ids of the rows whose label match(label) is true"""
+        return [
+            id
+            for id, row in self.rows().items()
+            if row[self.label_field] is not None and match(row[self.label_field])
+        ]
+
+
+class LocalCache:
+    """
+    Bounded, process-local cache of values loaded by key, with a time to live
+
+        prices = LocalCache(load_prices, size=10000, ttl=300)
+        prices.get_many([1, 2, 3])  # -> {1: Decimal("18.00"), 2: ...}
+        prices.invalidate(2)
+        prices.stats()  # -> dict(hits=2, misses=3, size=3, hit_rate=0.4)
+
+    The least recently used keys are dropped past size.  Keys the loader does not
+    return (e.g. deleted rows) are not cached.  Invalidate the keys whose values
+    are written with invalidate_written, the ttl bounds how long writes made
+    elsewhere (other processes, raw SQL) can go unnoticed.
+
+    Parameters
+    ----------
+    load: function receiving a list of keys and returning a dict of key -> value for the keys found
+    size: maximum number of keys kept
+    ttl: seconds a value is kept, None keeps it until it is invalidated or dropped
+    """
+
+    def __init__(self, load, size=1000, ttl=None):
+        self.load = load
+        self.size = size
+        self.ttl = ttl
+        self.values = OrderedDict()  # key -> (value, loaded at)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        """The values of keys, loading the missing and expired ones with one call to load"""
+        found = dict()
+        missing = []
+        now = time.time()
+        with self.lock:
+            for key in keys:
+                item = self.values.get(key)
+                if item is not None and (self.ttl is None or now - item[1] < self.ttl):
+                    self.values.move_to_end(key)
+                    found[key] = item[0]
+                    self.hits += 1
+                elif key not in missing:
+                    missing.append(key)
+                    self.misses += 1
+
+        if missing:
+            loaded = self.load(missing)
+            with self.lock:
+                for key, value in loaded.items():
+                    self.values[key] = (value, now)
+                    self.values.move_to_end(key)
+                while len(self.values) > self.size:
+                    self.values.popitem(last=False)
+            found.update(loaded)
+        return found
+
+    def invalidate(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.values.pop(key, None)
+
+    def invalidate_written(self, db, *keys):
+        """
+        Invalidate keys written in the current transaction on db, now and again once
+        it ends, so a value loaded by another thread before the commit is not kept
+        """
+        self.invalidate(*keys)
+        for key in keys:
+            after_transaction(db, (id(self), key), lambda key=key: self.invalidate(key))
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            size=len(self.values),
+            hit_rate=round(self.hits / lookups, 3) if lookups else None,
+        )
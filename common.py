@@ -13,6 +13,12 @@ from py4web.utils.downloader import downloader
 from pydal.tools.tags import Tags
 from py4web.utils.factories import ActionFactory
 from . import settings
+from .cache_helpers import TableVersions
+from .jobs import JobRunner
+from .schema import define_index
+from .permissions import GroupMembership
+from .profiler import SQLProfiler
+from .sqlite_pool import ReadOnlyPool, enable_sqlite_pool, sqlite_pragmas
 from py4web.utils.form import Form, FormStyleBulma
 from py4web.utils.grid import Grid, GridClassStyleBulma
 
@@ -42,12 +48,23 @@ db = DAL(
     pool_size=settings.DB_POOL_SIZE,
     migrate=settings.DB_MIGRATE,
     fake_migrate=settings.DB_FAKE_MIGRATE,
+    after_connection=sqlite_pragmas(settings.SQLITE_PRAGMAS),
 )
+enable_sqlite_pool(db, settings.DB_POOL_SIZE)
 
 # #######################################################
 # define global objects that may or may not be used by the actions
 # #######################################################
 cache = Cache(size=1000)
+table_versions = TableVersions(db)
+read_only = ReadOnlyPool(db, size=settings.DB_READ_POOL_SIZE)
+profiler = SQLProfiler(
+    db,
+    repeats=settings.SQL_PROFILER_REPEATS,
+    panel=settings.SQL_PROFILER_PANEL,
+    enabled=settings.SQL_PROFILER,
+    logger=logger,
+)
 T = Translator(settings.T_FOLDER)
 
 # #######################################################
@@ -112,6 +129,18 @@ if settings.SMTP_SERVER:
 # #######################################################
 if auth.db:
     groups = Tags(db.auth_user, "groups")
+    define_index(
+        groups.tag_table,
+        "auth_user_tag_groups_record",
+        groups.tag_table.record_id,
+        groups.tag_table.tagpath,
+    )
+    group_members = GroupMembership(
+        groups,
+        auth,
+        size=settings.GROUP_CACHE_SIZE,
+        ttl=settings.GROUP_CACHE_TTL,
+    )
 
 # #######################################################
 # Enable optional auth plugin
@@ -176,16 +205,17 @@ if settings.UPLOAD_FOLDER:
     # field.download_url = lambda filename: URL('download/%s' % filename)
 
 # #######################################################
-# Optionally configure celery
+# Background jobs, defined and started in tasks.py
 # #######################################################
-if settings.USE_CELERY:
-    from celery import Celery
-
-    # to use "from .common import scheduler" and then use it according
-    # to celery docs, examples in tasks.py
-    scheduler = Celery(
-        "apps.%s.tasks" % settings.APP_NAME, broker=settings.CELERY_BROKER
-    )
+jobs = JobRunner(
+    db,
+    workers=settings.JOB_WORKERS,
+    poll=settings.JOB_POLL,
+    lease=settings.JOB_LEASE,
+    max_attempts=settings.JOB_MAX_ATTEMPTS,
+    retry_delay=settings.JOB_RETRY_DELAY,
+    logger=logger,
+)
 
 
 # #######################################################
@@ -196,7 +226,7 @@ auth.enable(uses=(session, T, db), env=dict(T=T))
 # #######################################################
 # Define convenience decorators
 # #######################################################
-unauthenticated = ActionFactory(db, session, T, flash, auth)
-authenticated = ActionFactory(db, session, T, flash, auth.user)
+unauthenticated = ActionFactory(profiler, db, session, T, flash, auth)
+authenticated = ActionFactory(profiler, db, session, T, flash, auth.user)
 
 GRID_DEFAULTS = dict(formstyle=FormStyleBulma, grid_class_style=GridClassStyleBulma)
@@ -1,9 +1,57 @@
+import datetime
+
 from yatl import XML
 
-from py4web import action, URL, request
-from py4web.utils.grid import Grid, Column
-from .common import unauthenticated, session, db, GRID_DEFAULTS
-from .grid_helpers import GridSearchQuery, GridSearch
+from py4web import action, URL, request, HTTP
+from py4web.utils.grid import Column
+from .common import (
+    unauthenticated,
+    authenticated,
+    auth,
+    session,
+    db,
+    read_only,
+    groups,
+    group_members,
+    jobs,
+    cache,
+    profiler,
+    table_versions,
+    GRID_DEFAULTS,
+)
+from .cache_helpers import versioned_cache
+from .grid_helpers import (
+    GridSearchQuery,
+    GridSearch,
+    GridETag,
+    GridTemplate,
+    KeysetGrid,
+    AutocompleteWidget,
+    EXPORT_FORMATS,
+    ExportColumn,
+    StaticURLs,
+    cached_helper,
+    memoize_represent,
+    text_query,
+)
+from .models import (
+    verify_order_totals,
+    product_prices,
+    product_needs_reorder,
+    districts,
+)
+from . import settings
+from .formatters import format_decimal
+from .permissions import RowRules
+from .reporting import (
+    DIMENSIONS,
+    RevenueReport,
+    count_periods,
+    label,
+    parse_period,
+    revenue_report,
+)
+from .schema import index_report, table_exists
 from pydal.validators import IS_NULL_OR, IS_IN_DB, IS_IN_SET
 from yatl.helpers import A, I
 
@@ -13,20 +61,95 @@ def index():
     return dict()
 
 
+@authenticated("verify_order_totals", template=False)
+def verify_order_totals_action():
+    """
+    Report orders whose stored subtotal/total drifted from their order lines
+    Call with ?fix=true to queue the order_totals job rebuilding the drifted totals
+    """
+    if request.query.get("fix", "").lower() in ("1", "true", "yes"):
+        return dict(job=jobs.enqueue("order_totals"))
+    result = verify_order_totals()
+    result["drifted"] = [
+        {k: str(v) for k, v in drift.items()} for drift in result["drifted"]
+    ]
+    return result
+
+
+@authenticated("job_status", template=False)
+def job_status():
+    """Number of background jobs by status, and the latest ones"""
+    return jobs.status()
+
+
+@authenticated("index_report", template=False)
+def index_report_action():
+    """
+    List the declared indexes, the ones missing from the database and the
+    references no index can be used for
+    """
+    return index_report(db)
+
+
+@authenticated("cache_stats", template=False)
+def cache_stats():
+    """Hits and misses of the process-local caches"""
+    return dict(
+        product_prices=product_prices.stats(),
+        group_members=group_members.cache.stats(),
+    )
+
+
+@authenticated.get("autocomplete/<tablename>", template=False)
+def autocomplete(tablename):
+    """
+    Rows of tablename whose name starts with ?q=, 20 at a time (?page=0, 1, ...)
+    Only tables used by an AutocompleteWidget can be looked up, by logged in users
+    """
+    page_size = 20
+    label_field = AutocompleteWidget.lookups.get(tablename)
+    if not label_field:
+        raise HTTP(404)
+
+    prefix = request.query.get("q", "").strip()
+    page = request.query.get("page", "0")
+    page = int(page) if page.isdigit() else 0
+
+    table = label_field.table
+    query = label_field.startswith(prefix) if prefix else table.id > 0
+    rows = db(query).select(
+        table.id,
+        label_field,
+        orderby=label_field.sqlsafe + " COLLATE NOCASE",
+        limitby=(page * page_size, (page + 1) * page_size + 1),
+    )
+
+    return dict(
+        items=[
+            dict(id=row.id, label=row[label_field.name]) for row in rows[:page_size]
+        ],
+        more=len(rows) > page_size,
+    )
+
+
 @action("basic_grid")
 @action.uses(
-    "grid.html",
+    profiler,
+    GridETag(table_versions, "district", session=session),
+    GridTemplate("grid.html"),
     session,
     db,
+    read_only,
 )
 def basic_grid():
-    grid = Grid(
+    grid = KeysetGrid(
         db.district,
         orderby=db.district.name,
         show_id=True,
         rows_per_page=5,
         headings=[XML("District<br />ID")],
         validation=no_more_than_8_districts,
+        count_cache=versioned_cache(cache, table_versions, "district"),
         **GRID_DEFAULTS,
     )
 
@@ -41,66 +164,150 @@ def no_more_than_8_districts(form):
 
 @action("columns")
 @action.uses(
-    "grid.html",
+    profiler,
+    GridETag(table_versions, "customer", "district", session=session),
+    GridTemplate("grid.html"),
     session,
     db,
+    read_only,
 )
 def columns():
-    grid = Grid(
+    return dict(grid=columns_grid())
+
+
+def columns_grid(**attributes):
+    return KeysetGrid(
         db.customer,
         columns=[
             db.customer.name,
             db.customer.contact,
             db.customer.title,
-            db.district.name,
+            district_column(),
         ],
-        left=[db.district.on(db.customer.district == db.district.id)],
+        left=district_join(),
         headings=["Name", "Contact", "Title", "District"],
+        count_cache=versioned_cache(cache, table_versions, "customer", "district"),
+        page_cache=versioned_cache(cache, table_versions, "customer", "district"),
         **GRID_DEFAULTS,
+        **attributes,
     )
 
-    return dict(grid=grid)
+
+def customer_fulltext():
+    """
+    Whether the customer searches go through the FTS5 index (settings.FULLTEXT_SEARCH)
+    instead of LIKE '%value%', only when the index exists
+    """
+    return (
+        settings.FULLTEXT_SEARCH
+        and db._dbname == "sqlite"
+        and table_exists(db.customer_fts)
+    )
+
+
+def district_query(value):
+    # match the few districts in memory so customers are filtered through their district index
+    value = value.lower()
+    return db.customer.district.belongs(
+        districts.ids(lambda name: value in name.lower())
+    )
+
+
+def district_join():
+    """
+    The customer grids name the district from the districts cache, they only join
+    the district table to sort by its name
+    """
+    if request.query.get("orderby", "").lstrip("~") == "district.name":
+        return [db.district.on(db.customer.district == db.district.id)]
+    return None
+
+
+def district_column(**attributes):
+    # exported as the district name too, not its id
+    return ExportColumn(
+        "district",
+        represent=lambda row: districts.label(row["customer.district"]),
+        export=lambda row: districts.label(row["customer.district"]),
+        orderby=db.district.name,
+        required_fields=[db.customer.district],
+        **attributes,
+    )
 
 
 @action("search")
 @action.uses(
-    "grid.html",
+    profiler,
+    GridETag(table_versions, "customer", "district", session=session),
+    GridTemplate("grid.html"),
     session,
     db,
+    read_only,
 )
 def search():
+    return dict(grid=search_grid())
+
+
+def search_grid(**attributes):
+    fulltext = customer_fulltext()
     custom_search_queries = [
-        ["name", lambda value: db.customer.name.contains(value)],
-        ["contact", lambda value: db.customer.contact.contains(value)],
-        ["title", lambda value: db.customer.title.contains(value)],
-        ["district", lambda value: db.district.name.contains(value)],
+        ["name", lambda value: text_query(db.customer, value, ["name"], fulltext)],
+        ["contact", lambda value: text_query(db.customer, value, ["contact"], fulltext)],
+        ["title", lambda value: text_query(db.customer, value, ["title"], fulltext)],
+        ["district", lambda value: district_query(value)],
     ]
 
-    grid = Grid(
+    return KeysetGrid(
         db.customer,
         columns=[
             db.customer.name,
             db.customer.contact,
             db.customer.title,
-            db.district.name,
+            district_column(),
         ],
-        left=[db.district.on(db.customer.district == db.district.id)],
+        left=district_join(),
         search_queries=custom_search_queries,
         headings=["Name", "Contact", "Title", "District"],
+        count_cache=versioned_cache(cache, table_versions, "customer", "district"),
+        count_limit=1000,
         **GRID_DEFAULTS,
+        **attributes,
     )
 
-    return dict(grid=grid)
+
+# the actions allowed on the customers of the crud grid, the same for every user:
+# details of the owners, editing all but the owners and deleting the sales agents
+district_autocomplete = db.customer.district.widget
+
+crud_rules = (
+    RowRules(db.customer)
+    .allow("details", db.customer.title == "Owner")
+    # in SQL NULL <> 'Owner' is not true, customers without a title are editable too
+    .allow("editable", (db.customer.title != "Owner") | (db.customer.title == None))
+    .allow("deletable", db.customer.title == "Sales Agent")
+)
 
 
 @action("crud")
 @action.uses(
-    "customer_grid.html",
+    profiler,
+    GridETag(
+        table_versions,
+        "customer",
+        "district",
+        groups.tag_table._tablename,
+        session=session,
+    ),
+    GridTemplate("customer_grid.html"),
     session,
+    group_members,
     db,
+    read_only,
 )
 def crud():
     mode = request.query.get("mode", "select")
+    # the autocomplete action is for logged in users, the others pick from the options
+    db.customer.district.widget = district_autocomplete if auth.user_id else None
     if mode == "new":
         db.customer.title.default = "President"
         db.customer.country.default = "United States"
@@ -115,94 +322,114 @@ def crud():
         db.customer.country.readable = False
         db.customer.district.readable = False
 
+    grid = crud_grid(auto_process=False)
+    grid.param.details_submit_value = "Done"
+    grid.process()
+
+    if grid.mode != "select":
+        header = ""
+    elif request.query.get("view") == "editable":
+        header = A("All customers", _href=URL("crud"), _class="button")
+    else:
+        header = A(
+            "Editable only",
+            _href=URL("crud", vars=dict(view="editable")),
+            _class="button",
+        )
+    return dict(grid=grid, grid_header=header)
+
+
+def crud_grid(**attributes):
+    fulltext = customer_fulltext()
     custom_search_queries = [
-        ["name", lambda value: db.customer.name.contains(value)],
-        ["contact", lambda value: db.customer.contact.contains(value)],
-        ["title", lambda value: db.customer.title.contains(value)],
-        ["district", lambda value: db.district.name.contains(value)],
+        ["name", lambda value: text_query(db.customer, value, ["name"], fulltext)],
+        ["contact", lambda value: text_query(db.customer, value, ["contact"], fulltext)],
+        ["title", lambda value: text_query(db.customer, value, ["title"], fulltext)],
+        ["district", lambda value: district_query(value)],
     ]
-    grid = Grid(
-        db.customer,
+    permissions = crud_rules.compile(group_members.groups)
+    editable_only = request.query.get("view") == "editable"
+    query = permissions.query("editable") if editable_only else None
+    return KeysetGrid(
+        db.customer if query is None else query,
         columns=[
             db.customer.name,
             db.customer.contact,
             db.customer.title,
-            db.district.name,
+            district_column(),
         ],
-        left=[db.district.on(db.customer.district == db.district.id)],
+        left=district_join(),
         headings=["Name", "Contact", "Title", "District"],
         search_queries=custom_search_queries,
         field_id=db.customer.id,
-        details=lambda row: True
-        if (
-            ("customer" in row and row.customer.title == "Owner")
-            | ("title" in row and row.title == "Owner")
-        )
-        else False,
-        editable=lambda row: True
-        if (
-            ("customer" in row and row.customer.title != "Owner")
-            | ("title" in row and row.title != "Owner")
-        )
-        else False,
-        deletable=lambda row: True
-        if (
-            ("customer" in row and row.customer.title == "Sales Agent")
-            | ("title" in row and row.title == "Sales Agent")
-        )
-        else False,
-        auto_process=False,
+        required_fields=permissions.fields,
+        count_cache=versioned_cache(cache, table_versions, "customer", "district"),
+        count_limit=1000,
+        details=permissions.check("details"),
+        editable=permissions.check("editable"),
+        deletable=permissions.check("deletable"),
         **GRID_DEFAULTS,
+        **attributes,
     )
 
-    grid.param.details_submit_value = "Done"
-    grid.process()
-
-    return dict(grid=grid)
 
+# 1 when the product needs to be reordered, computed by the database
+needs_reorder = product_needs_reorder.case(1, 0)
+# rows hold it under its SQL, building that SQL for every row would cost more than the button
+needs_reorder_key = str(needs_reorder)
+
+reorder_button_html = cached_helper(
+    lambda id, name: A(
+        I(_class="fas fa-redo"),
+        XML("&nbsp;Reorder"),
+        _href=URL(f"reorder/{id}"),
+        _role="button",
+        _title=f"Reorder {name}",
+        _message=f"Do you want to reorder {name}?",
+        _class="button grid-button is-small",
+    ),
+    "id",
+    "name",
+)
 
-def can_user_access(action, group_number):
-    if action == "create":
-        if group_number in [1, 2, 5, 7]:
-            return True
-    elif action == "details":
-        if group_number in [3, 4, 6]:
-            return True
-    elif action == "editable":
-        if group_number in [2, 5, 6, 7]:
-            return True
-    elif action == "deletable":
-        if group_number in [7]:
-            return True
-    return False
 
 def reorder_button(row):
-        if row.in_stock > row.reorder_level:
-            return None
-        button = A(
-            I(_class="fas fa-redo"),
-            _href=URL(f"reorder/{row.id}"),
-            _role="button",
-            _title=f"Reorder {row.name}",
-            _message=f"Do you want to reorder {row.name}?",
-            _class="button grid-button is-small",
-        )
-        button.append(XML("&nbsp;Reorder"))
-        return button
+    if not row._extra[needs_reorder_key]:
+        return None
+    return reorder_button_html(id=row.product.id, name=row.product.name)
+
 
 @action("action_buttons")
 @action.uses(
-    "grid.html",
+    profiler,
+    GridETag(table_versions, "product", session=session),
+    GridTemplate("grid.html"),
     session,
     db,
+    read_only,
 )
 def action_buttons():
+    grid = action_buttons_grid()
+
+    if request.query.get("view") == "low_stock":
+        header = A("All products", _href=URL("action_buttons"), _class="button")
+    else:
+        header = A(
+            "Low stock only",
+            _href=URL("action_buttons", vars=dict(view="low_stock")),
+            _class="button",
+        )
+    return dict(grid=grid, grid_header=header)
+
+
+def action_buttons_grid(**attributes):
     pre_action_buttons = [
         lambda row: reorder_button(row),
     ]
 
-    grid = Grid(
-        db.product,
+    low_stock = request.query.get("view") == "low_stock"
+    return KeysetGrid(
+        product_needs_reorder if low_stock else db.product,
         columns=[
             db.product.name,
             db.product.quantity_per_unit,
@@ -211,31 +438,71 @@ def action_buttons():
             db.product.reorder_level,
         ],
         orderby=db.product.name,
+        required_fields=[needs_reorder],
+        field_id=db.product.id,
         pre_action_buttons=pre_action_buttons,
+        count_cache=versioned_cache(cache, table_versions, "product"),
         **GRID_DEFAULTS,
+        **attributes,
     )
 
-    return dict(grid=grid)
+
+flag_urls = StaticURLs("images/flags", ".png")
+
+
+def customer_of(row):
+    """The customer fields of a customer grid row, joined with district or not"""
+    return row.customer if "customer" in row else row
+
+
+def customer_address(row):
+    customer = customer_of(row)
+    return XML(
+        f"{customer.name}"
+        f"<div>{customer.address}</div>"
+        f"<div>{customer.city}, {customer.region} {customer.postal_code}</div>"
+        f"<div>{customer.country}</div>"
+    )
+
+
+def customer_contact(row):
+    customer = customer_of(row)
+    return XML(f"{customer.contact}<div>{customer.title}</div>")
+
+
+def flag_represent(row):
+    country = customer_of(row).country
+    if not country:
+        return ""
+    src = flag_urls.get(country.lower()) or URL(
+        "static", "images/flags", country.lower() + ".png"
+    )
+    return XML(
+        f'<a href="https://www.wikipedia.org/wiki/{country}" target="_blank">'
+        f'<img src="{src}" width="68" height="40"></a>'
+    )
 
 
 @action("advanced_columns")
 @action.uses(
-    "customer_grid.html",
+    profiler,
+    GridETag(table_versions, "customer", "district", session=session),
+    GridTemplate("customer_grid.html"),
     session,
     db,
+    read_only,
 )
 def advanced_columns():
-    grid = Grid(
+    return dict(grid=advanced_columns_grid())
+
+
+def advanced_columns_grid(**attributes):
+    return KeysetGrid(
         db.customer,
         columns=[
             Column(
                 "name",
-                represent=lambda row: XML(
-                    f"{row.customer.name}"
-                    f"<div>{row.customer.address}</div>"
-                    f"<div>{row.customer.city}, {row.customer.region} {row.customer.postal_code}</div>"
-                    f"<div>{row.customer.country}</div>"
-                ),
+                represent=customer_address,
                 required_fields=[
                     db.customer.name,
                     db.customer.address,
@@ -248,20 +515,14 @@ def advanced_columns():
             ),
             Column(
                 "flag",
-                represent=lambda row: XML(
-                    f'<a href="https://www.wikipedia.org/wiki/{row.customer.country}" target="_blank"><img src="{URL("static", "images/flags", row.customer.country.lower() + ".png")}" width="68" height="40"></a>'
-                )
-                if row.customer.country
-                else "",
+                represent=memoize_represent(flag_represent, [db.customer.country]),
                 required_fields=[
                     db.customer.country,
                 ],
             ),
             Column(
                 "contact",
-                represent=lambda row: XML(
-                    f"{row.customer.contact}<div>{row.customer.title}</div>"
-                ),
+                represent=customer_contact,
                 orderby=db.customer.contact,
                 td_class_style="grid-cell-type-decimal",
                 required_fields=[
@@ -269,37 +530,46 @@ def advanced_columns():
                     db.customer.title,
                 ],
             ),
-            Column(
-                "district",
-                represent=lambda row: XML(f"{row.district.name}"),
-                orderby=db.district.name,
-                td_class_style="grid-cell-type-decimal",
-                required_fields=[
-                    db.district.name,
-                ],
-            ),
+            district_column(td_class_style="grid-cell-type-decimal"),
         ],
         headings=["NAME", "FLAG", "CONTACT", "DISTRICT"],
-        left=[db.district.on(db.customer.district == db.district.id)],
+        left=district_join(),
         field_id=db.customer.id,
+        count_cache=versioned_cache(cache, table_versions, "customer", "district"),
+        page_cache=versioned_cache(cache, table_versions, "customer", "district"),
         **GRID_DEFAULTS,
+        **attributes,
     )
 
-    return dict(grid=grid)
-
 
 @action("advanced_search")
 @action.uses(
-    "grid.html",
+    profiler,
+    GridETag(table_versions, "customer", "district", session=session),
+    GridTemplate("grid.html"),
     session,
     db,
+    read_only,
 )
 def advanced_search():
+    return dict(grid=advanced_search_grid())
+
+
+def advanced_search_grid(**attributes):
+    fulltext = customer_fulltext()
     search_queries = [
         GridSearchQuery(
             "Filter by District",
             lambda value: db.customer.district == value,
-            requires=IS_NULL_OR(IS_IN_DB(db, db.district, "%(name)s", zero="..")),
+            requires=IS_NULL_OR(
+                IS_IN_DB(
+                    db,
+                    db.district,
+                    "%(name)s",
+                    zero="..",
+                    cache=versioned_cache(cache, table_versions, "district"),
+                )
+            ),
         ),
         GridSearchQuery(
             "Search by title",
@@ -309,7 +579,11 @@ def advanced_search():
                     [
                         x.title
                         for x in db(db.customer.title != "").select(
-                            db.customer.title, distinct=True, orderby=db.customer.title
+                            db.customer.title,
+                            distinct=True,
+                            orderby=db.customer.title,
+                            cache=versioned_cache(cache, table_versions, "customer"),
+                            cacheable=True,
                         )
                     ]
                 )
@@ -317,26 +591,111 @@ def advanced_search():
         ),
         GridSearchQuery(
             "Search by name or contact",
-            lambda value: db.customer.name.contains(value)
-            | db.customer.contact.contains(value),
+            lambda value: text_query(db.customer, value, ["name", "contact"], fulltext),
+            # the best matches first, the rank is only known to a fulltext search
+            orderby=db.customer_fts.rank if fulltext else None,
         ),
     ]
 
     search = GridSearch(search_queries, queries=[db.customer.id > 0])
 
-    grid = Grid(
+    return KeysetGrid(
         query=search.query,
         columns=[
             db.customer.name,
             db.customer.contact,
             db.customer.title,
-            db.district.name,
+            district_column(),
         ],
-        left=[db.district.on(db.customer.district == db.district.id)],
+        left=district_join(),
         search_queries=search.search_queries,
         search_form=search.search_form,
         headings=["Name", "Contact", "Title", "District"],
+        field_id=db.customer.id,
+        orderby=search.orderby,
+        count_cache=versioned_cache(cache, table_versions, "customer", "district"),
+        count_limit=1000,
         **GRID_DEFAULTS,
+        **attributes,
     )
 
-    return dict(grid=grid)
+
+# the grids of the export action by name, the query string of their page selects
+# the same rows: search, sort and view
+export_grids = dict(
+    columns=columns_grid,
+    search=search_grid,
+    crud=crud_grid,
+    action_buttons=action_buttons_grid,
+    advanced_columns=advanced_columns_grid,
+    advanced_search=advanced_search_grid,
+)
+
+
+@action("export/<name>")
+@action.uses(profiler, session, group_members, db)
+def export(name):
+    """
+    All the rows of a grid as a CSV (?format=csv, the default) or JSON lines
+    (?format=jsonl) file
+    """
+    if name not in export_grids:
+        raise HTTP(404)
+    export_format = request.query.get("format", "csv")
+    if export_format not in EXPORT_FORMATS:
+        raise HTTP(400)
+    grid = export_grids[name](auto_process=False)
+    return grid.export(export_format)
+
+
+@action("revenue")
+@action.uses(
+    profiler,
+    GridETag(
+        table_versions,
+        *RevenueReport.tablenames,
+        "district",
+        "category",
+        "shipper",
+        session=session,
+    ),
+    GridTemplate("revenue.html"),
+    session,
+    db,
+    read_only,
+)
+def revenue():
+    """
+    Revenue pivot: ?rows= and ?columns= pick the dimensions, ?first= and ?last= the months
+    (yyyy-mm), by default the 12 months up to the latest order
+    """
+    rows = request.query.get("rows", "district")
+    columns = request.query.get("columns", "month")
+    if rows not in DIMENSIONS or columns not in DIMENSIONS:
+        raise HTTP(400)
+
+    for name in ("first", "last"):
+        if request.query.get(name) and not parse_period(request.query.get(name)):
+            raise HTTP(400)
+    last = parse_period(request.query.get("last")) or revenue_report.last_period()
+    first = parse_period(request.query.get("first"))
+    if last and not first:
+        first = (last[0] - 1, last[1] + 1) if last[1] < 12 else (last[0], 1)
+        first = max(first, (datetime.MINYEAR, 1))
+    if last and first <= last and count_periods(first, last) > settings.REPORT_MAX_MONTHS:
+        raise HTTP(400)
+    if not last or first > last:
+        pivot = None
+    else:
+        pivot = revenue_report.pivot(rows, columns, first, last)
+
+    return dict(
+        pivot=pivot,
+        rows=rows,
+        columns=columns,
+        first="%04d-%02d" % first if first else "",
+        last="%04d-%02d" % last if last else "",
+        dimensions=DIMENSIONS,
+        label=label,
+        format_decimal=format_decimal,
+    )
@@ -0,0 +1,334 @@
+"""
+This file defines a generator filling the database with synthetic data at a chosen scale
+
+    from .fake_data import generate
+    generate(db, "100k")
+
+The scale is the number of order lines, the other tables are sized from it:
+about 2.75 lines per order, 8 orders per customer, one product per 1000 lines
+and a note for every 4th customer.  Values follow skewed distributions like
+real sales data: a few customers place most orders, a few products sell most,
+prices and freight are log-normal and most lines have no discount.
+
+Rows are written with executemany in batches, bypassing the DAL hooks, so the
+stored order subtotal/total are computed here.  Use it on a scratch database,
+see benchmark.py.
+"""
+
+import datetime
+import random
+import time
+
+SCALES = {
+    "10k": 10_000,
+    "100k": 100_000,
+    "1m": 1_000_000,
+    "10m": 10_000_000,
+}
+
+BATCH_SIZE = 10_000
+
+DISTRICTS = [
+    "North", "South", "East", "West", "Central", "Northeast",
+    "Northwest", "Southeast", "Southwest", "Coastal", "Mountain", "Metro",
+]
+SHIPPERS = ["Speedy Express", "United Package", "Federal Shipping"]
+CATEGORIES = [
+    "Beverages", "Condiments", "Confections", "Dairy Products",
+    "Grains/Cereals", "Meat/Poultry", "Produce", "Seafood",
+]
+TITLES = [
+    ("Owner", 17), ("Sales Representative", 17), ("Sales Manager", 11),
+    ("Marketing Manager", 6), ("Accounting Manager", 10), ("Sales Agent", 5),
+    ("Order Administrator", 2), ("Marketing Assistant", 3), ("President", 2),
+]
+# (country, weight, cities) - every country has a flag in static/images/flags
+COUNTRIES = [
+    ("USA", 24, ["Seattle", "Portland", "Boise", "Anchorage", "Albuquerque"]),
+    ("Germany", 15, ["Berlin", "Aachen", "Munich", "Frankfurt", "Cologne"]),
+    ("France", 12, ["Paris", "Lyon", "Marseille", "Nantes", "Lille"]),
+    ("Brazil", 9, ["Sao Paulo", "Rio de Janeiro", "Campinas", "Resende"]),
+    ("UK", 9, ["London", "Cowes", "Manchester", "Leeds"]),
+    ("Spain", 6, ["Madrid", "Barcelona", "Sevilla"]),
+    ("Mexico", 6, ["Mexico D.F.", "Guadalajara", "Monterrey"]),
+    ("Venezuela", 4, ["Caracas", "Barquisimeto", "San Cristobal"]),
+    ("Argentina", 3, ["Buenos Aires", "Cordoba"]),
+    ("Italy", 3, ["Torino", "Bergamo", "Reggio Emilia"]),
+    ("Canada", 3, ["Montreal", "Vancouver", "Tsawassen"]),
+    ("Austria", 2, ["Graz", "Salzburg"]),
+    ("Belgium", 2, ["Bruxelles", "Charleroi"]),
+    ("Portugal", 2, ["Lisboa", "Porto"]),
+    ("Sweden", 2, ["Lulea", "Bracke"]),
+    ("Switzerland", 2, ["Bern", "Geneve"]),
+    ("Denmark", 2, ["Kobenhavn", "Arhus"]),
+    ("Finland", 2, ["Helsinki", "Oulu"]),
+    ("Ireland", 1, ["Cork", "Dublin"]),
+    ("Norway", 1, ["Stavern", "Oslo"]),
+    ("Poland", 1, ["Warszawa", "Krakow"]),
+]
+FIRST_NAMES = [
+    "Maria", "Ana", "Antonio", "Thomas", "Christina", "Hanna", "Frederique",
+    "Martin", "Laurence", "Elizabeth", "Victoria", "Patricio", "Francisco",
+    "Yang", "Pedro", "Aria", "Diego", "Peter", "Carine", "Paolo", "Lino",
+    "Eduardo", "Jose", "Andre", "Howard", "Manuel", "Mario", "Yoshi", "Jaime",
+    "Fran", "Rita", "Pirkko", "Paula", "Karl", "Helvetius", "Jonas", "Liz",
+]
+LAST_NAMES = [
+    "Anders", "Trujillo", "Moreno", "Hardy", "Berglund", "Moos", "Citeaux",
+    "Sommer", "Lebihan", "Lincoln", "Ashworth", "Simpson", "Chang", "Afonso",
+    "Cruz", "Roel", "Pontes", "Franken", "Schmitt", "Accorti", "Rodriguez",
+    "Saavedra", "Fonseca", "Fresniere", "Snyder", "Pereira", "Latimer",
+    "Wilson", "Muller", "Koskitalo", "Nagy", "Ottlieb", "Devon", "Crowther",
+]
+COMPANY_WORDS = [
+    "Alfreds", "Blauer", "Bottom", "Cactus", "Centro", "Chop", "Comercio",
+    "Consolidated", "Drachenblut", "Du monde", "Eastern", "Ernst", "Familia",
+    "Folies", "Frankenversand", "Galeria", "Godos", "Great Lakes", "Hanari",
+    "Hungry", "Island", "Königlich", "La maison", "Lazy K", "Magazzini",
+    "Maison", "North/South", "Old World", "Piccolo", "Queen", "Rattlesnake",
+    "Save-a-lot", "Simons", "Split Rail", "Suprêmes", "Tortuga", "Vaffeljernet",
+]
+COMPANY_SUFFIXES = [
+    "Trading", "Markets", "Delicatessen", "Imports", "Foods", "Bistro",
+    "Store", "Canyon Grocery", "Gourmet", "Comidas", "Supermarket", "& Co.",
+]
+PRODUCT_WORDS = [
+    "Chai", "Chang", "Aniseed", "Cajun", "Gumbo", "Boysenberry", "Pears",
+    "Cranberry", "Kobe", "Ikura", "Queso", "Konbu", "Tofu", "Pavlova",
+    "Carnarvon", "Scones", "Sirop", "Tarte", "Gravad", "Chocolade",
+    "Maxilaku", "Valkoinen", "Manjimup", "Filo", "Perth", "Gnocchi",
+    "Ravioli", "Escargots", "Raclette", "Camembert", "Sasquatch", "Steeleye",
+]
+PRODUCT_KINDS = [
+    "Syrup", "Seasoning", "Spread", "Sauce", "Ale", "Lager", "Cheese",
+    "Crab Meat", "Biscuits", "Chocolate", "Mix", "Pasties", "Coffee", "Tea",
+]
+UNITS = ["10 boxes x 20 bags", "24 - 12 oz bottles", "12 - 550 ml bottles",
+         "48 - 6 oz jars", "36 boxes", "12 - 1 lb pkgs.", "500 g", "1 kg pkg."]
+DISCOUNTS = [5, 10, 15, 20, 25]
+
+
+def generate(db, scale="10k", seed=1, log=print):
+    """
+    Fill the tables with synthetic rows, the tables must be empty
+
+    Parameters
+    ----------
+    db: the DAL of the app
+    scale: one of SCALES or a number of order lines
+    seed: seed of the random generator, the same seed gives the same data
+    log: function receiving progress messages
+
+    Returns
+    -------
+    dict with the number of rows inserted in each table
+    """
+    lines = SCALES.get(str(scale).lower()) or int(scale)
+    if not db(db.customer).isempty() or not db(db.order).isempty():
+        raise RuntimeError("fake_data.generate needs an empty database")
+
+    rng = random.Random(seed)
+    orders = max(1, int(lines / 2.75))
+    customers = max(100, orders // 8)
+    products = max(50, lines // 1000)
+    counts = dict()
+    started = time.time()
+
+    def insert(table, fieldnames, batch):
+        """Insert rows - tuples in fieldnames order - with one executemany"""
+        sql = "INSERT INTO %s (%s) VALUES (%s);" % (
+            table._rname,
+            ", ".join(table[name]._rname for name in fieldnames),
+            ", ".join("?" for _ in fieldnames),
+        )
+        db._adapter.cursor.executemany(sql, batch)
+        counts[table._tablename] = counts.get(table._tablename, 0) + len(batch)
+
+    def load(table, fieldnames, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == BATCH_SIZE:
+                insert(table, fieldnames, batch)
+                db.commit()
+                batch = []
+        insert(table, fieldnames, batch)
+        db.commit()
+        log(
+            "%s: %s rows (%.0fs)"
+            % (table, counts[table._tablename], time.time() - started)
+        )
+
+    load(db.district, ["id", "name"], enumerate(DISTRICTS, 1))
+    load(db.shipper, ["id", "name"], enumerate(SHIPPERS, 1))
+    load(
+        db.category,
+        ["id", "name", "description"],
+        ((i, name, "%s and more" % name) for i, name in enumerate(CATEGORIES, 1)),
+    )
+
+    country_weights = [weight for _, weight, _ in COUNTRIES]
+    title_names = [title for title, _ in TITLES]
+    title_weights = [weight for _, weight in TITLES]
+    # district sizes are skewed too, the first districts are the big ones
+    district_ids = range(1, len(DISTRICTS) + 1)
+    district_weights = [1 / i for i in district_ids]
+
+    def customer_rows():
+        for i in range(1, customers + 1):
+            country, _, cities = rng.choices(COUNTRIES, country_weights)[0]
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            company = "%s %s" % (rng.choice(COMPANY_WORDS), rng.choice(COMPANY_SUFFIXES))
+            yield (
+                i,
+                ("%s %s" % (company, i))[:40],
+                "%s %s" % (first, last),
+                rng.choices(title_names, title_weights)[0],
+                "%s %s St." % (rng.randint(1, 9999), rng.choice(LAST_NAMES)),
+                rng.choice(cities),
+                "%05d" % rng.randint(1000, 99999),
+                country,
+                "(%03d) %03d-%04d"
+                % (rng.randint(100, 999), rng.randint(100, 999), rng.randint(0, 9999)),
+                "%s.%s%s@example.com" % (first.lower(), last.lower(), i),
+                rng.choices(district_ids, district_weights)[0],
+            )
+
+    load(
+        db.customer,
+        [
+            "id",
+            "name",
+            "contact",
+            "title",
+            "address",
+            "city",
+            "postal_code",
+            "country",
+            "phone",
+            "email",
+            "district",
+        ],
+        customer_rows(),
+    )
+
+    prices = dict()  # product id -> unit price in cents
+
+    def product_rows():
+        for i in range(1, products + 1):
+            prices[i] = max(100, int(rng.lognormvariate(3, 0.9) * 100))
+            name = "%s %s %s" % (rng.choice(PRODUCT_WORDS), rng.choice(PRODUCT_KINDS), i)
+            yield (
+                i,
+                name[:40],
+                rng.randint(1, len(CATEGORIES)),
+                rng.choice(UNITS),
+                prices[i] / 100,
+                int(rng.expovariate(1 / 40)),
+                rng.choice([0, 0, 0, 10, 20, 40]),
+                rng.choice([0, 5, 10, 15, 20, 25, 30]),
+                "T" if rng.random() < 0.08 else "F",  # pydal booleans on SQLite
+            )
+
+    load(
+        db.product,
+        [
+            "id",
+            "name",
+            "category",
+            "quantity_per_unit",
+            "unit_price",
+            "in_stock",
+            "on_order",
+            "reorder_level",
+            "discontinued",
+        ],
+        product_rows(),
+    )
+
+    # orders and their lines are generated together so the totals can be stored
+    order_fields = [
+        "id",
+        "customer",
+        "order_date",
+        "required_date",
+        "shipped_date",
+        "shipper",
+        "freight",
+        "ship_to_name",
+        "ship_to_city",
+        "subtotal",
+        "total",
+    ]
+    line_fields = ["id", "order", "product", "unit_price", "quantity", "discount"]
+    first_day = datetime.date(2019, 1, 1)
+    days = 6 * 365
+    order_batch, line_batch = [], []
+    line_id = 0
+    for i in range(1, orders + 1):
+        # a few customers place most orders, a few products make most lines
+        customer = 1 + int(customers * rng.random() ** 2)
+        order_date = first_day + datetime.timedelta(days=days * i // orders)
+        required_date = order_date + datetime.timedelta(days=rng.choice((14, 28, 42)))
+        shipped_date = None
+        if rng.random() > 0.03:
+            shipped_date = order_date + datetime.timedelta(days=rng.randint(1, 10))
+            shipped_date = shipped_date.isoformat()
+        freight = int(rng.lognormvariate(3, 1) * 100)
+        subtotal = 0
+        for _ in range(rng.choices((1, 2, 3, 4, 5, 6), (25, 25, 20, 15, 10, 5))[0]):
+            line_id += 1
+            product = 1 + int(products * rng.random() ** 3)
+            quantity = min(120, 1 + int(rng.expovariate(1 / 12)))
+            discount = 0 if rng.random() < 0.8 else rng.choice(DISCOUNTS)
+            subtotal += prices[product] * quantity
+            line_batch.append(
+                (line_id, i, product, prices[product] / 100, quantity, discount / 100)
+            )
+        order_batch.append(
+            (
+                i,
+                customer,
+                order_date.isoformat(),
+                required_date.isoformat(),
+                shipped_date,
+                rng.randint(1, len(SHIPPERS)),
+                freight / 100,
+                "Customer %s" % customer,
+                rng.choice(COUNTRIES[0][2]),
+                subtotal / 100,
+                (subtotal + freight) / 100,
+            )
+        )
+        if len(order_batch) == BATCH_SIZE or i == orders:
+            insert(db.order, order_fields, order_batch)
+            insert(db.order_detail, line_fields, line_batch)
+            db.commit()
+            order_batch, line_batch = [], []
+    log(
+        "order: %s rows, order_detail: %s rows (%.0fs)"
+        % (counts["order"], counts["order_detail"], time.time() - started)
+    )
+
+    notes = [
+        "Called about a late delivery",
+        "Asked for a catalog",
+        "Prefers email",
+        "New buyer",
+        "Credit limit reviewed",
+    ]
+
+    def note_rows():
+        for i in range(1, customers // 4 + 1):
+            timestamp = datetime.datetime(2019, 1, 1) + datetime.timedelta(
+                minutes=rng.randint(0, days * 24 * 60)
+            )
+            yield (
+                i,
+                1 + int(customers * rng.random()),
+                timestamp.isoformat(" "),
+                rng.choice(notes),
+            )
+
+    load(db.customer_note, ["id", "customer", "timestamp", "note"], note_rows())
+    return counts
@@ -0,0 +1,67 @@
+"""
+This file defines the formatters of the date and decimal values shown in the grids
+
+    Field("order_date", "date", represent=format_date)
+    Field("freight", "decimal(11,2)", represent=format_decimal)
+
+They run for every cell, so they only accept what the database hands back - date
+and datetime objects, Decimals - and the ISO strings SQLite stores, without
+guessing formats like a generic date parser does.  Anything else renders as "".
+The signature is the one of a pydal represent: (value, row).
+"""
+
+import datetime
+from decimal import Decimal, ROUND_HALF_UP, InvalidOperation
+
+CENTS = Decimal("0.01")
+
+
+def _iso_date(value):
+    """(year, month, day) strings of an ISO "yyyy-mm-dd..." string, or None"""
+    if len(value) >= 10 and value[4] == "-" and value[7] == "-":
+        year, month, day = value[0:4], value[5:7], value[8:10]
+        if year.isdigit() and month.isdigit() and day.isdigit():
+            return year, month, day
+    return None
+
+
+def format_date(value, row=None):
+    """mm/dd/yyyy"""
+    if isinstance(value, datetime.date):
+        return "%02d/%02d/%04d" % (value.month, value.day, value.year)
+    if isinstance(value, str):
+        parts = _iso_date(value)
+        if parts:
+            return "%s/%s/%s" % (parts[1], parts[2], parts[0])
+    return ""
+
+
+def format_datetime(value, row=None):
+    """mm/dd/yyyy hh:mm"""
+    if isinstance(value, datetime.datetime):
+        return "%02d/%02d/%04d %02d:%02d" % (
+            value.month,
+            value.day,
+            value.year,
+            value.hour,
+            value.minute,
+        )
+    if isinstance(value, str):
+        parts = _iso_date(value)
+        if parts:
+            # "yyyy-mm-dd hh:mm..." or "yyyy-mm-ddThh:mm..."
+            time = value[11:16] if len(value) >= 16 and value[13] == ":" else "00:00"
+            return "%s/%s/%s %s" % (parts[1], parts[2], parts[0], time)
+    return format_date(value)
+
+
+def format_decimal(value, row=None):
+    """The value rounded half up to 2 decimals, "1234.50" """
+    if value is None:
+        return ""
+    if not isinstance(value, Decimal):
+        try:
+            value = Decimal(str(value))
+        except InvalidOperation:
+            return ""
+    return str(value.quantize(CENTS, rounding=ROUND_HALF_UP))
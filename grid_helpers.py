@@ -1,24 +1,53 @@
 import base64
+import csv
+import hashlib
+import io
+import json
+import os
+import threading
 from functools import reduce
-from urllib.parse import unquote_plus
+from urllib.parse import quote, unquote_plus
 
-from py4web import request, Field, response
-from py4web.utils.form import Form, FormStyleBulma
+from py4web import request, Field, response, URL, HTTP
+from py4web.core import Fixture, Template
+from py4web.utils.form import Form, FormStyleBulma, join_classes, to_id
+from py4web.utils.grid import (
+    Column,
+    Grid,
+    make_default_search_query,
+    maybe_call,
+    safe_int,
+    strip_field_type,
+)
+from pydal.objects import Expression, FieldVirtual
 
 from yatl.helpers import (
     TAG,
+    XML,
+    escape,
+    is_helper,
+    A,
+    DIV,
+    INPUT,
+    SPAN,
+    TD,
+    TR,
 )
 
 BUTTON = TAG.button
 
 
 class GridSearchQuery:
-    def __init__(self, name, query, requires=None, datatype="str", default=None):
+    def __init__(
+        self, name, query, requires=None, datatype="str", default=None, orderby=None
+    ):
         self.name = name
         self.query = query
         self.requires = requires
         self.datatype = datatype
         self.default = default
+        #  orderby to use while this search is active - e.g. the rank of a fulltext_query
+        self.orderby = orderby
 
         self.field_name = name.replace(" ", "_").lower()
 
@@ -137,26 +166,92 @@ class GridSearch:
         if not self.queries:
             self.queries = []
 
+        self.orderby = None
         for sq in self.search_queries:
             field_name = "sq_" + sq.name.replace(" ", "_").replace("/", "_").lower()
             if field_name in field_values and field_values[field_name]:
                 self.queries.append(sq.query(field_values[field_name]))
             elif field_name in field_default and field_default[field_name]:
                 self.queries.append(sq.query(field_default[field_name]))
+            else:
+                continue
+            if sq.orderby and self.orderby is None:
+                self.orderby = sq.orderby
 
         self.query = reduce(lambda a, b: (a & b), self.queries)
 
 
+def text_query(table, value, columns, fulltext=False):
+    """
+    Build the query of a text search on some columns of table
+
+    By default each column is matched with .contains(value), a LIKE '%value%'
+    substring match.  With fulltext=True the words of value are matched as prefixes
+    through the FTS5 index of the table instead, see fulltext_query - only pass it
+    when the index exists.
+
+    Parameters
+    ----------
+    table: the searched table
+    value: the text entered by the user
+    columns: the names of the fields to search, a row matching any of them is found
+    fulltext: search through the FTS5 index of table
+    """
+    if fulltext:
+        return fulltext_query(table, value, columns)
+    return reduce(lambda a, b: a | b, [table[name].contains(value) for name in columns])
+
+
+def fulltext_query(table, value, columns=None):
+    """
+    Build a query matching the rows of table through its FTS5 index (see schema.ensure_fulltext)
+
+    Every word of value is matched as a prefix, so "jo sm" finds "John Smith".
+    While the query is applied the rank of the match can be used as orderby, e.g.
+    GridSearchQuery("Search", lambda value: fulltext_query(db.customer, value),
+                    orderby=db.customer_fts.rank)
+
+    Parameters
+    ----------
+    table: the indexed table
+    value: the text entered by the user
+    columns: optional list of indexed field names to restrict the match to
+
+    Returns
+    -------
+    a pydal query joining table with its fulltext index
+    """
+    db = table._db
+    fts = db[table._tablename + "_fts"]
+    words = value.split()
+    if not words:
+        return table._id > 0
+
+    match = " AND ".join('"%s"*' % word.replace('"', '""') for word in words)
+    if columns:
+        match = "{%s} : (%s)" % (" ".join(columns), match)
+    return (fts._id == table._id) & (
+        "%s MATCH %s" % (fts._rname, db._adapter.adapt(match))
+    )
+
+
 def apply_htmx_attrs(grid, target):
     myattrs = {"_hx-post": request.url, "_hx-target": target, "_hx-swap": "innerHTML"}
 
+    def link_attrs(attrs):
+        # links get their own url, so the page, sort and cursor they carry reach the
+        # action and the browser can revalidate the fragment with its ETag (GridETag)
+        attrs.update(myattrs)
+        del attrs["_hx-post"]
+        attrs["_hx-get"] = attrs.get("_href", request.url)
+
     grid.attributes_plugin["form"] = lambda attrs: attrs.update(myattrs)
-    grid.attributes_plugin["link"] = lambda attrs: attrs.update(myattrs)
+    grid.attributes_plugin["link"] = link_attrs
     grid.attributes_plugin["search_form"] = lambda attrs: attrs.update(myattrs)
-    grid.attributes_plugin["button_sort_up"] = lambda attrs: attrs.update(myattrs)
-    grid.attributes_plugin["button_sort_down"] = lambda attrs: attrs.update(myattrs)
+    grid.attributes_plugin["button_sort_up"] = link_attrs
+    grid.attributes_plugin["button_sort_down"] = link_attrs
     grid.attributes_plugin["button_delete"] = lambda attrs: attrs.update(myattrs)
-    grid.attributes_plugin["button_page_number"] = lambda attrs: attrs.update(myattrs)
+    grid.attributes_plugin["button_page_number"] = link_attrs
 
 
 def get_referrer(r, default):
@@ -201,3 +296,945 @@ def enable_htmx_grid(htmx_grid, target, default_referrer, after_swap=None):
             response.headers["HX-Trigger-After-Swap"] = after_swap
 
     htmx_grid.process()
+
+
+class GridETag(Fixture):
+    """
+    Fixture answering 304 Not Modified when the browser already has the grid page
+
+        @action.uses(profiler, GridETag(table_versions, "customer", session=session), "grid.html", session, db)
+
+    The ETag is built from the versions of the tables the grid reads, the url, the
+    session and user of the request and the htmx headers, so full pages and htmx
+    fragments get their own tags.  The versions are the ones stored in the database
+    (TableVersions(db), see TableVersions.stored), so a write done by any process
+    changes the tag.  A request whose If-None-Match matches is answered before the
+    query runs and the template renders.  Only GET requests showing rows (select
+    and details modes) are tagged, list it before the template and the other
+    fixtures, the db and session it needs run before it.
+
+    Parameters
+    ----------
+    versions: the TableVersions tracking tablenames, with a db
+    tablenames: the tables the grid reads from
+    session: the session fixture of the action
+    """
+
+    def __init__(self, versions, *tablenames, session):
+        self.versions = versions
+        self.tablenames = tablenames
+        self.session = session
+        self.__prerequisites__ = [versions.db, session]
+
+    def etag(self):
+        user = self.session.get("user") or {}
+        key = json.dumps(
+            [
+                self.versions.stored(*self.tablenames),
+                request.fullpath,
+                request.query_string,
+                self.session.get("uuid"),
+                user.get("id"),
+                request.headers.get("HX-Request", ""),
+                request.headers.get("HX-Target", ""),
+            ]
+        )
+        return '"%s"' % hashlib.sha1(key.encode("utf8")).hexdigest()
+
+    def on_request(self, context):
+        if request.method not in ("GET", "HEAD"):
+            return
+        if Grid.parse(request.query)["mode"] not in ("select", "details"):
+            return
+
+        etag = self.etag()
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "private, no-cache"
+        response.headers["Vary"] = "Cookie, HX-Request, HX-Target"
+        if_none_match = request.headers.get("If-None-Match", "")
+        if etag in [tag.strip() for tag in if_none_match.split(",")]:
+            raise HTTP(304)
+
+
+def is_htmx_request():
+    """True for requests made by htmx to swap part of the page (not boosted page loads)"""
+    return (
+        request.headers.get("HX-Request") == "true"
+        and request.headers.get("HX-Boosted") != "true"
+    )
+
+
+class GridTemplate(Template):
+    """
+    Template fixture rendering only the grid when htmx asks for it
+
+        @action.uses(profiler, GridTemplate("grid.html"), session, db)
+
+    Page loads render filename, which extends layout.html.  htmx requests render
+    fragment instead - by default filename with a _fragment suffix - a template
+    holding just the grid, that filename includes.  The swap then skips the
+    layout, navbar and assets and only the grid html goes over the wire.
+    """
+
+    def __init__(self, filename, fragment=None, **kwargs):
+        super().__init__(filename, **kwargs)
+        if fragment is None:
+            name, _, extension = filename.rpartition(".")
+            fragment = "%s_fragment.%s" % (name, extension)
+        self.fragment = Template(fragment, **kwargs)
+
+    def on_success(self, context):
+        if is_htmx_request():
+            self.fragment.on_success(context)
+        else:
+            super().on_success(context)
+
+
+def memoize_represent(represent, required_fields, size=4096):
+    """
+    Cache the output of a column represent by the values of its required fields
+
+    A represent building XML from a few fields gives the same output for every row
+    with the same values - e.g. a flag for each country.  The wrapped represent
+    only runs once per distinct values, later rows get the stored output.  Only
+    wrap represents that depend on nothing but required_fields.
+
+        Column("flag", represent=memoize_represent(flag, [db.customer.country]), ...)
+
+    Parameters
+    ----------
+    represent: function(row) returning the cell content
+    required_fields: the fields the output depends on
+    size: number of outputs kept, the cache starts over when it is full
+    """
+    names = [str(field) for field in required_fields]
+    outputs = dict()
+    lock = threading.Lock()
+
+    def memoized(row):
+        key = tuple(row[name] for name in names)
+        output = outputs.get(key)
+        if output is None:
+            output = represent(row)
+            with lock:
+                if len(outputs) >= size:
+                    outputs.clear()
+                outputs[key] = output
+        return output
+
+    return memoized
+
+
+def cached_helper(build, *names):
+    """
+    Render a helper once and reuse its html with other values
+
+    Building a tree of helpers for each row and serializing it costs far more than
+    pasting a few values into html rendered once.  build is called the first time
+    with a marker for each name, and its html is cut around the markers.  Calls
+    then join the pieces with the escaped values.
+
+        reorder = cached_helper(lambda id, name: A("Reorder", _href=URL(f"reorder/{id}"),
+                                                   _title=f"Reorder {name}"), "id", "name")
+        reorder(id=row.id, name=row.name)  # -> XML
+
+    The values must only be used as they are - as text or in attributes - by build,
+    not looked at or transformed.
+    """
+    pieces = []
+
+    def render(**values):
+        if not pieces:
+            markers = {name: _MARKER % name for name in names}
+            html = build(**markers).xml()
+            parts = [html]
+            for name in names:
+                parts = [p for part in parts for p in _split_marker(part, name)]
+            pieces.extend(parts)
+        return XML(
+            "".join(
+                escape(str(values[part[0]])) if isinstance(part, tuple) else part
+                for part in pieces
+            )
+        )
+
+    return render
+
+
+# stands for a value in the html of a cached_helper, made of characters URL() and escape() keep
+_MARKER = "__cached_helper_%s__"
+
+
+def _split_marker(part, name):
+    """Split html around the marker of name, markers become (name,) tuples"""
+    if isinstance(part, tuple):
+        return [part]
+    chunks = part.split(_MARKER % name)
+    result = [chunks[0]]
+    for chunk in chunks[1:]:
+        result += [(name,), chunk]
+    return result
+
+
+class StaticURLs:
+    """
+    The URLs of the files of a static folder, built once when the app loads
+
+        flags = StaticURLs("images/flags", ".png")
+        flags.get("france")  # -> "/grid_tutorial/static/images/flags/france.png"
+        flags.get("atlantis")  # -> None, there is no such file
+
+    The folder is listed and every URL built at startup, as URL() builds them for
+    the app served under its name.  Lookups are then a dict access, instead of a
+    URL() call and a string build per row.
+
+    Parameters
+    ----------
+    folder: the folder, relative to the static folder of the app
+    extension: only the files with this extension, looked up by name without it
+    prefix: the URL of the static folder, to give when the app is served behind a
+        SCRIPT_NAME, a PY4WEB_URL_PREFIX, a domain of its own or with a static version
+    """
+
+    def __init__(self, folder, extension="", prefix=None):
+        app_folder = os.path.dirname(__file__)
+        if prefix is None:
+            prefix = "/%s/static" % os.path.basename(app_folder)
+        self.urls = dict()
+        for filename in sorted(os.listdir(os.path.join(app_folder, "static", folder))):
+            key, file_extension = os.path.splitext(filename)
+            if not extension or file_extension == extension:
+                self.urls[key] = "%s/%s/%s" % (prefix, folder, quote(filename))
+
+    def get(self, name, default=None):
+        return self.urls.get(name, default)
+
+
+class AutocompleteWidget:
+    """
+    Form widget for reference fields that loads matching rows as the user types
+
+    Rendering every row of a large referenced table in a <select> makes forms huge,
+    this widget only renders the current value and asks the autocomplete action for
+    matches by name prefix.  The selected id is posted in a hidden input so the
+    IS_IN_DB validator on the field still checks it server side.
+
+    Usage:  Field("customer", "reference customer", widget=AutocompleteWidget(db.customer.name))
+    """
+
+    # tablename -> label field of every table that can be looked up by the autocomplete action
+    lookups = dict()
+
+    def __init__(self, label_field, path="autocomplete"):
+        self.label_field = label_field
+        self.path = path
+        AutocompleteWidget.lookups[label_field.tablename] = label_field
+
+    def __call__(self, table, vars):
+        field = next(f for f in table if f.widget is self)
+        if field.name in vars:
+            value = vars.get(field.name)
+        else:
+            # a new record, like the other widgets of the form
+            value = field.default() if callable(field.default) else field.default
+        label = ""
+        if value:
+            record = self.label_field.table(value)
+            label = record[self.label_field.name] if record else ""
+
+        return DIV(
+            INPUT(
+                _type="hidden",
+                _id=to_id(field),
+                _name=field.name,
+                _value="" if value is None else value,
+            ),
+            DIV(
+                INPUT(
+                    _type="text",
+                    _class="input",
+                    _value=label,
+                    _autocomplete="off",
+                    _placeholder="Type to search...",
+                ),
+                _class="dropdown-trigger",
+            ),
+            DIV(DIV(_class="dropdown-content"), _class="dropdown-menu"),
+            _class="dropdown autocomplete",
+            _style="display: block",
+            **{"_data-autocomplete": URL(self.path, self.label_field.tablename)},
+        )
+
+
+class ExportColumn(Column):
+    """
+    Column exported by KeysetGrid.export as one value computed from the row,
+    instead of the raw values of its required fields
+
+        ExportColumn("district", represent=..., export=lambda row: districts.label(...))
+
+    Parameters
+    ----------
+    export: function of the row giving the exported value, e.g. a name for an id
+    args, kwargs: the Column parameters
+    """
+
+    def __init__(self, *args, export=None, **kwargs):
+        self.export = export
+        super().__init__(*args, **kwargs)
+
+
+# the py4web release KeysetGrid was written against: it overrides and copies Grid
+# methods that are not public API, tests/test_keyset.py fails when they change
+PY4WEB_VERSION = "1.20260805.0"
+
+
+class KeysetGrid(Grid):
+    """
+    Grid paging with keyset (seek) pagination instead of LIMIT/OFFSET, cached counts and pages
+
+    Usage:  grid = KeysetGrid(db.customer, orderby=db.customer.name, ...)
+    """
+
+    def __init__(
+        self,
+        *args,
+        count_cache=None,
+        count_limit=None,
+        page_cache=None,
+        page_cache_key=None,
+        **kwargs,
+    ):
+        """
+        Parameters
+        ----------
+        count_cache: optional pydal (cache_model, expiration) tuple used to cache the row count
+        count_limit: optional number of rows after which the count is not exact anymore
+        page_cache: optional pydal (cache_model, expiration) tuple used to cache the
+            rows and html of the GET select pages
+        page_cache_key: what else the page depends on, added to the page cache key,
+            required to cache the pages of a grid with per-user buttons (see _per_user)
+        args, kwargs: the Grid parameters
+        """
+        # element name -> function updating the attributes of that element, see apply_htmx_attrs
+        self.attributes_plugin = dict()
+        self.count_cache = count_cache
+        self.count_limit = count_limit
+        self.count_exact = True  # False when the count stopped at count_limit
+        self.has_more = False  # when the count is not exact, whether there is a next page
+        self.page_keys = None  # sort key of the first and last row of the page
+        self.page_order_key = None
+        self.page_cache = page_cache
+        self.page_cache_key = page_cache_key
+        self.cached_html = None  # html of the page when it came from the page cache
+        super().__init__(*args, **kwargs)
+
+    def process(self):
+        if (
+            not self.page_cache
+            or (self.page_cache_key is None and self._per_user())
+            or request.method != "GET"
+            or Grid.parse(request.query)["mode"] != "select"
+        ):
+            return super().process()
+
+        key = json.dumps(
+            [
+                request.path,
+                str(self.query),
+                str(self.param.left),
+                str(self.param.orderby),
+                sorted(request.query.items()),
+                self.page_cache_key,
+            ],
+            default=str,
+        )
+        cache_model, expiration = self.page_cache
+        page = cache_model("grid-page:" + key, self._process_page, expiration)
+        self.__dict__.update(page["state"])
+        self.rows = page["rows"]
+        self.cached_html = page["html"]
+
+    def _per_user(self):
+        """Whether the buttons of the page may depend on the user, see page_cache"""
+        param = self.param
+        permissions = [param.create, param.details, param.editable, param.deletable]
+        elements = list(param.header_elements or []) + list(param.footer_elements or [])
+        return bool(
+            any(callable(permission) for permission in permissions)
+            or param.pre_action_buttons
+            or param.post_action_buttons
+            or any(callable(element) for element in elements)
+        )
+
+    def _process_page(self):
+        super().process()
+        return dict(
+            rows=self.rows,
+            html=super().render().xml(),
+            state={name: getattr(self, name) for name in _PAGE_STATE},
+        )
+
+    def render(self):
+        if self.cached_html is not None:
+            return XML(self.cached_html)
+        return super().render()
+
+    def _make_table_body(self):
+        """
+        Grid._make_table_body rendering the cells of the page in one pass, column by
+        column and straight to html: no TR and TD helpers are built per cell, and the
+        td tag of a column is built once unless its class depends on the row
+        """
+        rows = self.rows
+        tr = TR(_role="row", _class=self.get_style("grid-tr")).xml()[: -len("</tr>")]
+        cells = [[tr] for _ in rows]
+        for column in self.columns:
+            if callable(column.td_class_style):
+                tds = [self._td_tag(column, row) for row in rows]
+            else:
+                tds = [self._td_tag(column, None)] * len(rows)
+            for row_cells, td, row in zip(cells, tds, rows):
+                value = column.represent(row)
+                row_cells.append(td)
+                row_cells.append(value.xml() if is_helper(value) else escape(value))
+                row_cells.append("</td>")
+        body = "".join("".join(row_cells) + "</tr>" for row_cells in cells)
+        return XML("<tbody>%s</tbody>" % body)
+
+    def _td_tag(self, column, row):
+        """The opening td tag of the cell of column, as built by Grid._make_table_body"""
+        classes = join_classes(
+            [
+                self.get_style(maybe_call(column.td_class_style, row), "grid-td"),
+                f"grid-cell-{column.key}",
+            ]
+        )
+        return TD(_class=classes).xml()[: -len("</td>")]
+
+    def _handle_mode_select(self):
+        """
+        Grid._handle_mode_select, counting with _count_rows and selecting with _select_page
+        """
+        db = self.db
+        query, select_params = self._select_arguments()
+
+        # join the set of all required fields
+        sets = [set(self.param.required_fields or [])]
+        sets += [set(col.required_fields) for col in self.columns]
+        self.needed_fields = list(
+            reduce(lambda a, b: a | b, sets) | set([self.table._id])
+        )
+
+        self.this_url = base64.b16encode(request.url.encode("utf8")).decode("utf8")
+        self.current_page_number = safe_int(request.query.get("page"), default=1)
+
+        self.total_number_of_rows = self._count_rows(
+            db(query), self.param.left, self.param.groupby
+        )
+
+        # a filter leaving fewer rows than the page starts at goes back to page 1
+        if (
+            self.current_page_number - 1
+        ) * self.param.rows_per_page > self.total_number_of_rows:
+            self.current_page_number = 1
+
+        if self.total_number_of_rows > self.param.rows_per_page:
+            self.page_start = self.param.rows_per_page * (self.current_page_number - 1)
+            self.page_end = self.page_start + self.param.rows_per_page
+            select_params["limitby"] = (self.page_start, self.page_end)
+        else:
+            self.page_start = 1 if self.total_number_of_rows > 1 else 0
+            self.page_end = self.total_number_of_rows
+
+        self.rows = self._select_page(db(query), self.needed_fields, select_params)
+
+        self.number_of_pages = self.total_number_of_rows // self.param.rows_per_page
+        if self.total_number_of_rows % self.param.rows_per_page > 0:
+            self.number_of_pages += 1
+
+        if (
+            self.param.pre_action_buttons
+            or self.param.details
+            or self.param.editable
+            or self.param.deletable
+            or self.param.post_action_buttons
+        ):
+            self.columns.append(
+                Column(
+                    "",
+                    self.make_action_buttons,
+                    key=f"column-{len(self.columns)}",
+                    td_class_style=self.get_style("grid-td-buttons"),
+                )
+            )
+
+        # sorting or searching starts again from the first page
+        self.query_parms = {
+            k: v for k, v in dict(self.query_parms).items() if k not in ("page", "cursor")
+        }
+
+    def _select_arguments(self):
+        """
+        The grid query with the search of the request applied, and the orderby, left
+        and groupby of its select - the columns are made on the way
+        """
+        db = self.db
+        query = self._search_query()
+        self._make_columns()
+
+        select_params = dict(orderby=self.param.orderby)
+        sort_order = request.query.get("orderby")
+        if sort_order:
+            parts = sort_order.lstrip("~").split(".")
+            if len(parts) == 2 and parts[0] in db.tables and parts[1] in db[parts[0]]:
+                orderby = db[parts[0]][parts[1]]
+                select_params["orderby"] = ~orderby if sort_order.startswith("~") else orderby
+        if self.param.left:
+            select_params["left"] = self.param.left
+        if self.param.groupby:
+            select_params["groupby"] = self.param.groupby
+        return query, select_params
+
+    def _search_query(self):
+        """The grid query and the search_queries search of the request, as Grid does"""
+        query = self.query
+        if self.param.search_queries == "auto":
+            self.param.search_queries = [make_default_search_query(self.table)]
+        if not self.param.search_form and self.param.search_queries:
+            search_type = safe_int(request.query.get("search_type", 0), default=0)
+            search_string = request.query.get("search_string")
+            if search_type < len(self.param.search_queries) and search_string:
+                parts = self.param.search_queries[search_type]
+                if len(parts) == 3 and parts[2]:
+                    search_string, self.search_query_error = parts[2](search_string)
+                if not self.search_query_error:
+                    try:
+                        query = self.query & parts[1](search_string)
+                    except Exception as e:
+                        self.search_query_error = str(e)
+        return query
+
+    def _make_columns(self):
+        """Turn the columns parameter into Column objects, as Grid does"""
+        if not self.param.columns:
+            self.param.columns = [field for field in self.table if field.readable]
+        self.columns = []
+        for index, col in enumerate(self.param.columns):
+            if isinstance(col, Column):
+                if not col.key:
+                    col.key = f"column-{index}"
+                self.columns.append(col)
+            elif isinstance(col, Field):
+                type_name = strip_field_type(col.type)
+                if type_name == "upload" and hasattr(col, "download_url"):
+                    represent = lambda row, name=str(col), f=col.download_url: (
+                        row[name] and A("download", _href=f(row[name])) or ""
+                    )
+                elif col.represent:
+                    represent = lambda row, name=str(col), f=col.represent: f(
+                        row[name], row
+                    )
+                elif type_name in self.represent_by_type:
+                    represent = lambda row, col=col, f=self.represent_by_type[
+                        col.type_name
+                    ]: f(col, row[str(col)])
+                else:
+                    represent = lambda row, name=str(col): row[name]
+                self.columns.append(
+                    Column(
+                        col.label,
+                        represent,
+                        orderby=col,
+                        required_fields=[col],
+                        key=str(col).lower().replace(".", "-"),
+                        col_type=type_name,
+                    )
+                )
+            elif isinstance(col, FieldVirtual):
+                self.columns.append(
+                    Column(
+                        col.label,
+                        lambda row, col=col: (
+                            col.f(row) if "id" in row else col.f(row[col.tablename])
+                        ),
+                        orderby=None,
+                        required_fields=self.db[col.tablename],
+                        key=str(col).lower().replace(".", "-"),
+                    )
+                )
+            elif isinstance(col, Expression):
+                self.columns.append(
+                    Column(
+                        str(col).replace('"', ""),
+                        lambda row, name=str(col): row._extra(name),
+                        orderby=None,
+                        required_fields=[col],
+                        key=f"column-{index}",
+                    )
+                )
+            else:
+                raise RuntimeError(f"Column not support {col}")
+
+    def _count_rows(self, dbset, left=None, groupby=None):
+        """
+        Count the rows of the grid query, through count_cache and up to count_limit
+        """
+        limitby = (0, self.count_limit + 1) if self.count_limit else None
+        sql = dbset._select(self.table._id, left=left, groupby=groupby, limitby=limitby)
+        sql = "SELECT COUNT(*) FROM (%s) AS counted;" % sql.rstrip(";")
+
+        def count():
+            return dbset.db.executesql(sql)[0][0]
+
+        if self.count_cache:
+            cache_model, expiration = self.count_cache
+            total = cache_model("grid-count:" + sql, count, expiration)
+        else:
+            total = count()
+
+        self.count_exact = not self.count_limit or total <= self.count_limit
+        if not self.count_exact:
+            # Grid only needs to know there are rows past the current page
+            total = self.current_page_number * self.param.rows_per_page + 1
+        return total
+
+    def _select_page(self, dbset, fields, attributes):
+        if "limitby" not in attributes:
+            return dbset.select(*fields, **attributes)
+
+        rows_per_page = self.param.rows_per_page
+        orders = self._keyset_orders(attributes.get("orderby"))
+        direction, values = None, None
+        if orders is not None:
+            self.page_order_key = ",".join(
+                ("~" if desc else "") + str(field) for field, desc in orders
+            )
+            direction = "next"
+            if self.current_page_number > 1:
+                direction, values = decode_cursor(
+                    request.query.get("cursor"), self.page_order_key, len(orders)
+                )
+            if direction == "last" and not self.count_exact:
+                # the last page is only known from an exact count
+                direction = None
+
+            # the key fields are read from the rows (fields compare with "is", == builds a query)
+            fields = list(fields)
+            fields += [f for f, _ in orders if not any(f is field for field in fields)]
+
+        backwards = direction in ("prev", "last")
+        if direction is not None:
+            if values:
+                dbset = dbset(seek_query(orders, values, backwards))
+            limit = rows_per_page
+            if direction == "last":
+                limit = self.total_number_of_rows % rows_per_page or rows_per_page
+            attributes = dict(
+                attributes,
+                orderby=[
+                    field if desc == backwards else ~field for field, desc in orders
+                ],
+                limitby=(0, limit),
+            )
+        if not self.count_exact and not backwards:
+            # one more row tells whether there is a next page
+            start, end = attributes["limitby"]
+            attributes = dict(attributes, limitby=(start, end + 1))
+
+        rows = dbset.select(*fields, **attributes)
+        if backwards:
+            rows.records.reverse()
+
+        if not self.count_exact:
+            self.has_more = backwards or len(rows) > rows_per_page
+            del rows.records[rows_per_page:]
+            self.total_number_of_rows = self.page_start + len(rows) + self.has_more
+
+        if orders is not None and rows:
+            self.page_keys = [
+                [row[str(field)] for field, _ in orders] for row in (rows[0], rows[-1])
+            ]
+        return rows
+
+    def export(self, export_format, batch_size=1000):
+        """
+        Every row of the grid query, in the grid order, as the body to return from the action
+
+        The search and sort of the request are read here, the rows are read while the
+        body is sent: batch_size at a time, each batch seeking past the last row of
+        the previous one (or by OFFSET when sorted by an SQL expression).  The db
+        fixture has given its connection back by then, the body takes one from the
+        pool and returns it once the last row is sent.
+
+        Parameters
+        ----------
+        export_format: "csv" or "jsonl", see EXPORT_FORMATS
+        batch_size: number of rows fetched and sent at a time
+
+        Returns
+        -------
+        a generator of the encoded file, a batch of rows at a time, the Content-Type
+        and Content-Disposition response headers are set
+        """
+        if self.param.field_id:
+            self.tablename = str(self.param.field_id._table)
+        else:
+            self.tablename = self._get_tablenames(self.query)[0]
+            self.param.field_id = self.db[self.tablename]._id
+        self.table = self.db[self.tablename]
+
+        query, attributes = self._select_arguments()
+        fields = []
+        exports = {}  # name -> function of the row giving the exported value
+        for column in self.columns:
+            if isinstance(column, ExportColumn):
+                exports[column.name] = column.export
+            for field in column.required_fields:
+                if not isinstance(field, Field):
+                    continue
+                if not any(field is f for f in fields):
+                    fields.append(field)
+                if not isinstance(column, ExportColumn) and str(field) not in exports:
+                    exports[str(field)] = lambda row, name=str(field): row[name]
+
+        orders = self._keyset_orders(attributes.get("orderby"))
+        if orders is None:
+            # sorted by an expression: pages with OFFSET, the id keeps the order stable
+            orderby = attributes["orderby"]
+            if isinstance(orderby, str):
+                orderby = "%s, %s" % (orderby, self.table._id)
+            else:
+                orderby = orderby | self.table._id
+        else:
+            orderby = [~field if desc else field for field, desc in orders]
+            fields += [f for f, _ in orders if not any(f is field for field in fields)]
+        attributes = dict(attributes, orderby=orderby, cacheable=True)
+
+        content_type, extension = EXPORT_FORMATS[export_format]
+        response.headers["Content-Type"] = content_type
+        response.headers["Content-Disposition"] = 'attachment; filename="%s.%s"' % (
+            self.tablename,
+            extension,
+        )
+        return self._export_rows(
+            query, fields, attributes, orders, exports, export_format, batch_size
+        )
+
+    def _export_rows(
+        self, query, fields, attributes, orders, exports, export_format, batch_size
+    ):
+        """The body of export, read on a connection of its own"""
+        db = self.db
+        names = list(exports)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if export_format == "csv":
+            writer.writerow(names)
+        db._adapter.reconnect()
+        try:
+            start, last = 0, None
+            while True:
+                if orders is None:
+                    batch = db(query)
+                    limitby = (start, start + batch_size)
+                else:
+                    batch = db(query & seek_query(orders, last)) if last else db(query)
+                    limitby = (0, batch_size)
+                rows = batch.select(*fields, limitby=limitby, **attributes)
+                for row in rows:
+                    values = [export(row) for export in exports.values()]
+                    if export_format == "csv":
+                        writer.writerow(
+                            ["" if value is None else value for value in values]
+                        )
+                    else:
+                        buffer.write(json.dumps(dict(zip(names, values)), default=str))
+                        buffer.write("\n")
+                yield buffer.getvalue().encode("utf8")
+                buffer.seek(0)
+                buffer.truncate()
+                if len(rows) < batch_size:
+                    break
+                start += batch_size
+                if orders is not None:
+                    last = [rows[-1][str(field)] for field, _ in orders]
+        finally:
+            db.recycle_connection_in_pool_or_close("rollback")
+
+    def _keyset_orders(self, orderby):
+        """
+        Turn the select orderby into a list of (field, descending), ending with the id
+
+        Returns None when the orderby is not made of fields
+        """
+        if orderby is None:
+            orderby = []
+        elif not isinstance(orderby, (list, tuple)):
+            orderby = [orderby]
+
+        invert = self.db._adapter.dialect.invert
+        orders = []
+        for item in orderby:
+            if isinstance(item, Field):
+                orders.append((item, False))
+            elif (
+                isinstance(item, Expression)
+                and item.op == invert
+                and isinstance(item.first, Field)
+            ):
+                orders.append((item.first, True))
+            else:
+                return None
+
+        if not any(field is self.table._id for field, _ in orders):
+            orders.append((self.table._id, False))
+        return orders
+
+    def _make_table_pager(self):
+        if not self.page_keys:
+            return super()._make_table_pager()
+
+        page = self.current_page_number
+        first_key, last_key = self.page_keys
+        links = [
+            ("First", 1, None, page > 1),
+            ("Previous", page - 1, ("prev", first_key), page > 1),
+            ("Next", page + 1, ("next", last_key), page < self.number_of_pages),
+        ]
+        if self.count_exact:
+            links.append(
+                ("Last", self.number_of_pages, ("last", None), page < self.number_of_pages)
+            )
+            position = "%s %s / %s" % (self.T("Page"), page, self.number_of_pages)
+        else:
+            position = "%s %s" % (self.T("Page"), page)
+
+        pager = DIV(_class=self.get_style("grid-pagination"))
+        for label, page_number, cursor, enabled in links[:2]:
+            pager.append(self._make_pager_link(label, page_number, cursor, enabled))
+        pager.append(
+            SPAN(position, _class=self.get_style("grid-pagination-button-current"))
+        )
+        for label, page_number, cursor, enabled in links[2:]:
+            pager.append(self._make_pager_link(label, page_number, cursor, enabled))
+        return pager
+
+    def _make_table(self):
+        html = super()._make_table()
+        if self.has_more:
+            for info in html.find(".grid-info"):
+                info[0] = str(self.T("Displaying rows %s thru %s of more than %s")) % (
+                    self.page_start + 1,
+                    self.page_start + len(self.rows),
+                    self.page_start + len(self.rows),
+                )
+        return html
+
+    def _make_pager_link(self, label, page_number, cursor, enabled):
+        if not enabled:
+            return SPAN(
+                self.T(label),
+                _class=self.get_style("grid-pagination-button"),
+                _disabled=True,
+            )
+
+        pager_query_parms = dict(self.query_parms)
+        pager_query_parms["page"] = page_number
+        if cursor and page_number > 1:
+            pager_query_parms["cursor"] = encode_cursor(
+                cursor[0], self.page_order_key, cursor[1]
+            )
+        attrs = dict(
+            _class=self.get_style("grid-pagination-button"),
+            _role="button",
+            _href=URL(vars=pager_query_parms),
+        )
+        plugin = self.attributes_plugin.get("button_page_number")
+        if plugin:
+            plugin(attrs)
+        return A(self.T(label), **attrs)
+
+
+# export format -> (content type, file extension)
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "jsonl": ("application/x-ndjson", "jsonl"),
+}
+
+# the KeysetGrid attributes describing a page, restored with the page from the page cache
+_PAGE_STATE = (
+    "mode",
+    "tablename",
+    "total_number_of_rows",
+    "number_of_pages",
+    "current_page_number",
+    "page_start",
+    "page_end",
+    "count_exact",
+    "has_more",
+    "page_keys",
+    "page_order_key",
+)
+
+
+def seek_query(orders, values, backwards=False):
+    """
+    Build the query selecting the rows sorted after the key values
+
+    The rows are compared field by field like a tuple (a, b, id) > (va, vb, vid).
+    SQLite sorts NULLs first, so a NULL key is before any value in ascending order.
+
+    Parameters
+    ----------
+    orders: list of (field, descending) ending with a unique field
+    values: the key of the row to seek from, one value per field
+    backwards: select the rows sorted before the key instead
+
+    Returns
+    -------
+    the pydal query
+    """
+    query = None
+    equal = None
+    for (field, desc), value in zip(orders, values):
+        if desc == backwards:
+            after = field != None if value is None else field > value
+        else:
+            after = None if value is None else (field < value) | (field == None)
+        if after is not None:
+            term = after if equal is None else equal & after
+            query = term if query is None else query | term
+        same = field == value
+        equal = same if equal is None else equal & same
+
+    # a bound on the leading field lets the database range scan its index
+    field, desc = orders[0]
+    if values[0] is not None and desc == backwards:
+        query = (field >= values[0]) & query
+    return query
+
+
+def encode_cursor(direction, order_key, values):
+    data = json.dumps([direction, order_key, values], default=str)
+    return base64.urlsafe_b64encode(data.encode("utf8")).decode("utf8")
+
+
+def decode_cursor(cursor, order_key, length):
+    """
+    Read a cursor made by encode_cursor for the same orderby
+
+    Returns
+    -------
+    (direction, values), or (None, None) when the cursor is missing, invalid or
+    was made for a different sort order
+    """
+    try:
+        direction, key, values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (AttributeError, ValueError, TypeError):
+        return None, None
+    if key != order_key or direction not in ("next", "prev", "last"):
+        return None, None
+    if direction != "last" and not (isinstance(values, list) and len(values) == length):
+        return None, None
+    return direction, values
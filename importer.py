@@ -0,0 +1,314 @@
+"""
+This file defines the bulk loader of customers, orders, order lines and the other tables
+
+    from .importer import import_rows, read_rows
+    report = import_rows(db, "order_detail", read_rows("lines.csv"))
+
+Inserting through the DAL runs the validators and the write hooks one row at a
+time, and the IS_IN_DB validators and the order_detail hook each query the
+database for every row.  Here the rows are read batch_size at a time and
+validated with the requires= of their fields, except the references which are
+resolved with one belongs() select per reference field and batch (a reference may
+be given by id or, when the table has one, by name).  Valid rows are inserted with
+executemany, each batch in its own transaction, and the rejected rows are reported
+with their errors.  A batch the database refuses (e.g. an id already taken) is
+inserted again one row at a time, and the refused rows are rejected.
+
+The write hooks are not run, their work is done here: order lines get the unit
+price of their product, new orders start with subtotal 0 and total = freight, and
+the totals of the orders that got new lines are recomputed at the end.
+
+Run bulk_import.py to load a file from the command line.
+"""
+
+import csv
+import datetime
+import json
+import os
+from decimal import Decimal
+
+from .common import table_versions
+from .models import order_amounts, product_prices
+from .reporting import revenue_report
+
+# reference field -> field of the referenced table a row may name it by
+LOOKUP_FIELDS = {
+    "district": "name",
+    "shipper": "name",
+    "category": "name",
+    "product": "name",
+    "customer": "name",
+}
+
+
+def read_rows(path):
+    """
+    Iterate the rows of a CSV file (with a header line) or of a JSON lines file as dicts
+    """
+    with open(path, encoding="utf8", newline="") as stream:
+        if os.path.splitext(path)[1].lower() in (".jsonl", ".json", ".ndjson"):
+            for line in stream:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(stream)
+
+
+class ReferenceMap:
+    """
+    The ids of a table referenced by a batch of rows, and the ids by lowercase name,
+    loaded with one select per batch by load
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.name_field = LOOKUP_FIELDS.get(table._tablename)
+        self.ids = set()
+        self.by_name = dict()
+
+    def load(self, values):
+        """Look up the ids and names among values, forgetting those of the previous batch"""
+        table = self.table
+        db = table._db
+        ids, names = set(), set()
+        for value in values:
+            if isinstance(value, str):
+                value = value.strip()
+            if value in ("", None):
+                continue
+            if isinstance(value, int) or str(value).isdigit():
+                ids.add(int(value))
+            else:
+                names.add(str(value).lower())
+        self.ids = set()
+        self.by_name = dict()
+        if ids:
+            rows = db(table._id.belongs(ids)).iterselect(table._id)
+            self.ids = {row.id for row in rows}
+        if names and self.name_field:
+            name = table[self.name_field]
+            for row in db(name.lower().belongs(names)).iterselect(
+                table._id, name, orderby=table._id
+            ):
+                self.by_name.setdefault(row[self.name_field].strip().lower(), row.id)
+
+    def resolve(self, value):
+        """The id value stands for, or None"""
+        if isinstance(value, int) or str(value).strip().isdigit():
+            value = int(value)
+            return value if value in self.ids else None
+        return self.by_name.get(str(value).strip().lower())
+
+
+def _db_value(field, value):
+    """The value of field as a SQLite parameter"""
+    if value is None:
+        return None
+    if field.type == "boolean":
+        return "T" if value else "F"
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(" ")
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def import_rows(db, tablename, rows, batch_size=5000, max_rejects=1000, log=None):
+    """
+    Validate and insert rows into a table
+
+    Parameters
+    ----------
+    db: the DAL of the app
+    tablename: the table to load
+    rows: iterable of dicts of field name -> value (strings are fine, as read from CSV)
+    batch_size: number of rows validated together, inserted per executemany and transaction
+    max_rejects: number of rejected rows kept in the report (all of them are counted)
+    log: optional function receiving progress messages
+
+    Returns
+    -------
+    dict(inserted, rejected, rejects=[dict(line, row, errors)])
+    """
+    if db._dbname != "sqlite":
+        raise RuntimeError("the bulk import writes with SQLite executemany")
+
+    table = db[tablename]
+    references = dict()  # field name -> ReferenceMap
+    for field in table:
+        if field.type.startswith("reference"):
+            references[field.name] = ReferenceMap(db[field.type.split()[1]])
+
+    report = dict(inserted=0, rejected=0, rejects=[])
+    touched_orders = set()
+
+    def reject(line, row, errors):
+        report["rejected"] += 1
+        if len(report["rejects"]) < max_rejects:
+            report["rejects"].append(dict(line=line, row=row, errors=errors))
+
+    def insert(batch):
+        # the id is only written when the rows give it, e.g. orders referenced by their
+        # lines, the others get NULL which SQLite turns into the next id
+        with_id = any(values.get("id") is not None for _, _, values in batch)
+        fieldnames = [field.name for field in table if field.type != "id" or with_id]
+        if tablename == "order_detail":
+            # the prices of the products of the batch, through the cache the hooks use
+            products = {values["product"] for _, _, values in batch}
+            prices = product_prices.get_many(products)
+            for _, _, values in batch:
+                values["unit_price"] = prices.get(values["product"])
+        records = [
+            tuple(_db_value(table[name], values.get(name)) for name in fieldnames)
+            for _, _, values in batch
+        ]
+        sql = "INSERT INTO %s (%s) VALUES (%s);" % (
+            table._rname,
+            ", ".join(table[name]._rname for name in fieldnames),
+            ", ".join("?" for _ in fieldnames),
+        )
+        integrity_error = db._adapter.driver.IntegrityError
+        try:
+            db._adapter.cursor.executemany(sql, records)
+            db.commit()
+            inserted = len(records)
+        except integrity_error:
+            # e.g. an id already in the table: the rows of the batch go one by one,
+            # the failing ones are rejected
+            db.rollback()
+            inserted = 0
+            try:
+                for (line, row, _), record in zip(batch, records):
+                    try:
+                        db._adapter.cursor.execute(sql, record)
+                        inserted += 1
+                    except integrity_error as error:
+                        reject(line, row, dict(_row=str(error)))
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+        except Exception:
+            db.rollback()
+            raise
+        report["inserted"] += inserted
+        if log:
+            log("%s: %s rows inserted" % (tablename, report["inserted"]))
+
+    def load(lines):
+        for name, reference in references.items():
+            reference.load(row.get(name) for _, row in lines)
+        batch = []
+        for line, row in lines:
+            values, errors = validate_row(table, row, references)
+            if errors:
+                reject(line, row, errors)
+                continue
+
+            if tablename == "order_detail":
+                touched_orders.add(values["order"])
+            elif tablename == "order":
+                freight = values.get("freight") or Decimal("0.00")
+                values["subtotal"] = Decimal("0.00")
+                values["total"] = freight
+            batch.append((line, row, values))
+        if batch:
+            insert(batch)
+
+    lines = []
+    for line, row in enumerate(rows, 1):
+        lines.append((line, row))
+        if len(lines) == batch_size:
+            load(lines)
+            lines = []
+    if lines:
+        load(lines)
+
+    if touched_orders:
+        refresh_totals(db, touched_orders, batch_size)
+        table_versions.written(db.order)
+    # the stored versions tell the web server processes too
+    table_versions.written(table)
+    db.commit()
+    if tablename in ("order", "order_detail"):
+        # the rows went around the hooks, the cached revenue of every month may be off
+        revenue_report.clear()
+    return report
+
+
+def validate_row(table, row, references):
+    """
+    Check a row against the validators of its fields
+
+    Returns
+    -------
+    (values, errors) - values are the validated values, errors a dict of field name -> message
+    """
+    values = dict()
+    errors = dict()
+    for field in table:
+        if field.name not in row or field.type == "id" and not row[field.name]:
+            if field.type == "id":
+                continue
+            if field.required:
+                errors[field.name] = "missing"
+            elif field.default is not None:
+                default = field.default
+                values[field.name] = default() if callable(default) else default
+            continue
+
+        value = row[field.name]
+        if isinstance(value, str):
+            value = value.strip()
+        if value in ("", None):
+            value = None
+
+        if field.type == "id":
+            if not str(value).isdigit():
+                errors[field.name] = "not an id"
+            else:
+                values[field.name] = int(value)
+        elif field.name in references:
+            if value is None:
+                if field.required:
+                    errors[field.name] = "missing"
+                values[field.name] = None
+            else:
+                values[field.name] = references[field.name].resolve(value)
+                if values[field.name] is None:
+                    errors[field.name] = "unknown %s %s" % (field.type.split()[1], value)
+        elif field.type == "boolean":
+            values[field.name] = str(value).lower() in ("1", "t", "true", "yes", "on")
+        else:
+            value, error = field.validate("" if value is None else value)
+            if error:
+                errors[field.name] = str(error)
+            values[field.name] = None if value == "" else value
+
+    unknown = set(row) - set(table.fields)
+    if unknown:
+        errors["_row"] = "unknown fields %s" % ", ".join(sorted(unknown))
+    return values, errors
+
+
+def refresh_totals(db, order_ids, batch_size=5000):
+    """Recompute the stored subtotal and total of the orders with one grouped query per batch"""
+    order_ids = sorted(order_ids)
+    sql = "UPDATE %s SET %s = ?, %s = ? WHERE %s = ?;" % (
+        db.order._rname,
+        db.order.subtotal._rname,
+        db.order.total._rname,
+        db.order.id._rname,
+    )
+    for start in range(0, len(order_ids), batch_size):
+        amounts = order_amounts(order_ids[start : start + batch_size])
+        db._adapter.cursor.executemany(
+            sql,
+            [
+                (float(a["subtotal"]), float(a["total"]), order_id)
+                for order_id, a in amounts.items()
+            ],
+        )
+        db.commit()
@@ -0,0 +1,305 @@
+"""
+This file defines the background job runner: worker threads taking jobs from a table
+
+    jobs = JobRunner(db, workers=2)
+
+    @jobs.job("order_totals", every=24 * 3600, lease=1800)
+    def order_totals():
+        return verify_order_totals(fix=True)
+
+    jobs.enqueue("order_totals")  # run it now, once the transaction commits
+    jobs.start()
+
+The jobs are rows of a table of the app database, no broker is needed.  A worker
+claims a due job with a conditional UPDATE that only one worker can win, and the
+claim is a lease: a job whose worker died is taken over once its lease expires.
+A job that raises is run again later, waiting retry_delay seconds doubled on each
+attempt, until it has been tried max_attempts times and is marked failed.
+Every process calling start() runs its own workers, the leases keep them from
+running the same job twice.
+
+Periodic jobs are queued once per period of every seconds.  The period is part
+of a unique key, so when several processes schedule the same period only one of
+the inserts goes through.
+"""
+
+import datetime
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+
+from pydal import Field
+
+from .schema import define_index
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+def now():
+    return datetime.datetime.now().replace(microsecond=0)
+
+
+class JobRunner:
+    """
+    Queue of jobs kept in a table of db, run by worker threads
+
+    Parameters
+    ----------
+    db: the DAL the job table is defined in, and the jobs run with
+    workers: number of worker threads start() runs
+    poll: seconds an idle worker waits before looking for due jobs again
+    lease: default seconds a job may run before another worker may take it over
+    max_attempts: default number of times a failing job is tried
+    retry_delay: seconds before the first retry, doubled on each attempt
+    tablename: name of the job table
+    logger: where to log the failures, defaults to the py4web logger
+    """
+
+    def __init__(
+        self,
+        db,
+        workers=2,
+        poll=1.0,
+        lease=300,
+        max_attempts=3,
+        retry_delay=30,
+        tablename="job",
+        logger=None,
+    ):
+        self.db = db
+        self.workers = workers
+        self.poll = poll
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.logger = logger or logging.getLogger("py4web")
+        self.functions = dict()  # name -> dict(function, every, lease, max_attempts)
+        self.scheduled = dict()  # name -> last period queued by this process
+        self.worker = "%s:%s" % (socket.gethostname(), os.getpid())
+        self.stop_event = None
+        self.table = db.define_table(
+            tablename,
+            Field("name", length=64),
+            Field("args", "text"),
+            Field("status", length=16, default=QUEUED),
+            Field("run_at", "datetime", default=now),
+            Field("attempts", "integer", default=0),
+            Field("max_attempts", "integer"),
+            Field("lease_until", "datetime"),
+            Field("worker", length=128),
+            Field("period_key", length=128),
+            Field("result", "text"),
+            Field("error", "text"),
+            Field("created_on", "datetime", default=now),
+            Field("finished_on", "datetime"),
+        )
+        define_index(self.table, tablename + "_due", self.table.status, self.table.run_at)
+        define_index(self.table, tablename + "_period", self.table.period_key, unique=True)
+
+    def job(self, name, every=None, lease=None, max_attempts=None):
+        """
+        Decorator registering a function as the job name
+
+        Parameters
+        ----------
+        name: the name jobs are queued by
+        every: seconds between two runs of a periodic job, None if only run when queued
+        lease: seconds the job may run, when longer than the runner lease
+        max_attempts: number of times a failing job is tried, when not the runner default
+        """
+
+        def register(f):
+            self.functions[name] = dict(
+                function=f,
+                every=every,
+                lease=lease or self.lease,
+                max_attempts=max_attempts or self.max_attempts,
+            )
+            return f
+
+        return register
+
+    def enqueue(self, name, *args, run_at=None, **kwargs):
+        """
+        Queue a run of the job name with args and kwargs (JSON values), returns its id
+
+        The job is inserted in the current transaction, the workers see it once it commits.
+        """
+        if name not in self.functions:
+            raise KeyError("unknown job %s" % name)
+        return self.table.insert(
+            name=name,
+            args=json.dumps([args, kwargs]),
+            run_at=run_at or now(),
+            max_attempts=self.functions[name]["max_attempts"],
+        )
+
+    def schedule(self):
+        """Queue the periodic jobs whose period started, once per period across processes"""
+        db = self.db
+        for name, config in self.functions.items():
+            if not config["every"]:
+                continue
+            period = int(time.time() // config["every"])
+            if self.scheduled.get(name) == period:
+                continue
+            try:
+                self.table.insert(
+                    name=name,
+                    args=json.dumps([[], {}]),
+                    max_attempts=config["max_attempts"],
+                    period_key="%s@%s" % (name, period),
+                )
+                db.commit()
+            except db._adapter.driver.IntegrityError:
+                # another process queued this period first
+                db.rollback()
+            except Exception:
+                # e.g. the database is locked, tried again on the next poll
+                db.rollback()
+                raise
+            self.scheduled[name] = period
+
+    def claim(self):
+        """Take the next due job, or a job whose lease expired, None if there is none"""
+        db = self.db
+        job = self.table
+        started = now()
+        rows = db(
+            ((job.status == QUEUED) & (job.run_at <= started))
+            | ((job.status == RUNNING) & (job.lease_until < started))
+        ).select(
+            job.id,
+            job.name,
+            job.status,
+            job.attempts,
+            job.max_attempts,
+            orderby=job.run_at,
+            limitby=(0, 10),
+        )
+        for row in rows:
+            config = self.functions.get(row.name)
+            if row.status == RUNNING and row.attempts >= row.max_attempts:
+                # its last worker died or ran past the lease
+                db((job.id == row.id) & (job.attempts == row.attempts)).update(
+                    status=FAILED, error="lease expired", finished_on=started
+                )
+                db.commit()
+                continue
+            lease = config["lease"] if config else self.lease
+            # the attempts count changes on every claim, only one worker can match it
+            claimed = db(
+                (job.id == row.id)
+                & (job.status == row.status)
+                & (job.attempts == row.attempts)
+            ).update(
+                status=RUNNING,
+                attempts=row.attempts + 1,
+                lease_until=started + datetime.timedelta(seconds=lease),
+                worker=self.worker,
+            )
+            db.commit()
+            if claimed:
+                return job(row.id)
+        return None
+
+    def run(self, job):
+        """Run a claimed job and record how it went"""
+        db = self.db
+        claim = (self.table.id == job.id) & (self.table.attempts == job.attempts)
+        try:
+            config = self.functions.get(job.name)
+            if config is None:
+                raise KeyError("unknown job %s" % job.name)
+            args, kwargs = json.loads(job.args or "[[], {}]")
+            result = config["function"](*args, **kwargs)
+            db.commit()
+        except Exception:
+            db.rollback()
+            error = traceback.format_exc()
+            self.logger.warning("job %s #%s failed: %s", job.name, job.id, error)
+            if job.attempts < job.max_attempts:
+                delay = self.retry_delay * 2 ** (job.attempts - 1)
+                db(claim).update(
+                    status=QUEUED,
+                    run_at=now() + datetime.timedelta(seconds=delay),
+                    error=error,
+                )
+            else:
+                db(claim).update(status=FAILED, error=error, finished_on=now())
+        else:
+            db(claim).update(
+                status=DONE,
+                result=json.dumps(result, default=str),
+                error=None,
+                finished_on=now(),
+            )
+        db.commit()
+
+    def work(self, stop, scheduler=False):
+        """Loop of a worker thread, with its own database connection"""
+        while not stop.is_set():
+            job = None
+            self.db._adapter.reconnect()
+            try:
+                if scheduler:
+                    self.schedule()
+                job = self.claim()
+                if job:
+                    self.run(job)
+            except Exception:
+                self.logger.exception("job runner")
+            finally:
+                self.db.recycle_connection_in_pool_or_close("rollback")
+            if job is None:
+                stop.wait(self.poll)
+
+    def start(self):
+        """Start the worker threads, the first one also queues the periodic jobs"""
+        # the workers of a previous load of the app (py4web reloads on changes) stop
+        for thread in threading.enumerate():
+            if getattr(thread, "job_runner", None) == self.db._uri_hash:
+                thread.job_stop.set()
+        self.stop_event = threading.Event()
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self.work,
+                args=(self.stop_event, index == 0),
+                name="jobs-%s" % index,
+                daemon=True,
+            )
+            thread.job_runner = self.db._uri_hash
+            thread.job_stop = self.stop_event
+            thread.start()
+
+    def stop(self):
+        """Ask the worker threads to stop once their current job is over"""
+        if self.stop_event:
+            self.stop_event.set()
+
+    def status(self, limit=20):
+        """Number of jobs by status, and the latest jobs"""
+        db = self.db
+        job = self.table
+        count = job.id.count()
+        rows = db(job).select(job.status, count, groupby=job.status)
+        latest = db(job).select(
+            job.id,
+            job.name,
+            job.status,
+            job.attempts,
+            job.run_at,
+            job.finished_on,
+            job.worker,
+            job.error,
+            orderby=~job.id,
+            limitby=(0, limit),
+        )
+        return dict(
+            counts={row[job.status]: row[count] for row in rows},
+            latest=latest.as_list(),
+        )
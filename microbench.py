@@ -0,0 +1,298 @@
+"""
+This file defines micro benchmarks of the code run for every cell of the grids
+
+    python microbench.py                   # all of them
+    python microbench.py advanced_columns  # only some
+
+Each benchmark renders the same synthetic rows with the code the tutorial used
+before and with the current code, and prints the cost per row of each.  The
+rows are built in memory, the database is not involved.
+"""
+
+import argparse
+import datetime
+import functools
+import importlib
+import os
+import random
+import time
+from wsgiref.util import setup_testing_defaults
+
+APP_FOLDER = os.path.dirname(os.path.abspath(__file__))
+APP_NAME = os.path.basename(APP_FOLDER)
+
+# name -> function(rows) returning (before, after), each a function rendering one row
+BENCHMARKS = dict()
+
+
+def benchmark(name):
+    def register(f):
+        BENCHMARKS[name] = f
+        return f
+
+    return register
+
+
+def per_row(render, rows, repeat=5):
+    """Best time over repeat runs to render every row, in microseconds per row"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for row in rows:
+            render(row)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(rows) * 1e6
+
+
+def app_module(name):
+    return importlib.import_module("apps.%s.%s" % (APP_NAME, name))
+
+
+def customer_rows(count, seed=1):
+    """Joined customer/district rows like the ones of the customer grids"""
+    from pydal.objects import Row
+
+    fake_data = app_module("fake_data")
+    # the districts of the database, the represents look their names up by id
+    districts = list(app_module("models").districts.rows().values())
+    rng = random.Random(seed)
+    weights = [weight for _, weight, _ in fake_data.COUNTRIES]
+    rows = []
+    for i in range(count):
+        country, _, cities = rng.choices(fake_data.COUNTRIES, weights)[0]
+        customer = Row(
+            id=i,
+            name="Customer %s" % i,
+            address="%s Main St." % i,
+            city=rng.choice(cities),
+            region=None,
+            postal_code="%05d" % rng.randint(1000, 99999),
+            country=country,
+            contact="Contact %s" % i,
+            title=rng.choice(["Owner", "Sales Agent", "President"]),
+        )
+        district = rng.choice(districts)
+        customer.district = district.id
+        rows.append(Row(customer=customer, district=Row(name=district.name)))
+    return rows
+
+
+@functools.lru_cache()
+def advanced_columns_grid():
+    """The grid of the advanced_columns page, processed"""
+    return app_module("controllers").advanced_columns.__wrapped__()["grid"]
+
+
+@functools.lru_cache()
+def advanced_columns_represents():
+    """The represents of the 4 advanced_columns columns, before and now"""
+    from py4web import URL
+    from yatl.helpers import XML
+
+    grid = advanced_columns_grid()
+
+    # the represents of the advanced_columns grid before the flag urls were precomputed
+    before_columns = [
+        lambda row: XML(
+            f"{row.customer.name}"
+            f"<div>{row.customer.address}</div>"
+            f"<div>{row.customer.city}, {row.customer.region} {row.customer.postal_code}</div>"
+            f"<div>{row.customer.country}</div>"
+        ),
+        lambda row: XML(
+            f'<a href="https://www.wikipedia.org/wiki/{row.customer.country}" target="_blank"><img src="{URL("static", "images/flags", row.customer.country.lower() + ".png")}" width="68" height="40"></a>'
+        )
+        if row.customer.country
+        else "",
+        lambda row: XML(f"{row.customer.contact}<div>{row.customer.title}</div>"),
+        lambda row: XML(f"{row.district.name}"),
+    ]
+    after_columns = [column.represent for column in grid.columns[:4]]
+    return before_columns, after_columns
+
+
+def render(columns):
+    return lambda row: [str(represent(row)) for represent in columns]
+
+
+@benchmark("advanced_columns")
+def advanced_columns(rows):
+    before_columns, after_columns = advanced_columns_represents()
+    for row in rows[:100]:
+        assert render(before_columns)(row) == render(after_columns)(row)
+    return render(before_columns), render(after_columns)
+
+
+@benchmark("flag")
+def flag(rows):
+    before_columns, after_columns = advanced_columns_represents()
+    return render(before_columns[1:2]), render(after_columns[1:2])
+
+
+@benchmark("table_body")
+def table_body(rows):
+    from py4web.utils.grid import Grid
+
+    grid = advanced_columns_grid()
+    size = grid.param.rows_per_page
+    # the rows are rendered a page at a time, when the first row of the page comes
+    pages = {
+        id(rows[start]): rows[start : start + size] for start in range(0, len(rows), size)
+    }
+
+    def render(make_table_body):
+        def render_page(row):
+            page = pages.get(id(row))
+            if page is not None:
+                grid.rows = page
+                return make_table_body(grid).xml()
+
+        return render_page
+
+    # the TR and TD helpers of every cell as before, and the one pass of KeysetGrid
+    before, after = render(Grid._make_table_body), render(type(grid)._make_table_body)
+    for start in range(0, 10 * size, size):
+        assert before(rows[start]) == after(rows[start])
+    return before, after
+
+
+@benchmark("reorder_button")
+def reorder_button(rows):
+    from py4web import URL
+    from pydal.objects import Row
+    from yatl.helpers import A, I, XML
+
+    controllers = app_module("controllers")
+    key = str(controllers.needs_reorder)
+    products = [
+        Row(product=Row(id=i, name="Product %s" % i), _extra={key: i % 3 == 0})
+        for i in range(len(rows))
+    ]
+
+    # the button built from helpers for every row, as before
+    def before(row):
+        if not row[key]:
+            return None
+        button = A(
+            I(_class="fas fa-redo"),
+            _href=URL(f"reorder/{row.product.id}"),
+            _role="button",
+            _title=f"Reorder {row.product.name}",
+            _message=f"Do you want to reorder {row.product.name}?",
+            _class="button grid-button is-small",
+        )
+        button.append(XML("&nbsp;Reorder"))
+        return button
+
+    for row in products[:100]:
+        button = before(row)
+        assert str(button or "") == str(controllers.reorder_button(row) or "")
+    # the rows handed to the renders are the customers, render the products instead
+    index = {id(row): product for row, product in zip(rows, products)}
+
+    def render(f):
+        return lambda row: str(f(index[id(row)]) or "")
+
+    return render(before), render(controllers.reorder_button)
+
+
+def order_rows(count, seed=1):
+    """The dates and Decimal amounts of order rows, as the DAL hands them to the grid"""
+    from decimal import Decimal
+
+    rng = random.Random(seed)
+    first_day = datetime.date(2019, 1, 1)
+    rows = []
+    for _ in range(count):
+        order_date = first_day + datetime.timedelta(days=rng.randint(0, 2000))
+        rows.append(
+            dict(
+                dates=[
+                    order_date,
+                    order_date + datetime.timedelta(days=28),
+                    order_date + datetime.timedelta(days=rng.randint(1, 9)),
+                ],
+                amounts=[
+                    Decimal(rng.randint(0, 10**6)) / 100,
+                    Decimal("%.2f" % rng.lognormvariate(3, 1)),
+                ],
+            )
+        )
+    return rows
+
+
+@benchmark("order_dates")
+def order_dates(rows):
+    from dateutil.parser import parse
+
+    formatters = app_module("formatters")
+    orders = order_rows(len(rows))
+    index = {id(row): order for row, order in zip(rows, orders)}
+
+    # the order_date, required_date and shipped_date represents before, dateutil
+    # only parses strings
+    def before_represent(x):
+        return parse(str(x)).strftime("%m/%d/%Y") if x else ""
+
+    def before(row):
+        return [before_represent(x) for x in index[id(row)]["dates"]]
+
+    def after(row):
+        return [formatters.format_date(x) for x in index[id(row)]["dates"]]
+
+    for row in rows[:100]:
+        assert before(row) == after(row)
+    return before, after
+
+
+@benchmark("decimal")
+def decimal(rows):
+    formatters = app_module("formatters")
+    orders = order_rows(len(rows))
+    index = {id(row): order for row, order in zip(rows, orders)}
+
+    # the grid default represent of decimal fields
+    def before(row):
+        return ["%.2f" % x for x in index[id(row)]["amounts"]]
+
+    def after(row):
+        return [formatters.format_decimal(x) for x in index[id(row)]["amounts"]]
+
+    for row in rows[:100]:
+        assert before(row) == after(row)
+    return before, after
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro benchmarks of the cell rendering")
+    parser.add_argument("--rows", type=int, default=20000, help="rows rendered per run")
+    parser.add_argument("benchmarks", nargs="*", help="only run these benchmarks")
+    args = parser.parse_args()
+
+    from py4web.core import wsgi, request
+
+    # the background jobs are left to the web processes
+    os.environ.setdefault("JOB_WORKERS", "0")
+    wsgi(apps_folder=os.path.dirname(APP_FOLDER), yes=True)
+    # URL() and the grids need a request
+    environ = dict()
+    setup_testing_defaults(environ)
+    environ["PATH_INFO"] = "/%s/" % APP_NAME
+    request.setup(environ)
+    request.app_name = APP_NAME
+
+    rows = customer_rows(args.rows)
+    for name, f in BENCHMARKS.items():
+        if args.benchmarks and name not in args.benchmarks:
+            continue
+        before, after = f(rows)
+        before_us, after_us = per_row(before, rows), per_row(after, rows)
+        print(
+            "%-18s before %7.2fus/row  after %7.2fus/row  %5.1fx"
+            % (name, before_us, after_us, before_us / after_us)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+This file defines the command bringing an older copy of the tutorial database up to date
+
+    python migrate.py
+
+The order table of the tutorial database has no subtotal and total columns.  They
+are added here and filled in from the order lines, once, instead of on every start
+of the app (see schema.ensure_columns and models.verify_order_totals).  Running it
+again only checks the stored totals.  The database is the one configured in
+settings.py.
+"""
+
+import importlib
+import os
+
+APP_FOLDER = os.path.dirname(os.path.abspath(__file__))
+APP_NAME = os.path.basename(APP_FOLDER)
+
+
+def main():
+    from py4web.core import wsgi
+
+    # the background jobs are left to the web processes
+    os.environ.setdefault("JOB_WORKERS", "0")
+    wsgi(apps_folder=os.path.dirname(APP_FOLDER), yes=True)
+    models = importlib.import_module("apps.%s.models" % APP_NAME)
+    schema = importlib.import_module("apps.%s.schema" % APP_NAME)
+
+    added = schema.ensure_columns(models.db.order)
+    if added:
+        print("added the order columns %s" % ", ".join(added))
+    result = models.verify_order_totals(fix=True)
+    models.db.commit()
+    print(
+        "%s orders checked, %s totals rebuilt" % (result["checked"], len(result["drifted"]))
+    )
+
+
+if __name__ == "__main__":
+    main()
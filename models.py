@@ -5,9 +5,19 @@ This file defines the database models
 import datetime
 from decimal import Decimal, ROUND_HALF_UP
 
-from dateutil.parser import parse
-
-from .common import db, Field
+from . import settings
+from .common import db, Field, logger, cache, table_versions
+from .cache_helpers import versioned_cache, LocalCache, DimensionTable
+from .schema import (
+    missing_columns,
+    ensure_fulltext,
+    ensure_table,
+    define_index,
+    migrate_indexes,
+    index_report,
+)
+from .grid_helpers import AutocompleteWidget
+from .formatters import format_date, format_decimal
 from pydal.validators import *
 
 
@@ -15,6 +25,9 @@ db.define_table(
     "district",
     Field("name", required=True, requires=IS_NOT_EMPTY()),
 )
+define_index(db.district, "district_name", db.district.name)
+# case insensitive name indexes are used by the autocomplete prefix searches
+define_index(db.district, "district_name_nocase", "name COLLATE NOCASE")
 
 db.define_table(
     "customer",
@@ -31,10 +44,33 @@ db.define_table(
     Field(
         "district",
         "reference district",
-        requires=IS_IN_DB(db, "district.id", "%(name)s", zero=".."),
-        represent=lambda u: u.name if u else "N/A",
+        requires=IS_IN_DB(
+            db,
+            "district.id",
+            "%(name)s",
+            zero="..",
+            cache=versioned_cache(cache, table_versions, "district"),
+        ),
+        represent=lambda id, row=None: districts.label(id, "N/A"),
+        widget=AutocompleteWidget(db.district.name),
     ),
 )
+define_index(db.customer, "customer_district", db.customer.district)
+define_index(db.customer, "customer_name", db.customer.name)
+define_index(db.customer, "customer_name_nocase", "name COLLATE NOCASE")
+define_index(db.customer, "customer_contact", db.customer.contact)
+
+# FTS5 index on customer created by schema.ensure_fulltext - rank is only
+# available when the query has a MATCH on the table (see grid_helpers.fulltext_query)
+db.define_table(
+    "customer_fts",
+    Field("rowid", "id"),
+    Field("name"),
+    Field("contact"),
+    Field("title"),
+    Field("rank", "double", readable=False, writable=False),
+    migrate=False,
+)
 
 db.define_table(
     "customer_note",
@@ -42,6 +78,7 @@ db.define_table(
         "customer",
         "reference customer",
         requires=IS_IN_DB(db, "customer.id", "%(name)s", zero=".."),
+        widget=AutocompleteWidget(db.customer.name),
     ),
     Field(
         "timestamp",
@@ -51,6 +88,12 @@ db.define_table(
     ),
     Field("note", "text", requires=IS_NOT_EMPTY()),
 )
+define_index(
+    db.customer_note,
+    "customer_note_customer",
+    db.customer_note.customer,
+    db.customer_note.timestamp,
+)
 
 
 db.define_table(
@@ -75,14 +118,24 @@ db.define_table(
         "category",
         "reference category",
         requires=IS_IN_DB(db, "category.id", "%(name)s", zero=".."),
+        represent=lambda id, row=None: categories.label(id),
     ),
     Field("quantity_per_unit", length=20),
-    Field("unit_price", "decimal(11,2)"),
+    Field("unit_price", "decimal(11,2)", represent=format_decimal),
     Field("in_stock", "integer"),
     Field("on_order", "integer"),
     Field("reorder_level", "integer"),
     Field("discontinued", "boolean", default=False),
 )
+define_index(db.product, "product_category", db.product.category)
+define_index(db.product, "product_name", db.product.name)
+define_index(db.product, "product_name_nocase", "name COLLATE NOCASE")
+
+# products to reorder, the low stock view of action_buttons is served by the partial index
+product_needs_reorder = db.product.in_stock <= db.product.reorder_level
+define_index(
+    db.product, "product_reorder_name", db.product.name, where=product_needs_reorder
+)
 
 db.define_table(
     "order",
@@ -91,38 +144,33 @@ db.define_table(
         "reference customer",
         requires=IS_IN_DB(db, "customer.id", "%(name)s", zero=".."),
         represent=lambda row: row.name if row else "",
+        widget=AutocompleteWidget(db.customer.name),
     ),
     Field(
         "order_date",
         "date",
         requires=IS_DATE(),
-        represent=lambda x: parse(x).strftime("%m/%d/%Y")
-        if x and isinstance(x, str)
-        else "",
+        represent=format_date,
     ),
     Field(
         "required_date",
         "date",
         requires=IS_DATE(),
-        represent=lambda x: parse(x).strftime("%m/%d/%Y")
-        if x and isinstance(x, str)
-        else "",
+        represent=format_date,
     ),
     Field(
         "shipped_date",
         "date",
         requires=IS_NULL_OR(IS_DATE()),
-        represent=lambda x: parse(x).strftime("%m/%d/%Y")
-        if x and isinstance(x, str)
-        else "",
+        represent=format_date,
     ),
     Field(
         "shipper",
         "reference shipper",
         requires=IS_NULL_OR(IS_IN_DB(db, "shipper.id", "%(name)s", zero="..")),
-        represent=lambda row: f"{row.name}" if row else "",
+        represent=lambda id, row=None: shippers.label(id),
     ),
-    Field("freight", "decimal(11,2)"),
+    Field("freight", "decimal(11,2)", represent=format_decimal),
     Field("ship_to_name", length=40),
     Field("ship_to_address", length=60),
     Field("ship_to_city", length=15),
@@ -130,15 +178,20 @@ db.define_table(
     Field("ship_to_region", length=15),
     Field("ship_to_postal_code", length=10),
     Field("ship_to_country", length=15),
-    Field.Virtual(
+    Field(
         "subtotal",
-        lambda o: order_subtotal(o) if "id" in o else 0,
+        "decimal(11,2)",
+        default=0,
+        writable=False,
+        represent=format_decimal,
     ),
-    Field.Virtual(
-        "total",
-        lambda o: order_total(o) if "id" in o else 0,
+    Field(
+        "total", "decimal(11,2)", default=0, writable=False, represent=format_decimal
     ),
 )
+define_index(db.order, "order_customer", db.order.customer, db.order.order_date)
+define_index(db.order, "order_shipper", db.order.shipper)
+define_index(db.order, "order_date", db.order.order_date)
 
 db.define_table(
     "order_detail",
@@ -147,54 +200,222 @@ db.define_table(
         "product",
         "reference product",
         requires=IS_IN_DB(db, "product.id", "%(name)s", zero=".."),
+        widget=AutocompleteWidget(db.product.name),
     ),
-    Field("unit_price", "decimal(11,2)"),
+    Field("unit_price", "decimal(11,2)", represent=format_decimal),
     Field("quantity", "integer"),
-    Field("discount", "decimal(11,2)", default=0),
+    Field("discount", "decimal(11,2)", default=0, represent=format_decimal),
+)
+define_index(db.order_detail, "order_detail_order", db.order_detail.order)
+define_index(db.order_detail, "order_detail_product", db.order_detail.product)
+
+
+def load_product_prices(product_ids):
+    rows = db(db.product.id.belongs(product_ids)).select(
+        db.product.id, db.product.unit_price
+    )
+    return {row.id: row.unit_price for row in rows}
+
+
+# unit price of the products, copied into the order lines when they are written
+product_prices = LocalCache(
+    load_product_prices,
+    size=settings.PRODUCT_PRICE_CACHE_SIZE,
+    ttl=settings.PRODUCT_PRICE_CACHE_TTL,
 )
 
 
 #  add callback functions
 def order_detail_before_update(fields):
     if "product" in fields:
-        product_id = fields["product"]
-        product = db.product(product_id)
-        if product:
-            fields["unit_price"] = product.unit_price
+        try:
+            product_id = int(fields["product"])
+        except (TypeError, ValueError):
+            return
+        prices = product_prices.get_many([product_id])
+        if product_id in prices:
+            fields["unit_price"] = prices[product_id]
+
+
+def product_capture_ids(s):
+    """Remember the products of a set before their prices change"""
+    s._product_ids = [row.id for row in s.select(db.product.id)]
+
+
+def order_detail_capture_orders(s):
+    """Remember the orders of a set of order lines before the lines change"""
+    s._order_ids = {
+        row.order for row in s.select(db.order_detail.order, distinct=True)
+    }
+
+
+def order_detail_after_update(s, fields):
+    order_ids = set(s._order_ids)
+    if fields.get("order"):
+        order_ids.add(fields["order"])
+    refresh_order_totals(order_ids)
+
+
+def order_before_insert(fields):
+    fields["subtotal"] = Decimal("0.00")
+    fields["total"] = Decimal(fields.get("freight") or 0).quantize(
+        Decimal("0.00"), rounding=ROUND_HALF_UP
+    )
+
+
+def order_before_update(s, fields):
+    if "freight" in fields:
+        s._order_ids = {row.id for row in s.select(db.order.id)}
+
+
+def order_after_update(s, fields):
+    if "freight" in fields:
+        refresh_order_totals(s._order_ids)
 
 
 db.order_detail._before_insert.append(lambda f: order_detail_before_update(f))
 db.order_detail._before_update.append(lambda s, f: order_detail_before_update(f))
+db.order_detail._before_update.append(lambda s, f: order_detail_capture_orders(s))
+db.order_detail._before_delete.append(lambda s: order_detail_capture_orders(s))
+db.order_detail._after_insert.append(
+    lambda f, i: refresh_order_totals([f["order"]]) if f.get("order") else None
+)
+db.order_detail._after_update.append(lambda s, f: order_detail_after_update(s, f))
+db.order_detail._after_delete.append(lambda s: refresh_order_totals(s._order_ids))
+db.order._before_insert.append(lambda f: order_before_insert(f))
+db.order._before_update.append(lambda s, f: order_before_update(s, f))
+db.order._after_update.append(lambda s, f: order_after_update(s, f))
+db.product._before_update.append(
+    lambda s, f: product_capture_ids(s) if "unit_price" in f else None
+)
+db.product._after_update.append(
+    lambda s, f: (
+        product_prices.invalidate_written(db, *s._product_ids) if "unit_price" in f else None
+    )
+)
+db.product._before_delete.append(lambda s: product_capture_ids(s))
+db.product._after_delete.append(
+    lambda s: product_prices.invalidate_written(db, *s._product_ids)
+)
 
 
-def order_subtotal(row):
-    row_id = row["id"] if "id" in row else row.order["id"] if "order" in row else None
+def order_amounts(order_ids):
+    """
+    Compute subtotal and total for many orders with a single grouped query
 
-    price = 0
+    Prices are summed in integer cents so the results are identical to rounding
+    each unit price half up to cents and summing them as Decimal
+    """
+    line_cents = (
+        (db.order_detail.unit_price * 100 + 0.5).cast("integer")
+        * db.order_detail.quantity
+    ).sum()
+    rows = db(db.order.id.belongs(order_ids)).select(
+        db.order.id,
+        db.order.freight,
+        line_cents,
+        left=db.order_detail.on(db.order_detail.order == db.order.id),
+        groupby=db.order.id | db.order.freight,
+    )
 
-    if row_id:
-        for od in db(db.order_detail.order == row_id).select():
-            price += Decimal(od.unit_price).quantize(
-                Decimal("0.00"), rounding=ROUND_HALF_UP
-            ) * Decimal(od.quantity).quantize(Decimal("0.00"), rounding=ROUND_HALF_UP)
+    amounts = dict()
+    for row in rows:
+        subtotal = (Decimal(row[line_cents] or 0) / 100).quantize(
+            Decimal("0.00"), rounding=ROUND_HALF_UP
+        )
+        freight = Decimal(row.order.freight or 0).quantize(
+            Decimal("0.00"), rounding=ROUND_HALF_UP
+        )
+        amounts[row.order.id] = dict(subtotal=subtotal, total=subtotal + freight)
+    return amounts
 
-    return Decimal(price).quantize(Decimal("0.00"), rounding=ROUND_HALF_UP)
 
+def refresh_order_totals(order_ids):
+    """Recompute and store the subtotal and total of the given orders"""
+    for order_id, amounts in order_amounts(list(order_ids)).items():
+        db(db.order.id == order_id).update_naive(**amounts)
+    table_versions.written(db.order)
 
-def order_total(row):
-    subtotal = order_subtotal(row)
-    freight = (
-        row["freight"]
-        if "freight" in row
-        else db.order(row["id"])["freight"]
-        if "id" in row
-        else 0
-    )
-    total = Decimal(subtotal).quantize(
-        Decimal("0.00"), rounding=ROUND_HALF_UP
-    ) + Decimal(freight).quantize(Decimal("0.00"), rounding=ROUND_HALF_UP)
 
-    return Decimal(total).quantize(Decimal("0.00"), rounding=ROUND_HALF_UP)
+def verify_order_totals(fix=False, batch_size=1000):
+    """
+    Recompute the totals of every order and compare them with the stored columns
+
+    Parameters
+    ----------
+    fix: store the recomputed values for the orders that drifted
+    batch_size: number of orders recomputed per grouped query
+
+    Returns
+    -------
+    dict with the number of orders checked and the list of drifted orders
+    """
+    checked = 0
+    drifted = []
+    last_id = 0
+    while True:
+        rows = db(db.order.id > last_id).select(
+            db.order.id,
+            db.order.subtotal,
+            db.order.total,
+            orderby=db.order.id,
+            limitby=(0, batch_size),
+        )
+        if not rows:
+            break
+        amounts = order_amounts([row.id for row in rows])
+        for row in rows:
+            expected = amounts[row.id]
+            if row.subtotal != expected["subtotal"] or row.total != expected["total"]:
+                drifted.append(
+                    dict(
+                        id=row.id,
+                        subtotal=row.subtotal,
+                        expected_subtotal=expected["subtotal"],
+                        total=row.total,
+                        expected_total=expected["total"],
+                    )
+                )
+                if fix:
+                    db(db.order.id == row.id).update_naive(**expected)
+        checked += len(rows)
+        last_id = rows.last().id
+
+    if drifted and fix:
+        # update_naive skips the hooks, tell the versioned caches like refresh_order_totals
+        table_versions.written(db.order)
+    if drifted:
+        logger.warning(
+            "%s of %s order totals drifted%s",
+            len(drifted),
+            checked,
+            " and were rebuilt" if fix else "",
+        )
+    return dict(checked=checked, drifted=drifted)
+
+
+table_versions.track(*[db[tablename] for tablename in db.tables])
+
+# the small tables the represents name references from, instead of joining them
+districts = DimensionTable(db.district, table_versions)
+shippers = DimensionTable(db.shipper, table_versions)
+categories = DimensionTable(db.category, table_versions)
+
+if settings.FULLTEXT_SEARCH:
+    ensure_fulltext(db.customer, "name", "contact", "title")
+ensure_table(db.job)
+
+missing = missing_columns(db.order)
+if missing:
+    # added and filled in by migrate.py, not on every start of the app
+    logger.error(
+        "the order table lacks the columns %s, run python migrate.py", ", ".join(missing)
+    )
 
+for name in migrate_indexes(db):
+    logger.info("created index %s", name)
+unindexed = index_report(db)["unindexed_references"]
+if unindexed:
+    logger.warning("no index on the references %s", ", ".join(unindexed))
 
 db.commit()
@@ -0,0 +1,206 @@
+"""
+This file defines the row permission rules of the grids
+
+    rules = RowRules(db.customer)
+    rules.allow("editable", db.customer.title != "Owner")
+    rules.allow("deletable", groups=["7"])  # every row, for the members of group 7
+
+    permissions = rules.compile(group_members.groups)
+    grid = Grid(
+        ...,
+        required_fields=permissions.fields,
+        editable=permissions.check("editable"),
+        deletable=permissions.check("deletable"),
+    )
+
+A rule allows an action on the rows matching its query, to everyone or to the
+members of some groups.  Compiling the rules for a user drops the rules of the
+groups the user is not in and ORs the remaining queries of each action into one
+SQL CASE flag, selected with the page.  The checks handed to the grid only read
+the flag of the row, and permissions.query(action) filters the table down to the
+rows the action is allowed on.  An action allowed on every row, or on none, is
+compiled to a plain True / False and adds nothing to the select.
+
+The groups of the user come from the GroupMembership fixture, which loads them
+once per request through a process-local cache.
+"""
+
+from functools import reduce
+
+from py4web.core import Fixture
+
+from .cache_helpers import LocalCache
+
+
+class GroupMembership(Fixture):
+    """
+    Fixture loading the groups of the logged in user once per request
+
+        group_members = GroupMembership(groups, auth)
+
+        @action.uses(group_members, db)
+        def page():
+            group_members.groups  # -> frozenset({"manager", "sales/north"})
+
+    The groups of the users are kept in a LocalCache.  Tags added or removed
+    through the DAL (groups.add, groups.remove, or writes to the tag table)
+    invalidate the users they are about, again once the transaction ends, the
+    ttl bounds how long writes made elsewhere go unnoticed.
+
+    Parameters
+    ----------
+    groups: the Tags of the auth_user table
+    auth: the Auth fixture telling who the user is
+    size: number of users kept
+    ttl: seconds the groups of a user are kept
+    """
+
+    def __init__(self, groups, auth, size=1000, ttl=60):
+        self.__prerequisites__ = [auth]
+        self.tag_table = groups.tag_table
+        self.auth = auth
+        self.cache = LocalCache(self._load, size=size, ttl=ttl)
+        table = self.tag_table
+        db = table._db
+        table._after_insert.append(
+            lambda f, id: self.cache.invalidate_written(db, f.get("record_id"))
+        )
+        table._before_update.append(lambda s, f: self._capture_users(s))
+        table._after_update.append(
+            lambda s, f: self.cache.invalidate_written(db, f.get("record_id"), *s._group_users)
+        )
+        table._before_delete.append(lambda s: self._capture_users(s))
+        table._after_delete.append(lambda s: self.cache.invalidate_written(db, *s._group_users))
+
+    def _load(self, user_ids):
+        # users without tags are cached too, as no groups
+        found = {user_id: set() for user_id in user_ids}
+        db = self.tag_table._db
+        rows = db(self.tag_table.record_id.belongs(user_ids)).select(
+            self.tag_table.record_id, self.tag_table.tagpath
+        )
+        for row in rows:
+            found[row.record_id].add(row.tagpath.strip("/"))
+        return {user_id: frozenset(tags) for user_id, tags in found.items()}
+
+    def _capture_users(self, s):
+        # the users whose tags the update or delete is about to change
+        s._group_users = [
+            row.record_id for row in s.select(self.tag_table.record_id, distinct=True)
+        ]
+
+    def get(self, user_id):
+        """The groups of a user"""
+        return self.cache.get(user_id, frozenset()) if user_id else frozenset()
+
+    def on_request(self, context):
+        self.local_initialize(self)
+        self.local.groups = self.get(self.auth.user_id)
+
+    def on_success(self, context):
+        self.local_delete(self)
+
+    def on_error(self, context):
+        self.local_delete(self)
+
+    @property
+    def groups(self):
+        """The groups of the user of the current request"""
+        return self.local.groups
+
+
+def in_groups(user_groups, groups):
+    """Whether the user belongs to one of groups, or to a subgroup ("sales/north") of one"""
+    return any(
+        group in user_groups or any(tag.startswith(group + "/") for tag in user_groups)
+        for group in groups
+    )
+
+
+class RowRules:
+    """
+    The actions allowed on the rows of a table, defined once per table
+
+    Parameters
+    ----------
+    table: the table the rules are about
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.rules = []  # (action, query, groups)
+
+    def allow(self, action, query=None, groups=None):
+        """
+        Allow action on the rows matching query (all of them if None) to the
+        members of one of groups (everyone if None)
+        """
+        self.rules.append((action, query, list(groups) if groups else None))
+        return self
+
+    def compile(self, user_groups):
+        """The RowPermissions of a user, given the groups the user is in"""
+        return RowPermissions(self, user_groups)
+
+
+class RowPermissions:
+    """
+    The rules of a table compiled for a user, built once per request by RowRules.compile
+    """
+
+    def __init__(self, rules, user_groups):
+        self.table = rules.table
+        self.queries = dict()  # action -> list of queries, None meaning every row
+        for action, query, groups in rules.rules:
+            if groups is None or in_groups(user_groups, groups):
+                self.queries.setdefault(action, []).append(query)
+        self.flags = dict()  # action -> (CASE expression, its key in row._extra)
+        for action in self.queries:
+            query = self.query(action)
+            if query is not None:
+                flag = query.case(1, 0)
+                self.flags[action] = (flag, str(flag))
+
+    @property
+    def fields(self):
+        """The flags to select with the rows (the grid required_fields)"""
+        return [flag for flag, _ in self.flags.values()]
+
+    def query(self, action):
+        """
+        The rows action is allowed on, as a query, None if allowed on every row
+
+        The query of an action allowed on no row matches nothing.
+        """
+        queries = self.queries.get(action)
+        if not queries:
+            return self.table._id < 0
+        # not "None in queries", a Query compared to None is a (true) Query
+        if any(query is None for query in queries):
+            return None
+        return reduce(lambda a, b: a | b, queries)
+
+    def check(self, action):
+        """
+        The check of action for the grid: True, False or a function(row)
+
+        The function reads the flag selected with the row.  A row loaded without
+        it, like the record of the details/edit/delete forms, is checked with
+        one query.
+        """
+        if not self.queries.get(action):
+            return False
+        if action not in self.flags:
+            return True
+        flag, key = self.flags[action]
+        query = self.query(action)
+        id_key = "%s.%s" % (self.table._tablename, self.table._id.name)
+        db = self.table._db
+
+        def allowed(row):
+            extra = row.get("_extra")
+            if extra and key in extra:
+                return bool(extra[key])
+            return not db(query & (self.table._id == row[id_key])).isempty()
+
+        return allowed
@@ -0,0 +1,181 @@
+"""
+This file defines the SQLProfiler fixture, recording the queries run by each request
+
+    profiler = SQLProfiler(db, repeats=10)
+
+    @action("columns")
+    @action.uses(profiler, "grid.html", session, db)
+    def columns(): ...
+
+Every response gets the number of queries and the time spent in the database in
+X-SQL-Queries / X-SQL-Time headers (and a Server-Timing header the browser dev
+tools can show).  Statements are grouped by shape - the SQL with its literal
+values replaced by ? - and a warning is logged when one shape runs more than
+repeats times in a request: that is usually a query run once per row (N+1).
+With panel=True, html pages get a table of the statements at the bottom.
+
+List the profiler before the template so the queries run while the template
+renders the grid (e.g. represent lookups) are counted.
+"""
+
+import logging
+import re
+import threading
+import time
+
+from py4web import request, response
+from py4web.core import Fixture
+from pydal.helpers.classes import ExecutionHandler
+from yatl.helpers import DIV, TABLE, TR, TH, TD, CODE
+
+# the profile of the request being served by this thread, if any
+_current = threading.local()
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w\"])-?\d+(?:\.\d+)?")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+
+def statement_shape(sql):
+    """
+    The statement with its literal values replaced by ?, so the same query run
+    for different rows has the same shape
+    """
+    shape = _STRING.sub("?", sql)
+    shape = _NUMBER.sub("?", shape)
+    return _LIST.sub("(?)", shape).strip().rstrip(";")
+
+
+class SQLProfile:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = []  # (sql, seconds)
+
+    def record(self, sql, seconds):
+        self.statements.append((sql, seconds))
+
+    @property
+    def db_time(self):
+        return sum(seconds for _, seconds in self.statements)
+
+    def shapes(self):
+        """
+        The statements grouped by shape, most repeated first
+
+        Returns
+        -------
+        list of dict(shape, count, time, sql) - sql is the first statement of that shape
+        """
+        shapes = dict()
+        for sql, seconds in self.statements:
+            shape = statement_shape(sql)
+            if shape not in shapes:
+                shapes[shape] = dict(shape=shape, count=0, time=0.0, sql=sql)
+            shapes[shape]["count"] += 1
+            shapes[shape]["time"] += seconds
+        return sorted(shapes.values(), key=lambda s: (-s["count"], -s["time"]))
+
+
+class _ProfilerHandler(ExecutionHandler):
+    """pydal execution handler feeding the profile of the current request"""
+
+    def before_execute(self, command):
+        self.t0 = time.perf_counter()
+
+    def after_execute(self, command):
+        profile = getattr(_current, "profile", None)
+        if profile is not None:
+            profile.record(command, time.perf_counter() - self.t0)
+
+
+class SQLProfiler(Fixture):
+    def __init__(self, db, repeats=10, panel=False, enabled=True, logger=None):
+        """
+        Fixture recording the queries of each request
+
+        Parameters
+        ----------
+        db: the DAL to profile
+        repeats: log a warning when a statement shape runs more than this many times in a request
+        panel: append the statements table to html pages
+        enabled: False makes the fixture do nothing
+        logger: where to log the warnings, defaults to the py4web logger
+        """
+        self.repeats = repeats
+        self.panel = panel
+        self.enabled = enabled
+        self.logger = logger or logging.getLogger("py4web")
+        # only the adapter of this db, DAL.execution_handlers is shared by every DAL
+        handlers = db._adapter.execution_handlers
+        if enabled and _ProfilerHandler not in handlers:
+            handlers.append(_ProfilerHandler)
+
+    def on_request(self, context):
+        if self.enabled:
+            _current.profile = SQLProfile()
+
+    def on_error(self, context):
+        _current.profile = None
+
+    def on_success(self, context):
+        profile = getattr(_current, "profile", None)
+        _current.profile = None
+        if profile is None:
+            return
+
+        elapsed = time.perf_counter() - profile.start
+        db_time = profile.db_time
+        shapes = profile.shapes()
+        response.headers["X-SQL-Queries"] = str(len(profile.statements))
+        response.headers["X-SQL-Time"] = "%.1f" % (db_time * 1000)
+        response.headers["X-SQL-Repeated"] = str(shapes[0]["count"] if shapes else 0)
+        response.headers["Server-Timing"] = (
+            'db;dur=%.1f;desc="%s queries", app;dur=%.1f'
+            % (db_time * 1000, len(profile.statements), elapsed * 1000)
+        )
+
+        for shape in shapes:
+            if shape["count"] <= self.repeats:
+                break
+            self.logger.warning(
+                "%s ran the same statement %s times (%.1fms), N+1 query? %s",
+                request.fullpath,
+                shape["count"],
+                shape["time"] * 1000,
+                shape["shape"],
+            )
+
+        if self.panel:
+            self.add_panel(context, profile, shapes)
+
+    def add_panel(self, context, profile, shapes):
+        panel = DIV(
+            DIV(
+                "%s queries, %.1fms in the database"
+                % (len(profile.statements), profile.db_time * 1000),
+                _class="has-text-weight-bold",
+            ),
+            TABLE(
+                TR(TH("Count"), TH("ms"), TH("Statement")),
+                *[
+                    TR(
+                        TD(shape["count"]),
+                        TD("%.1f" % (shape["time"] * 1000)),
+                        TD(CODE(shape["shape"])),
+                        _class="has-background-warning-light"
+                        if shape["count"] > self.repeats
+                        else "",
+                    )
+                    for shape in shapes
+                ],
+                _class="table is-narrow is-fullwidth",
+            ),
+            _class="box sql-profile",
+        )
+
+        output = context["output"]
+        if isinstance(output, dict):
+            # the template has not rendered yet - layout.html shows it
+            context["template_inject"]["sql_profile"] = panel
+        elif isinstance(output, str) and "</body>" in output:
+            context["output"] = output.replace("</body>", panel.xml() + "</body>", 1)
@@ -0,0 +1,338 @@
+"""
+This file defines the revenue reports: revenue by district, category, shipper and month
+
+    revenue_report.pivot("district", "month", (2024, 1), (2024, 12))
+
+Revenue is the amount of the order lines, unit_price * quantity less the discount,
+freight excluded.  The months are aggregated by the database with one GROUP BY over
+month, district, category and shipper, summing exact integers (cents times the
+percent paid), and a pivot is rolled up from these month aggregates in Python.  Amounts
+are rounded half up to cents once summed, like the order totals.
+
+The months are cached in process memory.  A closed month is kept until an order
+or order line of that month is written through the DAL, a customer or product
+changes district or category, or ttl seconds pass (for writes made by other
+processes).  The written months are dropped again when the transaction ends, so
+a month aggregated by another request before the commit is not kept.  The
+current month, and the ones after it, are computed again after any write to the
+tables they read from.
+"""
+
+import datetime
+import threading
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from . import settings
+from .cache_helpers import after_transaction
+from .common import db, table_versions
+from .formatters import CENTS
+from .models import districts, categories, shippers
+
+# the report dimensions, and the position of the first three in the month aggregates
+DIMENSIONS = ("district", "category", "shipper", "month")
+KEY_POSITIONS = dict(district=0, category=1, shipper=2)
+
+# cents of the line times the percent paid, an integer the database sums exactly
+LINE_AMOUNT = (
+    (db.order_detail.unit_price * 100 + 0.5).cast("integer")
+    * db.order_detail.quantity
+    * (db.order_detail.discount * -100 + 100.5).cast("integer")
+)
+
+
+def period_of(value):
+    """(year, month) of a date, or of an ISO "yyyy-mm-dd" string, None otherwise"""
+    if isinstance(value, datetime.date):
+        return value.year, value.month
+    if isinstance(value, str) and len(value) >= 7 and value[:4].isdigit():
+        return int(value[:4]), int(value[5:7])
+    return None
+
+
+def parse_period(value):
+    """(year, month) of a "yyyy-mm" string, None if it is not one or out of the date range"""
+    try:
+        year, month = [int(part) for part in value.split("-")]
+    except (AttributeError, ValueError):
+        return None
+    # the month after the last one must be a date too
+    if not datetime.MINYEAR <= year < datetime.MAXYEAR or not 1 <= month <= 12:
+        return None
+    return year, month
+
+
+def next_period(period):
+    year, month = period
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def count_periods(first, last):
+    """Number of months from first to last, both included"""
+    return (last[0] - first[0]) * 12 + last[1] - first[1] + 1
+
+
+def periods(first, last):
+    """The months from first to last, both included"""
+    period = first
+    while period <= last:
+        yield period
+        period = next_period(period)
+
+
+def to_amount(value):
+    """Decimal amount of a sum of LINE_AMOUNT"""
+    return (Decimal(value or 0) / 10000).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+class RevenueReport:
+    """
+    Revenue pivots over the orders of db, built from cached month aggregates
+
+    Parameters
+    ----------
+    db: the DAL of the app
+    versions: the TableVersions tracking the tables of the orders
+    ttl: seconds a closed month is kept
+    """
+
+    tablenames = ("order", "order_detail", "customer", "product")
+
+    def __init__(self, db, versions, ttl=3600):
+        self.db = db
+        self.versions = versions
+        self.ttl = ttl
+        self.closed = dict()  # (year, month) -> (time computed, aggregates)
+        self.open = dict()  # (year, month) -> (versions, aggregates)
+        self.generation = 0  # bumped by invalidate and clear
+        self.lock = threading.Lock()
+        self.track()
+
+    def month(self, period):
+        """
+        The revenue of a month as a dict of (district, category, shipper) -> sum of LINE_AMOUNT
+        """
+        return self.months([period])[period]
+
+    def months(self, months):
+        """
+        The revenue of some months as a dict of (year, month) -> the dict of month()
+
+        The months missing from the cache are aggregated together, with one grouped
+        query for the closed months and one for the current month and the ones after.
+        """
+        found = dict()
+        closed = []
+        current = []
+        today = period_of(datetime.date.today())
+        now = time.time()
+        for period in months:
+            if period >= today:
+                current.append(period)
+                continue
+            cached = self.closed.get(period)
+            if cached is None or now - cached[0] > self.ttl:
+                closed.append(period)
+            else:
+                found[period] = cached[1]
+
+        if closed:
+            generation = self.generation
+            aggregates = self.aggregate(closed)
+            with self.lock:
+                # not kept if a month was written while it was aggregated
+                if generation == self.generation:
+                    for period in closed:
+                        self.closed[period] = (now, aggregates[period])
+            found.update(aggregates)
+
+        if current:
+            versions = self.versions(*self.tablenames)
+            stale = []
+            for period in current:
+                cached = self.open.get(period)
+                if cached is None or cached[0] != versions:
+                    stale.append(period)
+                else:
+                    found[period] = cached[1]
+            if stale:
+                aggregates = self.aggregate(stale)
+                with self.lock:
+                    for period in stale:
+                        self.open[period] = (versions, aggregates[period])
+                found.update(aggregates)
+        return found
+
+    def aggregate(self, months):
+        """
+        Compute the revenue of some months with one query grouped by month, as a dict
+        of (year, month) -> the dict of month()
+        """
+        db = self.db
+        first = datetime.date(*min(months), 1)
+        after = datetime.date(*next_period(max(months)), 1)
+        year = db.order.order_date.year()
+        month = db.order.order_date.month()
+        amount = LINE_AMOUNT.sum()
+        keys = [db.customer.district, db.product.category, db.order.shipper]
+        rows = db((db.order.order_date >= first) & (db.order.order_date < after)).select(
+            year,
+            month,
+            *keys,
+            amount,
+            join=db.order_detail.on(db.order_detail.order == db.order.id),
+            left=[
+                db.customer.on(db.customer.id == db.order.customer),
+                db.product.on(db.product.id == db.order_detail.product),
+            ],
+            groupby=year | month | keys[0] | keys[1] | keys[2],
+        )
+        found = {period: dict() for period in months}
+        for row in rows:
+            # the months between the ones asked for are left out
+            aggregates = found.get((row[year], row[month]))
+            if aggregates is not None:
+                key = (row.customer.district, row.product.category, row.order.shipper)
+                aggregates[key] = row[amount]
+        return found
+
+    def last_period(self):
+        """The month of the latest order, None without orders"""
+        latest = self.db.order.order_date.max()
+        return period_of(self.db(self.db.order).select(latest).first()[latest])
+
+    def pivot(self, rows, columns, first, last):
+        """
+        The revenue from month first to month last, by rows and columns
+
+        Parameters
+        ----------
+        rows: the dimension of the rows, one of DIMENSIONS
+        columns: the dimension of the columns, one of DIMENSIONS
+        first, last: the (year, month) of the first and last months, both included
+
+        Returns
+        -------
+        dict(rows=[key], columns=[key], cells={(row key, column key): amount},
+             row_totals={key: amount}, column_totals={key: amount}, total=amount)
+        """
+        cells = dict()
+        for period, aggregates in self.months(list(periods(first, last))).items():
+            for key, value in aggregates.items():
+                cell = (
+                    period if rows == "month" else key[KEY_POSITIONS[rows]],
+                    period if columns == "month" else key[KEY_POSITIONS[columns]],
+                )
+                cells[cell] = cells.get(cell, 0) + value
+
+        row_totals = dict()
+        column_totals = dict()
+        for (row, column), value in cells.items():
+            row_totals[row] = row_totals.get(row, 0) + value
+            column_totals[column] = column_totals.get(column, 0) + value
+        return dict(
+            rows=sorted(row_totals, key=lambda key: sort_key(rows, key)),
+            columns=sorted(column_totals, key=lambda key: sort_key(columns, key)),
+            cells={cell: to_amount(value) for cell, value in cells.items()},
+            row_totals={key: to_amount(value) for key, value in row_totals.items()},
+            column_totals={key: to_amount(value) for key, value in column_totals.items()},
+            total=to_amount(sum(row_totals.values())),
+        )
+
+    def invalidate(self, *months):
+        """Forget the cached revenue of some months"""
+        with self.lock:
+            self.generation += 1
+            for period in months:
+                self.closed.pop(period, None)
+                self.open.pop(period, None)
+
+    def clear(self):
+        """Forget the cached revenue of every month, e.g. after a bulk import"""
+        with self.lock:
+            self.generation += 1
+            self.closed.clear()
+            self.open.clear()
+
+    def written(self, *months):
+        """
+        Invalidate months written in the current transaction, now and again once it
+        ends, so a month aggregated by another thread before the commit is not kept
+        """
+        self.invalidate(*months)
+        for period in months:
+            after_transaction(
+                self.db, (id(self), period), lambda period=period: self.invalidate(period)
+            )
+
+    def cleared(self):
+        """Clear, now and again once the current transaction ends"""
+        self.clear()
+        after_transaction(self.db, (id(self), "clear"), self.clear)
+
+    def track(self):
+        """Register the hooks invalidating the months whose orders are written"""
+        db = self.db
+
+        def order_months(s):
+            s._report_periods = {
+                period_of(row.order_date)
+                for row in s.select(db.order.order_date, distinct=True)
+            }
+
+        def line_months(s):
+            rows = db(s.query & (db.order.id == db.order_detail.order)).select(
+                db.order.order_date, distinct=True
+            )
+            s._report_periods = {period_of(row.order_date) for row in rows}
+
+        def order_month(order_id):
+            order = db.order(order_id) if order_id else None
+            return period_of(order.order_date) if order else None
+
+        db.order._after_insert.append(
+            lambda f, i: self.written(period_of(f.get("order_date")))
+        )
+        db.order._before_update.append(lambda s, f: order_months(s))
+        db.order._after_update.append(
+            lambda s, f: self.written(period_of(f.get("order_date")), *s._report_periods)
+        )
+        db.order._before_delete.append(lambda s: order_months(s))
+        db.order._after_delete.append(lambda s: self.written(*s._report_periods))
+        db.order_detail._after_insert.append(
+            lambda f, i: self.written(order_month(f.get("order")))
+        )
+        db.order_detail._before_update.append(lambda s, f: line_months(s))
+        db.order_detail._after_update.append(
+            lambda s, f: self.written(order_month(f.get("order")), *s._report_periods)
+        )
+        db.order_detail._before_delete.append(lambda s: line_months(s))
+        db.order_detail._after_delete.append(lambda s: self.written(*s._report_periods))
+        # moving customers or products to another district or category changes every month
+        db.customer._after_update.append(
+            lambda s, f: self.cleared() if "district" in f else None
+        )
+        db.customer._after_delete.append(lambda s: self.cleared())
+        db.product._after_update.append(
+            lambda s, f: self.cleared() if "category" in f else None
+        )
+        db.product._after_delete.append(lambda s: self.cleared())
+
+
+def sort_key(dimension, key):
+    if dimension == "month":
+        return key
+    return (key is None, label(dimension, key).lower())
+
+
+def label(dimension, key):
+    """The name shown for a key of a dimension"""
+    if dimension == "month":
+        return "%04d-%02d" % key
+    if key is None:
+        return "N/A"
+    table = dict(district=districts, category=categories, shipper=shippers)[dimension]
+    return table.label(key, str(key))
+
+
+revenue_report = RevenueReport(db, table_versions, ttl=settings.REPORT_CACHE_TTL)
@@ -0,0 +1,256 @@
+"""
+This file defines helpers that bring an existing database in line with models.py
+
+The tutorial database is copied into the databases folder and opened with
+DB_FAKE_MIGRATE = True, so pydal never alters it.  The helpers here make the
+additive schema changes the models rely on.  The indexes and tables are checked
+on every start, the columns are added by migrate.py.
+"""
+
+from decimal import Decimal
+
+
+def ensure_columns(table):
+    """
+    Add the columns defined on table that are missing from an existing SQLite table
+
+    Parameters
+    ----------
+    table: the pydal table to check
+
+    Returns
+    -------
+    the list of field names that were added
+    """
+    db = table._db
+    added = []
+    types = db._adapter.types
+    for name in missing_columns(table):
+        field = table[name]
+        if field.type.startswith("decimal"):
+            precision, scale = map(int, field.type[8:-1].split(","))
+            sqltype = types["decimal"] % dict(precision=precision, scale=scale)
+        else:
+            sqltype = types[field.type] % dict(length=field.length)
+        default = field.default if type(field.default) in (int, float, Decimal) else None
+        db.executesql(
+            f"ALTER TABLE {table._rname} ADD COLUMN {field._rname} {sqltype}"
+            + (f" DEFAULT {default}" if default is not None else "")
+            + ";"
+        )
+        added.append(field.name)
+    return added
+
+
+def missing_columns(table):
+    """
+    The names of the fields of table that an existing SQLite table has no column for
+
+    References are left out, ensure_columns cannot add them.
+    """
+    db = table._db
+    if db._dbname != "sqlite":
+        return []
+
+    existing = {
+        row[1] for row in db.executesql(f"PRAGMA table_info({table._rname});")
+    }
+    if not existing:
+        # the table has not been created yet - pydal migrations will create it
+        return []
+    return [
+        field.name
+        for field in table
+        if field.name not in existing and not field.type.startswith(("reference", "id"))
+    ]
+
+
+def define_index(table, name, *columns, unique=False, where=None):
+    """
+    Declare an index on table, created or updated by migrate_indexes
+
+    Declare the indexes right after db.define_table:
+
+        define_index(db.order, "order_customer_date", "customer", "order_date")
+        define_index(db.product, "product_name_nocase", "name COLLATE NOCASE")
+        define_index(db.order, "order_unshipped", "required_date", where="shipped_date IS NULL")
+
+    Parameters
+    ----------
+    table: the pydal table to index
+    name: the index name
+    columns: the indexed fields or column names, each may carry a COLLATE or ASC/DESC clause
+    unique: create a unique index
+    where: optional condition (SQL string or pydal query) making a partial index
+    """
+    if "_declared_indexes" not in table.__dict__:
+        table._declared_indexes = dict()
+    if where is not None and not isinstance(where, str):
+        where = table._db._adapter.expand(where)
+    columns = [
+        column._rname if hasattr(column, "_rname") else column for column in columns
+    ]
+    table._declared_indexes[name] = (
+        "CREATE %sINDEX %s ON %s (%s)"
+        % ("UNIQUE " if unique else "", name, table._rname, ", ".join(columns))
+        + (" WHERE %s" % where if where else "")
+    )
+
+
+def migrate_indexes(db):
+    """
+    Create the indexes declared with define_index, and rebuild the ones whose definition changed
+
+    Indexes that are no longer declared are left alone.
+
+    Returns
+    -------
+    the list of index names that were created or rebuilt
+    """
+    if db._dbname != "sqlite":
+        return []
+
+    changed = []
+    for tablename in db.tables:
+        table = db[tablename]
+        declared = table.__dict__.get("_declared_indexes")
+        if not declared or not table_exists(table):
+            continue
+        existing = dict(
+            db.executesql(
+                "SELECT name, sql FROM sqlite_master WHERE type='index' AND tbl_name=?;",
+                (tablename,),
+            )
+        )
+        for name, sql in declared.items():
+            if existing.get(name) == sql:
+                continue
+            if name in existing:
+                db.executesql("DROP INDEX %s;" % name)
+            db.executesql(sql + ";")
+            changed.append(name)
+    return changed
+
+
+def index_report(db):
+    """
+    Report the declared indexes and the foreign keys no index can be used for
+
+    A reference column is covered when it is the first column of an index.
+
+    Returns
+    -------
+    dict(indexes=[{table, name, sql}], missing=[names of declared indexes not in the database],
+         unindexed_references=["table.field", ...])
+    """
+    if db._dbname != "sqlite":
+        return dict(indexes=[], missing=[], unindexed_references=[])
+
+    indexes = []
+    missing = []
+    unindexed = []
+    for tablename in db.tables:
+        table = db[tablename]
+        if not table_exists(table):
+            continue
+        existing = {
+            name: sql
+            for name, sql in db.executesql(
+                "SELECT name, sql FROM sqlite_master WHERE type='index' AND tbl_name=?;",
+                (tablename,),
+            )
+        }
+        for name, sql in table.__dict__.get("_declared_indexes", {}).items():
+            indexes.append(dict(table=tablename, name=name, sql=sql))
+            if existing.get(name) != sql:
+                missing.append(name)
+
+        leading = set()
+        for name in existing:
+            info = db.executesql("PRAGMA index_info(%s);" % name)
+            if info:
+                leading.add(min(info)[2])
+        for field in table:
+            if field.type.startswith("reference") and field.name not in leading:
+                unindexed.append("%s.%s" % (tablename, field.name))
+
+    return dict(indexes=indexes, missing=missing, unindexed_references=unindexed)
+
+
+def ensure_table(table):
+    """
+    Create table in an existing SQLite database, where DB_FAKE_MIGRATE keeps pydal from doing it
+
+    Returns
+    -------
+    True if the table was created
+    """
+    db = table._db
+    if db._dbname != "sqlite" or table_exists(table):
+        return False
+    db.executesql(db._adapter.create_table(table, migrate=False))
+    return True
+
+
+def table_exists(table):
+    return bool(
+        table._db.executesql(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?;",
+            (table._tablename,),
+        )
+    )
+
+
+def ensure_fulltext(table, *fieldnames):
+    """
+    Create a SQLite FTS5 index on fieldnames of table, kept in sync by triggers
+
+    The index is an external content table named <tablename>_fts whose rowid is
+    the id of the indexed row.  It is filled from the existing rows when created.
+
+    Parameters
+    ----------
+    table: the pydal table to index
+    fieldnames: the text fields to index
+
+    Returns
+    -------
+    True if the index was just created
+    """
+    db = table._db
+    if db._dbname != "sqlite" or not table_exists(table):
+        return False
+
+    tablename = table._tablename
+    fts = f"{tablename}_fts"
+    if db.executesql("SELECT 1 FROM sqlite_master WHERE name=?;", (fts,)):
+        return False
+
+    columns = ", ".join(fieldnames)
+    new_values = ", ".join(f"new.{name}" for name in fieldnames)
+    old_values = ", ".join(f"old.{name}" for name in fieldnames)
+    db.executesql(
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({columns}, content='{tablename}', "
+        f"content_rowid='id', prefix='2 3', tokenize='unicode61 remove_diacritics 2');"
+    )
+    db.executesql(
+        f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table._rname} BEGIN "
+        f"INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values}); END;"
+    )
+    db.executesql(
+        f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table._rname} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END;"
+    )
+    db.executesql(
+        f"CREATE TRIGGER {fts}_au AFTER UPDATE OF {columns} ON {table._rname} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values}); END;"
+    )
+    db.executesql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild');")
+    return True
+
+
+def optimize_fulltext(table):
+    """Merge the segments of the FTS5 index of table, see ensure_fulltext"""
+    fts = f"{table._tablename}_fts"
+    table._db.executesql(f"INSERT INTO {fts}({fts}) VALUES ('optimize');")
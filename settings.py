@@ -16,9 +16,19 @@ APP_NAME = os.path.split(APP_FOLDER)[-1]
 #               and is the store location for SQLite databases
 DB_FOLDER = required_folder(APP_FOLDER, "databases")
 DB_URI = "sqlite://grid_tutorial.db"
-DB_POOL_SIZE = 1
+DB_POOL_SIZE = 10  # connections kept open between requests (see sqlite_pool.py)
+DB_READ_POOL_SIZE = 10  # query_only connections kept for the grid pages, 0 to not use them
 DB_MIGRATE = True
 DB_FAKE_MIGRATE = True  # maybe?
+# run on every new SQLite connection
+SQLITE_PRAGMAS = dict(
+    journal_mode="WAL",  # readers and the writer no longer block each other
+    synchronous="NORMAL",  # with WAL, fsync at checkpoints only, still safe on crash
+    mmap_size=256 * 1024 * 1024,  # bytes of the file read through memory mapping
+    cache_size=-16000,  # KiB of page cache, per connection
+    busy_timeout=5000,  # ms a writer waits for the lock before "database is locked"
+    temp_store="MEMORY",  # temporary tables and indexes of sorts stay in memory
+)
 
 # location where static files are stored:
 STATIC_FOLDER = required_folder(APP_FOLDER, "static")
@@ -93,9 +103,35 @@ LDAP_SETTINGS = {
 # i18n settings
 T_FOLDER = required_folder(APP_FOLDER, "translations")
 
-# Celery settings
-USE_CELERY = False
-CELERY_BROKER = "redis://localhost:6379/0"
+# customer searches: False matches the text anywhere in the fields (LIKE '%value%'),
+# True matches words by prefix through a SQLite FTS5 index, ranked (see schema.ensure_fulltext)
+FULLTEXT_SEARCH = False
+
+# sql profiler settings (see profiler.py)
+# add X-SQL-Queries / X-SQL-Time headers to every response, off unless SQL_PROFILER=1
+SQL_PROFILER = os.environ.get("SQL_PROFILER") == "1"
+SQL_PROFILER_REPEATS = 10  # warn when one statement runs more times in a request
+SQL_PROFILER_PANEL = False  # show the statements at the bottom of the pages
+
+# product price cache used when order lines are written (see models.py)
+PRODUCT_PRICE_CACHE_SIZE = 10000  # number of products kept
+PRODUCT_PRICE_CACHE_TTL = 300  # seconds, prices updated by another process show up after this
+
+# groups of the users, loaded once per request by the GroupMembership fixture (see common.py)
+GROUP_CACHE_SIZE = 1000  # number of users kept
+GROUP_CACHE_TTL = 60  # seconds, tags written by another process show up after this
+
+# revenue of the closed months, kept by the reports (see reporting.py)
+REPORT_CACHE_TTL = 3600  # seconds, orders written by another process show up after this
+REPORT_MAX_MONTHS = 120  # longest range of months a pivot may cover
+
+# background jobs, run by worker threads of every process (see jobs.py and tasks.py)
+# worker threads, 0 to not run jobs in this process (the command line scripts set JOB_WORKERS=0)
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_POLL = 1.0  # seconds an idle worker waits before looking for due jobs again
+JOB_LEASE = 300  # seconds a job may run before another worker takes it over
+JOB_MAX_ATTEMPTS = 3  # times a failing job is tried
+JOB_RETRY_DELAY = 30  # seconds before the first retry, doubled on each attempt
 
 # try import private settings
 try:
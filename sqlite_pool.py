@@ -0,0 +1,130 @@
+"""
+This file defines the SQLite performance profile of the app: pragmas and connection pools
+
+    db = DAL(uri, pool_size=10, after_connection=sqlite_pragmas(settings.SQLITE_PRAGMAS))
+    enable_sqlite_pool(db, 10)
+    read_only = ReadOnlyPool(db, size=10)
+
+    @action.uses(profiler, "grid.html", session, db, read_only)
+
+The pydal SQLite adapter turns its connection pool off, so every request opens a
+new connection, registers the SQL functions and starts over with an empty page
+cache.  enable_sqlite_pool turns the pool back on, and the pragmas (WAL journal,
+synchronous, mmap and cache size, busy timeout) run once on every new connection.
+With WAL, readers no longer wait for the writer and the writer no longer waits
+for them.
+
+ReadOnlyPool keeps a second pool of connections opened with query_only, used by
+the GET requests of the actions listing it that show rows (grid select and
+details modes).  Those requests never hold the write pool connections, and a
+write attempted by mistake fails instead of taking the database lock.
+"""
+
+import threading
+
+from py4web import request
+from py4web.core import Fixture
+from py4web.utils.grid import Grid
+
+
+def sqlite_pragmas(pragmas):
+    """
+    The after_connection hook of the DAL running PRAGMA name=value for each of pragmas
+
+    Parameters
+    ----------
+    pragmas: dict of pragma name -> value, e.g. dict(journal_mode="WAL", busy_timeout=5000)
+    """
+    statements = ["PRAGMA %s=%s;" % (name, value) for name, value in pragmas.items()]
+
+    def after_connection(adapter):
+        if adapter.dbengine == "sqlite":
+            for statement in statements:
+                adapter.execute(statement)
+
+    return after_connection
+
+
+def enable_sqlite_pool(db, size):
+    """
+    Keep up to size SQLite connections of db open between requests
+
+    The connections are local files that cannot be dropped by a server, so they
+    are not tested with a query when taken from the pool.
+    """
+    adapter = db._adapter
+    if adapter.dbengine == "sqlite" and ":memory" not in adapter.uri.split("://", 1)[0]:
+        adapter.pool_size = size
+        adapter.check_active_connection = False
+
+
+class ReadOnlyPool(Fixture):
+    """
+    Fixture running the reads of grid pages on pooled query_only connections
+
+    List it right after db.  GET and HEAD requests in select or details mode use a
+    connection of this pool for the action, other requests keep the db connection.
+
+    Parameters
+    ----------
+    db: the DAL fixture
+    size: number of read connections kept open
+    """
+
+    def __init__(self, db, size=10):
+        self.db = db
+        self.size = size
+        self.pool = []
+        self.lock = threading.Lock()
+
+    def enabled(self):
+        return (
+            self.size
+            and self.db._adapter.dbengine == "sqlite"
+            and request.method in ("GET", "HEAD")
+            and Grid.parse(request.query)["mode"] in ("select", "details")
+        )
+
+    def on_request(self, context):
+        self.local_initialize(self)
+        self.local.connection = None
+        if not self.enabled():
+            return
+        adapter = self.db._adapter
+        # the write connection db took goes back to its pool unused
+        adapter.close("commit")
+        with self.lock:
+            connection = self.pool.pop() if self.pool else None
+        if connection is None:
+            connection = adapter.connector()
+            adapter.set_connection(connection, run_hooks=True)
+            adapter.execute("PRAGMA query_only=ON;")
+        else:
+            adapter.set_connection(connection, run_hooks=False)
+        self.local.connection = connection
+
+    def release(self):
+        connection = self.local.connection
+        self.local_delete(self)
+        if connection is None:
+            return
+        adapter = self.db._adapter
+        try:
+            connection.rollback()
+            adapter.cursor.close()
+        except Exception:
+            connection = None
+        # db finds no connection left to commit and recycle
+        adapter.set_connection(None)
+        with self.lock:
+            if connection is not None and len(self.pool) < self.size:
+                self.pool.append(connection)
+                connection = None
+        if connection is not None:
+            connection.close()
+
+    def on_success(self, context):
+        self.release()
+
+    def on_error(self, context):
+        self.release()
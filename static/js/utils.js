@@ -373,8 +373,58 @@ Q.handle_flash = function() {
     }    
 };
 
+// Autocomplete for reference fields rendered by grid_helpers.AutocompleteWidget
+Q.autocomplete = function (elem) {
+    if (elem.dataset.autocompleteReady) return;
+    elem.dataset.autocompleteReady = true;
+    var hidden = Q('input[type=hidden]', elem)[0];
+    var text = Q('input[type=text]', elem)[0];
+    var content = Q('.dropdown-content', elem)[0];
+    var query = '';
+    var page = 0;
+    var load = function () {
+        var url = elem.dataset.autocomplete + '?q=' + encodeURIComponent(query) + '&page=' + page;
+        Q.ajax('GET', url).then(function (res) {
+            var data = res.json();
+            if (page == 0) content.innerHTML = '';
+            Q('.autocomplete-more', content).forEach(function (item) { item.remove(); });
+            data.items.forEach(function (row) {
+                var item = document.createElement('a');
+                item.className = 'dropdown-item';
+                item.textContent = row.label;
+                item.onmousedown = function (event) {
+                    event.preventDefault();
+                    hidden.value = row.id;
+                    text.value = row.label;
+                    elem.classList.remove('is-active');
+                };
+                content.appendChild(item);
+            });
+            if (data.more) {
+                var more = document.createElement('a');
+                more.className = 'dropdown-item autocomplete-more';
+                more.textContent = '...';
+                more.onmousedown = function (event) { event.preventDefault(); page++; load(); };
+                content.appendChild(more);
+            }
+            elem.classList.toggle('is-active', data.items.length > 0);
+        });
+    };
+    text.oninput = Q.debounce(function () {
+        query = text.value.trim();
+        page = 0;
+        if (!query) hidden.value = '';
+        load();
+    }, 250);
+    text.onblur = function () { elem.classList.remove('is-active'); };
+};
+
 Q.handle_components();
 Q.handle_flash();
+Q('[data-autocomplete]').forEach(Q.autocomplete);
+document.addEventListener('htmx:load', function (event) {
+    Q('[data-autocomplete]', event.target).forEach(Q.autocomplete);
+});
 Q('input[type=text].type-list-string').forEach(function(elem){Q.tags_input(elem);});
 Q('input[type=text].type-list-integer').forEach(function(elem){Q.tags_input(elem, {regex:/[-+]?[\d]+/});});
 Q('input[name=password],input[name=new_password]').forEach(Q.score_input);
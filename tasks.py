@@ -1,36 +1,50 @@
 """
-To use celery tasks:
-1) pip install -U "celery[redis]"
-2) In settings.py:
-   USE_CELERY = True
-   CELERY_BROKER = "redis://localhost:6379/0"
-3) Start "redis-server"
-4) Start "celery -A apps.{appname}.tasks beat"
-5) Start "celery -A apps.{appname}.tasks worker --loglevel=info" for each worker
+This file defines the background jobs of the app, run by the workers of common.jobs
 
+    from .common import jobs
+    jobs.enqueue("order_totals")
+
+The jobs are queued in the job table of the app database and run by worker
+threads, no broker is needed (see jobs.py).  Importing this file only defines
+the jobs, the workers are started by start_workers(), called by __init__.py in
+every process serving the app.  Set JOB_WORKERS = 0 in settings_private.py to
+keep a process from running jobs, they are then run by the processes that do.
 """
 
-from .common import settings, scheduler, db, Field
-
-
-# example of task that needs db access
-@scheduler.task
-def my_task():
-    try:
-        # this task will be executed in its own thread, connect to db
-        db._adapter.reconnect()
-        # do something here
-        db.commit()
-    except:
-        # rollback on failure
-        db.rollback()
-
-
-# run my_task every 10 seconds
-scheduler.conf.beat_schedule = {
-    "my_first_task": {
-        "task": "apps.%s.tasks.my_task" % settings.APP_NAME,
-        "schedule": 10.0,
-        "args": (),
-    },
-}
+from .common import settings, jobs, db
+from .models import product_needs_reorder, verify_order_totals
+from .schema import optimize_fulltext, table_exists
+
+
+@jobs.job("order_totals", every=24 * 3600, lease=1800)
+def order_totals():
+    """Rebuild the stored order totals that drifted from their lines"""
+    result = verify_order_totals(fix=True)
+    return dict(checked=result["checked"], fixed=len(result["drifted"]))
+
+
+@jobs.job("search_index", every=24 * 3600)
+def search_index():
+    """Merge the segments the writes added to the customer full-text index"""
+    if db._dbname == "sqlite" and table_exists(db.customer_fts):
+        optimize_fulltext(db.customer)
+
+
+
+@jobs.job("low_stock", every=3600)
+def low_stock():
+    """The products to reorder, listed in the result of the job"""
+    rows = db(product_needs_reorder).select(
+        db.product.id,
+        db.product.name,
+        db.product.in_stock,
+        db.product.reorder_level,
+        orderby=db.product.name,
+    )
+    return dict(count=len(rows), products=rows.as_list())
+
+
+def start_workers():
+    """Start the job workers of this process, none with settings.JOB_WORKERS = 0"""
+    if settings.JOB_WORKERS:
+        jobs.start()
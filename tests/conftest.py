@@ -0,0 +1,57 @@
+"""
+This file defines the fixtures of the tests, run with python -m pytest from the app folder
+
+The modules of the app are imported as a package of their own, without running
+__init__.py (the actions are not needed), with settings pointing at a scratch
+SQLite database in a temporary folder and without job workers.
+"""
+
+import atexit
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+import types
+
+import pytest
+
+APP_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_NAME = os.path.basename(APP_FOLDER)
+
+os.environ["JOB_WORKERS"] = "0"
+
+# registered before pytest collects the app folder, which would import __init__.py
+# and with it the actions and the database of settings.py
+package = types.ModuleType(APP_NAME)
+package.__path__ = [APP_FOLDER]
+package.__file__ = os.path.join(APP_FOLDER, "__init__.py")
+sys.modules.setdefault(APP_NAME, package)
+settings = importlib.import_module(APP_NAME + ".settings")
+settings.DB_FOLDER = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, settings.DB_FOLDER, True)
+settings.DB_URI = "sqlite://tests.db"
+settings.DB_MIGRATE = True
+settings.DB_FAKE_MIGRATE = False
+
+
+def app_module(name):
+    """A module of the app, e.g. app_module("models")"""
+    return importlib.import_module("%s.%s" % (APP_NAME, name))
+
+
+@pytest.fixture
+def db():
+    """The DAL of the app, every row written by the test is deleted afterwards"""
+    db = app_module("models").db
+    yield db
+    db.rollback()
+    for tablename in db.tables:
+        # customer_fts only exists with settings.FULLTEXT_SEARCH
+        if app_module("schema").table_exists(db[tablename]):
+            db.executesql("DELETE FROM %s;" % db[tablename]._rname)
+    db.commit()
+    # the rows went around the hooks, drop what the caches know about them
+    app_module("common").table_versions.bump(*db.tables)
+    app_module("models").product_prices.clear()
+    app_module("reporting").revenue_report.clear()
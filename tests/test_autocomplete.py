@@ -0,0 +1,24 @@
+def hidden_and_label(db, vars):
+    """The posted value and the shown label of the district widget of a form"""
+    widget = db.customer.district.widget(db.customer, vars)
+    hidden, text = widget.find("input")
+    return hidden["_value"], text["_value"]
+
+
+def test_new_forms_show_the_default(db, monkeypatch):
+    north = db.district.insert(name="North")
+    monkeypatch.setattr(db.customer.district, "default", north)
+
+    assert hidden_and_label(db, {}) == (north, "North")
+    monkeypatch.setattr(db.customer.district, "default", lambda: north)
+    assert hidden_and_label(db, {}) == (north, "North")
+
+
+def test_edit_forms_show_the_value(db, monkeypatch):
+    north = db.district.insert(name="North")
+    south = db.district.insert(name="South")
+    monkeypatch.setattr(db.customer.district, "default", north)
+
+    assert hidden_and_label(db, dict(district=south)) == (south, "South")
+    # a value cleared by the user stays cleared
+    assert hidden_and_label(db, dict(district=None)) == ("", "")
@@ -0,0 +1,78 @@
+import sqlite3
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+from py4web import HTTP, request, response
+
+from conftest import app_module
+
+common = app_module("common")
+grid_helpers = app_module("grid_helpers")
+
+
+def serve(tag, method="GET", query="", session=None, **headers):
+    """Run the fixture for a request, returns the ETag it set, raises HTTP(304)"""
+    environ = dict(REQUEST_METHOD=method, QUERY_STRING=query, PATH_INFO="/crud")
+    for name, value in headers.items():
+        environ["HTTP_" + name.upper()] = value
+    setup_testing_defaults(environ)
+    request.__init__(environ)
+    response.__init__()
+    tag.session = session if session is not None else dict(uuid="a", user=dict(id=1))
+    tag.on_request({})
+    return response.headers.get("ETag")
+
+
+@pytest.fixture
+def tag(db):
+    return grid_helpers.GridETag(common.table_versions, "customer", session=None)
+
+
+def test_matching_requests_get_a_304(db, tag):
+    etag = serve(tag)
+    assert etag
+
+    with pytest.raises(HTTP) as answer:
+        serve(tag, IF_NONE_MATCH='"other", %s' % etag)
+    assert answer.value.status == 304
+    # other cookies do not change the tag
+    with pytest.raises(HTTP):
+        serve(tag, IF_NONE_MATCH=etag, COOKIE="theme=dark")
+
+
+def test_tags_depend_on_the_request_and_the_user(db, tag):
+    etag = serve(tag)
+
+    assert serve(tag, query="page=2") != etag
+    assert serve(tag, HX_REQUEST="true", HX_TARGET="#grid") != etag
+    assert serve(tag, session=dict(uuid="b", user=dict(id=1))) != etag
+    assert serve(tag, session=dict(uuid="a", user=dict(id=2))) != etag
+    assert serve(tag) == etag
+
+
+def test_writes_change_the_tag(db, tag):
+    etag = serve(tag)
+    db.district.insert(name="North")
+    db.commit()
+    assert serve(tag) == etag
+
+    db.customer.insert(name="Alfreds")
+    db.commit()
+    written = serve(tag)
+    assert written != etag
+
+    # a write committed by another process, through its stored version
+    connection = sqlite3.connect(db._adapter.dbpath)
+    connection.execute(
+        "UPDATE table_version SET version = version + 1 WHERE tablename = 'customer';"
+    )
+    connection.commit()
+    connection.close()
+    assert serve(tag) != written
+
+
+@pytest.mark.parametrize(
+    "method, query", [("POST", ""), ("GET", "mode=edit&id=1"), ("GET", "mode=new")]
+)
+def test_only_pages_showing_rows_are_tagged(db, tag, method, query):
+    assert serve(tag, method, query) is None
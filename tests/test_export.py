@@ -0,0 +1,106 @@
+import csv
+import io
+import json
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+from py4web import request, response
+
+from conftest import app_module
+
+grid_helpers = app_module("grid_helpers")
+
+
+@pytest.fixture
+def customers(db):
+    titles = ["Owner", None, "Sales Agent", "Owner", None, "President", "Owner"]
+    for i, title in enumerate(titles):
+        db.customer.insert(name="Customer %s" % i, title=title)
+    db.commit()
+    return db.customer
+
+
+def export(db, query_string="", batch_size=2, orderby=None, export_format="csv"):
+    """The chunks of the export of a customer grid for a GET of query_string"""
+    environ = dict(REQUEST_METHOD="GET", QUERY_STRING=query_string)
+    setup_testing_defaults(environ)
+    request.__init__(environ)
+    response.__init__()
+    grid = grid_helpers.KeysetGrid(
+        db.customer,
+        columns=[
+            db.customer.name,
+            grid_helpers.ExportColumn(
+                "Title",
+                lambda row: "",
+                required_fields=[db.customer.title],
+                export=lambda row: (row["customer.title"] or "").upper(),
+            ),
+        ],
+        orderby=orderby or db.customer.title,
+        search_queries=[["name", lambda value: db.customer.name.contains(value)]],
+        auto_process=False,
+    )
+    chunks = list(grid.export(export_format, batch_size=batch_size))
+    # the export gave back the connection it took, the test goes on with another one
+    assert db._adapter.cursor is None
+    db._adapter.reconnect()
+    return chunks
+
+
+def rows(chunks):
+    return list(csv.reader(io.StringIO(b"".join(chunks).decode("utf8"))))
+
+
+def test_the_rows_are_sent_a_batch_at_a_time(db, customers):
+    chunks = export(db)
+
+    assert len(chunks) == 4
+    assert rows(chunks[:1]) == [
+        ["customer.name", "Title"],
+        ["Customer 1", ""],
+        ["Customer 4", ""],
+    ]
+    assert rows(chunks) == rows(export(db, batch_size=1000))
+    assert [row[0] for row in rows(chunks)[1:]] == [
+        "Customer %s" % i for i in (1, 4, 0, 3, 6, 5, 2)
+    ]
+    disposition = response.headers["Content-Disposition"]
+    assert disposition == 'attachment; filename="customer.csv"'
+
+
+def test_the_rows_are_read_while_the_body_is_sent(db, customers):
+    environ = dict(REQUEST_METHOD="GET", QUERY_STRING="")
+    setup_testing_defaults(environ)
+    request.__init__(environ)
+    grid = grid_helpers.KeysetGrid(
+        db.customer, orderby=db.customer.name, auto_process=False
+    )
+    del db._timings[:]
+
+    body = grid.export("jsonl", batch_size=2)
+    assert db._timings == []
+    first = next(body)
+    assert len(first.splitlines()) == 2
+    assert len([sql for sql, _ in db._timings if sql.startswith("SELECT")]) == 1
+    assert json.loads(first.splitlines()[0])["customer.name"] == "Customer 0"
+    body.close()
+    assert db._adapter.cursor is None
+    db._adapter.reconnect()
+
+
+def test_the_search_and_sort_of_the_request_apply(db, customers):
+    chunks = export(db, "search_type=0&search_string=1&orderby=~customer.name")
+    assert rows(chunks)[1:] == [["Customer 1", ""]]
+    chunks = export(db, "orderby=~customer.name")
+    assert [row[0] for row in rows(chunks)[1:3]] == ["Customer 6", "Customer 5"]
+
+
+def test_sql_orderby_pages_by_offset(db, customers):
+    chunks = export(db, orderby="customer.title DESC", batch_size=3)
+
+    titles = ["SALES AGENT", "PRESIDENT", "OWNER", "OWNER", "OWNER", "", ""]
+    assert [row[1] for row in rows(chunks)[1:]] == titles
+    assert rows(chunks) == rows(
+        export(db, orderby="customer.title DESC", batch_size=1000)
+    )
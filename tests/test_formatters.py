@@ -0,0 +1,58 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+
+from conftest import app_module
+
+formatters = app_module("formatters")
+
+
+@pytest.mark.parametrize(
+    "value, shown",
+    [
+        (datetime.date(2024, 3, 7), "03/07/2024"),
+        (datetime.datetime(2024, 12, 31, 23, 59), "12/31/2024"),
+        ("2024-03-07", "03/07/2024"),
+        ("2024-03-07 10:30:00", "03/07/2024"),
+        ("07/03/2024", ""),
+        ("2024-3-7", ""),
+        (None, ""),
+        (20240307, ""),
+    ],
+)
+def test_format_date(value, shown):
+    assert formatters.format_date(value) == shown
+
+
+@pytest.mark.parametrize(
+    "value, shown",
+    [
+        (datetime.datetime(2024, 3, 7, 9, 5, 59), "03/07/2024 09:05"),
+        ("2024-03-07T09:05:59", "03/07/2024 09:05"),
+        ("2024-03-07", "03/07/2024 00:00"),
+        (datetime.date(2024, 3, 7), "03/07/2024"),
+        ("tomorrow", ""),
+    ],
+)
+def test_format_datetime(value, shown):
+    assert formatters.format_datetime(value) == shown
+
+
+@pytest.mark.parametrize(
+    "value, shown",
+    [
+        (Decimal("1234.5"), "1234.50"),
+        (Decimal("0.125"), "0.13"),
+        (Decimal("-0.125"), "-0.13"),
+        (Decimal("2.675"), "2.68"),
+        # floats are taken as they print, not as their binary value
+        (2.675, "2.68"),
+        (3, "3.00"),
+        ("18", "18.00"),
+        ("eighteen", ""),
+        (None, ""),
+    ],
+)
+def test_format_decimal(value, shown):
+    assert formatters.format_decimal(value) == shown
@@ -0,0 +1,82 @@
+import pytest
+
+from conftest import app_module
+
+grid_helpers = app_module("grid_helpers")
+schema = app_module("schema")
+
+
+@pytest.fixture
+def customers(db):
+    """Customers indexed by a customer_fts created for the test"""
+    for name, contact, title in [
+        ("John Smith Ltd", "Maria Anders", "Owner"),
+        ("Smithson", "Jonas Müller", "Sales Agent"),
+        ("Around the Horn", "Thomas Hardy", "Sales Representative"),
+    ]:
+        db.customer.insert(name=name, contact=contact, title=title)
+    assert schema.ensure_fulltext(db.customer, "name", "contact", "title")
+    db.commit()
+    yield db.customer
+    db.rollback()
+    for trigger in ("ai", "ad", "au"):
+        db.executesql("DROP TRIGGER customer_fts_%s;" % trigger)
+    db.executesql("DROP TABLE customer_fts;")
+    db.commit()
+
+
+def names(db, query, orderby=None):
+    rows = db(query).select(db.customer.name, orderby=orderby or db.customer.name)
+    return [row.name for row in rows]
+
+
+def search(db, value, columns=None):
+    return names(db, grid_helpers.fulltext_query(db.customer, value, columns))
+
+
+def test_every_word_matches_as_a_prefix(db, customers):
+    assert search(db, "jo sm") == ["John Smith Ltd", "Smithson"]
+    assert search(db, "smith") == ["John Smith Ltd", "Smithson"]
+    assert search(db, "smith maria") == ["John Smith Ltd"]
+    # accents are ignored, quotes are only text
+    assert search(db, "muller") == ["Smithson"]
+    assert search(db, '"horn') == ["Around the Horn"]
+    assert search(db, "  ") == ["Around the Horn", "John Smith Ltd", "Smithson"]
+
+
+def test_columns_restrict_the_match(db, customers):
+    assert search(db, "jo", ["contact"]) == ["Smithson"]
+    assert search(db, "sales", ["name"]) == []
+    assert names(db, grid_helpers.text_query(db.customer, "sales", ["title"], True)) == [
+        "Around the Horn",
+        "Smithson",
+    ]
+
+
+def test_the_rank_can_order_the_matches(db, customers):
+    query = grid_helpers.fulltext_query(db.customer, "smith")
+    ranked = names(db, query, orderby=db.customer_fts.rank)
+
+    assert sorted(ranked) == ["John Smith Ltd", "Smithson"]
+
+
+def test_the_triggers_keep_the_index_current(db, customers):
+    new = db.customer.insert(name="Smith & Sons", contact="Ann Devon")
+    assert search(db, "smith") == ["John Smith Ltd", "Smith & Sons", "Smithson"]
+
+    db(db.customer.id == new).update(name="Devon Foods")
+    assert search(db, "smith") == ["John Smith Ltd", "Smithson"]
+    assert search(db, "devon foods") == ["Devon Foods"]
+
+    db(db.customer.id == new).delete()
+    assert search(db, "devon") == []
+
+
+def test_like_search_stays_the_default(db):
+    db.customer.insert(name="Blauer See", title="Sales Agent")
+    db.customer.insert(name="Bólido", title="Owner")
+
+    query = grid_helpers.text_query(db.customer, "uer s", ["name", "title"])
+    # substrings across word boundaries, no index needed
+    assert names(db, query) == ["Blauer See"]
+    assert names(db, grid_helpers.text_query(db.customer, "own", ["title"])) == ["Bólido"]
@@ -0,0 +1,134 @@
+import re
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+from py4web import request
+
+from conftest import app_module
+
+common = app_module("common")
+cache_helpers = app_module("cache_helpers")
+grid_helpers = app_module("grid_helpers")
+
+
+@pytest.fixture
+def customers(db):
+    for i in range(7):
+        db.customer.insert(name="Customer %s" % i)
+    db.commit()
+    return db.customer
+
+
+def grid(db, query_string="", **attributes):
+    """A KeysetGrid of the customers, 2 by page, processed for a GET of query_string"""
+    environ = dict(REQUEST_METHOD="GET", QUERY_STRING=query_string)
+    setup_testing_defaults(environ)
+    request.__init__(environ)
+    attributes = dict(
+        dict(create=False, details=False, editable=False, deletable=False), **attributes
+    )
+    return grid_helpers.KeysetGrid(
+        db.customer,
+        columns=[db.customer.name],
+        orderby=db.customer.name,
+        rows_per_page=2,
+        **attributes,
+    )
+
+
+def queries(db, f, pattern):
+    """The number of statements matching pattern run by f()"""
+    # pydal keeps the last 100 statements of the thread
+    del db._timings[:]
+    f()
+    return len([sql for sql, _ in db._timings if re.search(pattern, sql)])
+
+
+def next_link(html):
+    links = re.findall(r'<a [^>]*href="[^"?]*\?([^"]*)"[^>]*>Next</a>', html)
+    return links[0].replace("&amp;", "&") if links else None
+
+
+def test_counts_are_cached_until_the_table_is_written(db, customers):
+    count_cache = cache_helpers.versioned_cache(
+        common.cache, common.table_versions, "customer"
+    )
+
+    def count():
+        return grid(db, count_cache=count_cache).total_number_of_rows
+
+    assert queries(db, count, "COUNT") == 1
+    assert queries(db, count, "COUNT") == 0
+    assert count() == 7
+    db.customer.insert(name="Customer 7")
+    db.commit()
+    assert queries(db, count, "COUNT") == 1
+    assert count() == 8
+
+
+def test_counts_stop_at_count_limit(db, customers):
+    page = grid(db, count_limit=3)
+    assert not page.count_exact
+    assert page.has_more
+    assert "of more than 2" in page.render().xml()
+
+    # the pager follows the rows one page past the last count
+    names = []
+    query_string = ""
+    while query_string is not None:
+        page = grid(db, query_string, count_limit=3)
+        names += [row.name for row in page.rows]
+        html = page.render().xml()
+        assert ">Last<" not in html
+        query_string = next_link(html)
+    assert names == ["Customer %s" % i for i in range(7)]
+    assert not page.has_more
+
+
+@pytest.fixture
+def page_cache(db):
+    return cache_helpers.versioned_cache(common.cache, common.table_versions, "customer")
+
+
+def page(db, page_cache, query_string="", **attributes):
+    """The html of a page of the cached grid"""
+    return grid(db, query_string, page_cache=page_cache, **attributes).render().xml()
+
+
+def test_pages_are_cached_until_the_table_is_written(db, customers, page_cache):
+    first = page(db, page_cache)
+    assert queries(db, lambda: page(db, page_cache), "SELECT") == 0
+    assert page(db, page_cache) == first
+    # other parameters are other pages
+    assert queries(db, lambda: page(db, page_cache, "page=2"), "SELECT") > 0
+    sorted_page = page(db, page_cache, "orderby=~customer.name")
+    assert "Customer 6" in sorted_page and "Customer 0" not in sorted_page
+
+    db(db.customer.name == "Customer 0").update(name="Customer 00")
+    db.commit()
+    assert "Customer 00" in page(db, page_cache)
+
+
+def test_pages_with_per_user_buttons_need_a_page_cache_key(db, customers, page_cache):
+    def editable(row):
+        return row.name != "Customer 1"
+
+    def served(**attributes):
+        return page(db, page_cache, editable=editable, **attributes)
+
+    served()
+    assert queries(db, served, "SELECT") > 0
+    served(page_cache_key=["group 2"])
+    assert queries(db, lambda: served(page_cache_key=["group 2"]), "SELECT") == 0
+    # each key has its own pages
+    assert queries(db, lambda: served(page_cache_key=["group 3"]), "SELECT") > 0
+
+
+def test_only_select_pages_are_cached(db, customers, page_cache):
+    details = "mode=details&id=%s" % db(customers).select().first().id
+
+    def served():
+        return page(db, page_cache, details, details=True)
+
+    served()
+    assert queries(db, served, "SELECT") > 0
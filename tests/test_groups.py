@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from conftest import app_module
+
+common = app_module("common")
+permissions = app_module("permissions")
+
+
+@pytest.fixture
+def users(db):
+    ids = [
+        db.auth_user.insert(username=name, email="%s@example.com" % name)
+        for name in ("ann", "bob")
+    ]
+    db.commit()
+    yield ids
+    common.group_members.cache.clear()
+
+
+def tag_selects(db, f):
+    """The number of selects of the tag table run by f()"""
+    del db._timings[:]
+    f()
+    tablename = common.groups.tag_table._rname
+    return len([sql for sql, _ in db._timings if "FROM %s" % tablename in sql])
+
+
+def test_groups_are_cached_until_the_tags_of_the_user_change(db, users):
+    ann, bob = users
+    members = common.group_members
+    common.groups.add(ann, ["7", "sales/north"])
+    db.commit()
+
+    assert tag_selects(db, lambda: members.get(ann)) == 1
+    assert members.get(ann) == frozenset({"7", "sales/north"})
+    assert tag_selects(db, lambda: members.get(ann)) == 0
+    # users without tags are cached too
+    assert members.get(bob) == frozenset()
+    assert tag_selects(db, lambda: members.get(bob)) == 0
+    assert members.get(None) == frozenset()
+
+    common.groups.add(bob, "2")
+    assert tag_selects(db, lambda: members.get(ann)) == 0
+    assert members.get(bob) == frozenset({"2"})
+    common.groups.remove(ann, "7")
+    assert members.get(ann) == frozenset({"sales/north"})
+    db(common.groups.tag_table.record_id == bob).update(record_id=ann)
+    assert members.get(ann) == frozenset({"2", "sales/north"})
+    assert members.get(bob) == frozenset()
+
+
+def test_groups_read_before_the_commit_are_dropped_by_it(db, users):
+    ann, _ = users
+    common.groups.add(ann, "7")
+
+    # another thread does not see the tag yet and caches no groups
+    def read():
+        read.groups = common.group_members.get(ann)
+        db.rollback()
+
+    thread = threading.Thread(target=read)
+    thread.start()
+    thread.join()
+    assert read.groups == frozenset()
+
+    db.commit()
+    assert common.group_members.get(ann) == frozenset({"7"})
+
+
+def test_subgroups_belong_to_their_group():
+    user_groups = frozenset({"sales/north", "7"})
+
+    assert permissions.in_groups(user_groups, ["sales"])
+    assert permissions.in_groups(user_groups, ["2", "7"])
+    assert not permissions.in_groups(user_groups, ["sales/south", "north", "sale"])
@@ -0,0 +1,123 @@
+from decimal import Decimal
+
+from conftest import app_module
+
+importer = app_module("importer")
+
+
+def test_invalid_rows_are_rejected_with_their_errors(db):
+    db.district.insert(name="North")
+    db.commit()
+    rows = [
+        dict(name="Alfreds", district="north"),
+        dict(name="", district="North"),
+        dict(name="Berglunds", district="South"),
+        dict(name="Chop-suey", email="not an email"),
+        dict(name="Du monde", colour="blue"),
+    ]
+
+    report = importer.import_rows(db, "customer", rows, batch_size=2)
+
+    assert report["inserted"] == 1
+    assert report["rejected"] == 4
+    assert [(r["line"], sorted(r["errors"])) for r in report["rejects"]] == [
+        (2, ["name"]),
+        (3, ["district"]),
+        (4, ["email"]),
+        (5, ["_row"]),
+    ]
+    assert report["rejects"][1]["errors"]["district"] == "unknown district South"
+    assert db(db.customer).select().column("name") == ["Alfreds"]
+
+
+def test_references_are_resolved_by_id_or_name_per_batch(db):
+    north = db.district.insert(name="North")
+    south = db.district.insert(name="South")
+    db.commit()
+    rows = [
+        dict(name="A", district=str(north)),
+        dict(name="B", district=" SOUTH "),
+        # the name of the previous batch is not known in this one, it is looked up again
+        dict(name="C", district="north"),
+        dict(name="D", district=str(south + 1)),
+        dict(name="E", district=""),
+    ]
+
+    report = importer.import_rows(db, "customer", rows, batch_size=2)
+
+    assert report["rejected"] == 1
+    assert report["rejects"][0]["line"] == 4
+    customers = db(db.customer).select(orderby=db.customer.name)
+    assert [(c.name, c.district) for c in customers] == [
+        ("A", north),
+        ("B", south),
+        ("C", north),
+        ("E", None),
+    ]
+
+
+def test_rows_with_and_without_ids_in_one_batch(db):
+    rows = [dict(id="40", name="Forty"), dict(name="Next")]
+
+    report = importer.import_rows(db, "district", rows)
+
+    assert report["inserted"] == 2
+    assert db(db.district).select(orderby=db.district.id).as_list() == [
+        dict(id=40, name="Forty"),
+        dict(id=41, name="Next"),
+    ]
+
+
+def test_order_lines_get_the_product_price_and_refresh_the_totals(db):
+    chai = db.product.insert(name="Chai", unit_price=Decimal("18.00"))
+    tofu = db.product.insert(name="Tofu", unit_price=Decimal("23.25"))
+    db.commit()
+    orders = [
+        dict(id="1", order_date="2024-03-01", required_date="2024-03-15", freight="3.50"),
+        dict(id="2", order_date="2024-03-02", required_date="2024-03-16"),
+    ]
+    lines = [
+        dict(order="1", product="chai", quantity="2"),
+        dict(order="1", product=str(tofu), quantity="1", discount="0.1"),
+        dict(order="2", product="Tofu", quantity="4", unit_price="1.00"),
+        dict(order="3", product="Chai", quantity="1"),
+    ]
+
+    assert importer.import_rows(db, "order", orders)["inserted"] == 2
+    assert db.order(2).total == Decimal("0.00")
+    report = importer.import_rows(db, "order_detail", lines, batch_size=3)
+
+    assert report["inserted"] == 3
+    assert report["rejects"][0]["errors"] == dict(order="unknown order 3")
+    lines = db(db.order_detail).select(orderby=db.order_detail.id)
+    assert [(line.product, line.unit_price) for line in lines] == [
+        (chai, Decimal("18.00")),
+        (tofu, Decimal("23.25")),
+        (tofu, Decimal("23.25")),
+    ]
+    # the totals leave the discount out, like the order hooks
+    assert (db.order(1).subtotal, db.order(1).total) == (Decimal("59.25"), Decimal("62.75"))
+    assert (db.order(2).subtotal, db.order(2).total) == (Decimal("93.00"), Decimal("93.00"))
+
+
+def test_rows_the_database_refuses_are_rejected(db):
+    db.district.insert(id=2, name="Taken")
+    db.commit()
+    rows = [
+        dict(id="1", name="One"),
+        dict(id="2", name="Two"),
+        dict(id="3", name="Three"),
+        dict(id="4", name="Four"),
+    ]
+
+    report = importer.import_rows(db, "district", rows, batch_size=2)
+
+    assert (report["inserted"], report["rejected"]) == (3, 1)
+    assert report["rejects"][0]["line"] == 2
+    assert "UNIQUE" in report["rejects"][0]["errors"]["_row"]
+    assert db(db.district).select(orderby=db.district.id).column("name") == [
+        "One",
+        "Taken",
+        "Three",
+        "Four",
+    ]
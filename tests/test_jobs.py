@@ -0,0 +1,168 @@
+import datetime
+
+import pytest
+from pydal import DAL
+
+from conftest import app_module
+
+jobs = app_module("jobs")
+schema = app_module("schema")
+
+
+def job_runner(folder, **attributes):
+    """A runner with its own DAL on the job database of folder, and a job failing twice"""
+    db = DAL("sqlite://jobs.db", folder=str(folder))
+    runner = jobs.JobRunner(db, workers=0, retry_delay=10, **attributes)
+    schema.migrate_indexes(db)
+    runner.calls = []
+
+    @runner.job("flaky")
+    def flaky(n):
+        runner.calls.append(n)
+        if len(runner.calls) <= 2:
+            raise ValueError("try again")
+        return n * 2
+
+    @runner.job("hourly", every=3600)
+    def hourly():
+        runner.calls.append("hourly")
+
+    return runner
+
+
+@pytest.fixture
+def runner(tmp_path):
+    runner = job_runner(tmp_path)
+    yield runner
+    runner.db.close()
+
+
+def due(runner, job_id):
+    """Make a job due now, as if its retry delay or lease had passed"""
+    past = jobs.now() - datetime.timedelta(seconds=1)
+    runner.db(runner.table.id == job_id).update(run_at=past, lease_until=past)
+    runner.db.commit()
+
+
+def test_claim_takes_a_lease(runner):
+    job_id = runner.enqueue("flaky", 1)
+    runner.db.commit()
+
+    job = runner.claim()
+
+    assert job.id == job_id
+    assert (job.status, job.attempts, job.worker) == (jobs.RUNNING, 1, runner.worker)
+    assert job.lease_until - jobs.now() > datetime.timedelta(seconds=runner.lease - 5)
+    # the job is leased, no one else gets it
+    assert runner.claim() is None
+
+
+def test_failing_jobs_are_retried_with_a_doubling_delay(runner):
+    job_id = runner.enqueue("flaky", 21)
+    runner.db.commit()
+
+    delays = []
+    for _ in range(3):
+        due(runner, job_id)
+        started = jobs.now()
+        runner.run(runner.claim())
+        job = runner.table(job_id)
+        delays.append((job.run_at - started).total_seconds())
+
+    assert job.status == jobs.DONE
+    assert job.result == "42"
+    assert job.error is None
+    assert job.attempts == 3
+    # run_at is left alone by the successful run
+    assert [round(delay, -1) for delay in delays[:2]] == [10, 20]
+
+
+def test_jobs_fail_after_max_attempts(runner):
+    job_id = runner.enqueue("flaky", 1)
+    runner.db(runner.table.id == job_id).update(max_attempts=2)
+    runner.db.commit()
+
+    for _ in range(2):
+        due(runner, job_id)
+        runner.run(runner.claim())
+
+    job = runner.table(job_id)
+    assert (job.status, job.attempts) == (jobs.FAILED, 2)
+    assert "ValueError: try again" in job.error
+    due(runner, job_id)
+    assert runner.claim() is None
+
+
+def test_expired_leases_are_taken_over(runner):
+    job_id = runner.enqueue("flaky", 1)
+    runner.db.commit()
+    first = runner.claim()
+    due(runner, job_id)
+
+    second = runner.claim()
+
+    assert (second.id, second.attempts) == (job_id, 2)
+    # the first worker lost its claim, what it reports is ignored
+    runner.run(first)
+    assert runner.table(job_id).status == jobs.RUNNING
+
+
+def test_expired_last_attempts_fail(runner):
+    job_id = runner.enqueue("flaky", 1)
+    runner.db(runner.table.id == job_id).update(max_attempts=1)
+    runner.db.commit()
+    runner.claim()
+    due(runner, job_id)
+
+    assert runner.claim() is None
+    job = runner.table(job_id)
+    assert (job.status, job.error) == (jobs.FAILED, "lease expired")
+
+
+def test_periodic_jobs_are_queued_once_per_period(runner, tmp_path):
+    other = job_runner(tmp_path)
+    try:
+        runner.schedule()
+        other.schedule()
+        runner.schedule()
+    finally:
+        other.db.close()
+
+    rows = runner.db(runner.table.name == "hourly").select()
+    assert len(rows) == 1
+    assert rows[0].period_key.startswith("hourly@")
+
+
+def test_low_stock_lists_the_products_to_reorder(db):
+    tasks = app_module("tasks")
+    for name, in_stock, reorder_level in [
+        ("Chai", 39, 10),
+        ("Tofu", 10, 10),
+        ("Aniseed Syrup", 0, 25),
+        ("Konbu", 24, None),
+    ]:
+        db.product.insert(name=name, in_stock=in_stock, reorder_level=reorder_level)
+    db.commit()
+
+    result = tasks.low_stock()
+
+    assert result["count"] == 2
+    assert [product["name"] for product in result["products"]] == ["Aniseed Syrup", "Tofu"]
+    assert sorted(result["products"][0]) == ["id", "in_stock", "name", "reorder_level"]
+
+
+def test_workers_are_only_started_explicitly(monkeypatch):
+    tasks = app_module("tasks")
+    common = app_module("common")
+    assert "low_stock" in common.jobs.functions
+    # importing tasks started nothing
+    assert common.jobs.stop_event is None
+
+    started = []
+    monkeypatch.setattr(common.jobs, "start", lambda: started.append(True))
+    monkeypatch.setattr(tasks.settings, "JOB_WORKERS", 0)
+    tasks.start_workers()
+    assert started == []
+    monkeypatch.setattr(tasks.settings, "JOB_WORKERS", 2)
+    tasks.start_workers()
+    assert started == [True]
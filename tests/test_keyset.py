@@ -0,0 +1,143 @@
+import hashlib
+import inspect
+import re
+from wsgiref.util import setup_testing_defaults
+
+import py4web
+import pytest
+from py4web import request
+from py4web.utils.grid import Grid
+
+from conftest import app_module
+
+grid_helpers = app_module("grid_helpers")
+
+# start of the sha1 of the source of the Grid methods KeysetGrid overrides, copies
+# or calls, in py4web grid_helpers.PY4WEB_VERSION
+GRID_INTERNALS = {
+    "__init__": "120b1cf71dd4",
+    "process": "992b47b8e4de",
+    "render": "a483b10f9620",
+    "_handle_mode_select": "b169cf6978b7",
+    "_make_table": "6c02e2a0d83e",
+    "_make_table_body": "68831fe55671",
+    "_make_table_pager": "857b36b3fc83",
+    "_get_tablenames": "55a3128eeeb8",
+    "parse": "f004ef37e0ae",
+}
+
+
+@pytest.fixture
+def customers(db):
+    """Customers with repeated and missing titles, sorted by title then id"""
+    titles = ["Owner", None, "Sales Agent", "Owner", None, "President", "Owner"]
+    for i, title in enumerate(titles):
+        db.customer.insert(name="Customer %s" % i, title=title)
+    db.commit()
+    return db.customer
+
+
+def walk(db, table, orders, size, backwards=False):
+    """The ids of every row, a page of size at a time, each page seeking past the last one"""
+    orderby = [~field if desc != backwards else field for field, desc in orders]
+    ids, values = [], None
+    while True:
+        query = table.id > 0
+        if values is not None:
+            query &= grid_helpers.seek_query(orders, values, backwards)
+        rows = db(query).select(
+            *[field for field, _ in orders], orderby=orderby, limitby=(0, size)
+        )
+        ids += [row.id for row in rows]
+        if len(rows) < size:
+            return ids
+        values = [rows[-1][field.name] for field, _ in orders]
+
+
+@pytest.mark.parametrize("descending", [False, True])
+@pytest.mark.parametrize("size", [1, 2, 3])
+def test_seek_pages_follow_the_sort_order(db, customers, descending, size):
+    orders = [(customers.title, descending), (customers.id, False)]
+    orderby = ~customers.title if descending else customers.title
+    expected = [row.id for row in db(customers).select(orderby=orderby | customers.id)]
+
+    assert walk(db, customers, orders, size) == expected
+    assert walk(db, customers, orders, size, backwards=True) == expected[::-1]
+
+
+def test_cursor_round_trip():
+    cursor = grid_helpers.encode_cursor("next", "customer.title,customer.id", ["Owner", 12])
+
+    assert grid_helpers.decode_cursor(cursor, "customer.title,customer.id", 2) == (
+        "next",
+        ["Owner", 12],
+    )
+
+
+@pytest.mark.parametrize(
+    "cursor, order_key, length",
+    [
+        (None, "customer.id", 1),
+        ("not base64 json", "customer.id", 1),
+        # made for another sort order
+        (grid_helpers.encode_cursor("next", "customer.name", [1]), "customer.id", 1),
+        # a key of the wrong length
+        (grid_helpers.encode_cursor("next", "customer.id", [1, 2]), "customer.id", 1),
+        # an unknown direction
+        (grid_helpers.encode_cursor("up", "customer.id", [1]), "customer.id", 1),
+    ],
+)
+def test_invalid_cursors_are_ignored(cursor, order_key, length):
+    assert grid_helpers.decode_cursor(cursor, order_key, length) == (None, None)
+
+
+def grid_page(db, query_string=""):
+    """A KeysetGrid of the customers, 2 by page, processed for a GET of query_string"""
+    environ = dict(REQUEST_METHOD="GET", QUERY_STRING=query_string)
+    setup_testing_defaults(environ)
+    request.__init__(environ)
+    return grid_helpers.KeysetGrid(
+        db.customer,
+        columns=[db.customer.name, db.customer.title],
+        orderby=~db.customer.title,
+        rows_per_page=2,
+        create=False,
+        details=False,
+        editable=False,
+        deletable=False,
+    )
+
+
+def test_grid_pages_follow_their_cursors(db, customers):
+    expected = [
+        row.name
+        for row in db(customers).select(orderby=~customers.title | customers.id)
+    ]
+    pages = []
+    grid = grid_page(db)
+    while True:
+        pages.append([row.name for row in grid.rows])
+        html = grid.render().xml()
+        links = re.findall(r'<a [^>]*href="[^"?]*\?([^"]*)"[^>]*>Next</a>', html)
+        if not links:
+            break
+        grid = grid_page(db, links[0].replace("&amp;", "&"))
+
+    assert [len(page) for page in pages] == [2, 2, 2, 1]
+    assert sum(pages, []) == expected
+    assert "Page 4 / 4" in html
+
+
+def test_the_grid_internals_keyset_grid_relies_on(db):
+    changed = [
+        name
+        for name, digest in GRID_INTERNALS.items()
+        if hashlib.sha1(inspect.getsource(getattr(Grid, name)).encode()).hexdigest()[:12]
+        != digest
+    ]
+
+    assert changed == [], (
+        "py4web %s changed Grid.%s: check KeysetGrid against them, then update "
+        "GRID_INTERNALS and grid_helpers.PY4WEB_VERSION"
+        % (py4web.__version__, ", Grid.".join(changed))
+    )
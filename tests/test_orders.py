@@ -0,0 +1,83 @@
+from decimal import Decimal
+
+from conftest import app_module
+
+models = app_module("models")
+common = app_module("common")
+
+
+def totals(db, order_id):
+    order = db.order(order_id)
+    return order.subtotal, order.total
+
+
+def test_the_hooks_keep_the_stored_totals_current(db):
+    chai = db.product.insert(name="Chai", unit_price=Decimal("18.00"))
+    tofu = db.product.insert(name="Tofu", unit_price=Decimal("23.25"))
+    order_id = db.order.insert(freight=Decimal("3.50"))
+    assert totals(db, order_id) == (Decimal("0.00"), Decimal("3.50"))
+
+    line = db.order_detail.insert(order=order_id, product=chai, quantity=2)
+    db.order_detail.insert(order=order_id, product=tofu, quantity=1)
+    # the line gets the price of its product, whatever it is given
+    assert db.order_detail(line).unit_price == Decimal("18.00")
+    assert totals(db, order_id) == (Decimal("59.25"), Decimal("62.75"))
+
+    db(db.order_detail.id == line).update(quantity=3)
+    assert totals(db, order_id) == (Decimal("77.25"), Decimal("80.75"))
+    db(db.order.id == order_id).update(freight=Decimal("1.00"))
+    assert totals(db, order_id) == (Decimal("77.25"), Decimal("78.25"))
+    db(db.order_detail.id == line).delete()
+    assert totals(db, order_id) == (Decimal("23.25"), Decimal("24.25"))
+
+
+def test_moving_a_line_refreshes_both_orders(db):
+    chai = db.product.insert(name="Chai", unit_price=Decimal("18.00"))
+    first = db.order.insert()
+    second = db.order.insert()
+    line = db.order_detail.insert(order=first, product=chai, quantity=1)
+
+    db(db.order_detail.id == line).update(order=second)
+
+    assert totals(db, first) == (Decimal("0.00"), Decimal("0.00"))
+    assert totals(db, second) == (Decimal("18.00"), Decimal("18.00"))
+
+
+def test_order_amounts_of_many_orders_round_each_price_to_cents(db):
+    tea = db.product.insert(name="Tea", unit_price=Decimal("0.10"))
+    orders = [db.order.insert(freight=Decimal("0.05")) for _ in range(3)]
+    for quantity, order_id in enumerate(orders, 1):
+        db.order_detail.insert(order=order_id, product=tea, quantity=quantity * 3)
+    empty = db.order.insert()
+
+    amounts = models.order_amounts(orders + [empty])
+
+    assert [amounts[order_id]["subtotal"] for order_id in orders] == [
+        Decimal("0.30"),
+        Decimal("0.60"),
+        Decimal("0.90"),
+    ]
+    assert amounts[orders[2]]["total"] == Decimal("0.95")
+    assert amounts[empty] == dict(subtotal=Decimal("0.00"), total=Decimal("0.00"))
+
+
+def test_verify_order_totals_rebuilds_the_drifted_totals(db):
+    chai = db.product.insert(name="Chai", unit_price=Decimal("18.00"))
+    order_id = db.order.insert()
+    db.order_detail.insert(order=order_id, product=chai, quantity=1)
+    db.order.insert()
+    db(db.order.id == order_id).update_naive(subtotal=0, total=0)
+    db.commit()
+
+    result = models.verify_order_totals(batch_size=1)
+    assert result["checked"] == 2
+    assert [order["id"] for order in result["drifted"]] == [order_id]
+    assert totals(db, order_id) == (Decimal("0.00"), Decimal("0.00"))
+
+    version = common.table_versions("order")
+    models.verify_order_totals(fix=True)
+    db.commit()
+    assert totals(db, order_id) == (Decimal("18.00"), Decimal("18.00"))
+    # the caches of the order grids see the repair
+    assert common.table_versions("order") > version
+    assert models.verify_order_totals()["drifted"] == []
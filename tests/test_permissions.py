@@ -0,0 +1,78 @@
+from conftest import app_module
+
+permissions = app_module("permissions")
+
+
+def customers(db, *titles):
+    ids = [db.customer.insert(name="Customer %s" % i, title=t) for i, t in enumerate(titles)]
+    db.commit()
+    return ids
+
+
+def flags(db, compiled, action):
+    """The check of action for every customer, by id, as the grid sees them"""
+    check = compiled.check(action)
+    rows = db(db.customer).select(db.customer.ALL, *compiled.fields, orderby=db.customer.id)
+    return [check(row) for row in rows]
+
+
+def test_null_titles_are_editable(db):
+    customers(db, "Owner", "Sales Agent", None)
+    rules = permissions.RowRules(db.customer).allow(
+        "editable", (db.customer.title != "Owner") | (db.customer.title == None)
+    )
+
+    compiled = rules.compile([])
+    assert flags(db, compiled, "editable") == [False, True, True]
+    editable = db(compiled.query("editable")).select(orderby=db.customer.id)
+    assert [row.title for row in editable] == ["Sales Agent", None]
+
+
+def test_group_rules_only_apply_to_their_members(db):
+    customers(db, "Owner", "Sales Agent")
+    rules = (
+        permissions.RowRules(db.customer)
+        .allow("deletable", db.customer.title == "Sales Agent")
+        .allow("deletable", groups=["7"])
+    )
+
+    assert flags(db, rules.compile(["2"]), "deletable") == [False, True]
+    # a rule without a query allows every row, nothing is selected with the page
+    members = rules.compile(["7/north"])
+    assert members.check("deletable") is True
+    assert members.query("deletable") is None
+    assert members.fields == []
+
+
+def test_actions_without_rules_are_denied(db):
+    customers(db, "Owner")
+    rules = permissions.RowRules(db.customer).allow("details", groups=["3"])
+
+    compiled = rules.compile(["4"])
+    assert compiled.check("details") is False
+    assert db(compiled.query("details")).isempty()
+
+
+def test_rows_without_the_flag_are_checked_with_a_query(db):
+    owner, agent = customers(db, "Owner", "Sales Agent")
+    rules = permissions.RowRules(db.customer).allow("editable", db.customer.title != "Owner")
+
+    check = rules.compile([]).check("editable")
+    # the record of the edit form is loaded without the flag
+    assert check(db.customer(agent)) is True
+    assert check(db.customer(owner)) is False
+
+
+def test_the_crud_rules_are_the_same_for_every_user(db):
+    controllers = app_module("controllers")
+    customers(db, "Owner", "Sales Agent", None, "President")
+    expected = dict(
+        details=[True, False, False, False],
+        editable=[False, True, True, True],
+        deletable=[False, True, False, False],
+    )
+
+    for user_groups in ([], ["2"], ["7"], ["3", "5/north"]):
+        compiled = controllers.crud_rules.compile(user_groups)
+        for action, allowed in expected.items():
+            assert flags(db, compiled, action) == allowed
@@ -0,0 +1,80 @@
+import threading
+from decimal import Decimal
+
+from conftest import app_module
+
+cache_helpers = app_module("cache_helpers")
+models = app_module("models")
+
+
+def product_selects(db, f):
+    """The number of selects of the product table run by f()"""
+    del db._timings[:]
+    f()
+    return len([sql for sql, _ in db._timings if 'FROM "product"' in sql])
+
+
+def test_order_lines_take_the_cached_price(db):
+    chai = db.product.insert(name="Chai", unit_price=Decimal("18.00"))
+    order = db.order.insert()
+    db.commit()
+
+    def add_line():
+        return db.order_detail.insert(order=order, product=chai, quantity=1)
+
+    assert product_selects(db, add_line) == 1
+    assert product_selects(db, add_line) == 0
+    assert [line.unit_price for line in db(db.order_detail).select()] == [
+        Decimal("18.00"),
+        Decimal("18.00"),
+    ]
+
+    # a new price is loaded again, other product changes keep the cached one
+    db(db.product.id == chai).update(unit_price=Decimal("19.50"))
+    assert product_selects(db, add_line) == 1
+    db(db.product.id == chai).update(name="Chai tea")
+    assert product_selects(db, add_line) == 0
+    assert db.order_detail(add_line()).unit_price == Decimal("19.50")
+    db(db.product.id == chai).delete()
+    assert models.product_prices.get(chai) is None
+
+
+def test_prices_read_before_the_commit_are_dropped_by_it(db):
+    chai = db.product.insert(name="Chai", unit_price=Decimal("18.00"))
+    db.commit()
+    db(db.product.id == chai).update(unit_price=Decimal("19.50"))
+
+    # another thread still sees the committed price and caches it
+    def read():
+        read.price = models.product_prices.get(chai)
+        db.rollback()
+
+    thread = threading.Thread(target=read)
+    thread.start()
+    thread.join()
+    assert read.price == Decimal("18.00")
+
+    db.commit()
+    assert models.product_prices.get(chai) == Decimal("19.50")
+
+
+def test_local_caches_keep_the_recent_keys_for_ttl_seconds(monkeypatch):
+    loads = []
+
+    def load(keys):
+        loads.append(sorted(keys))
+        return {key: key * 10 for key in keys if key > 0}
+
+    cache = cache_helpers.LocalCache(load, size=2, ttl=60)
+    assert cache.get_many([1, 2, 0]) == {1: 10, 2: 20}
+    assert cache.get(1) == 10
+    # 3 pushes out 2, the least recently used, and 0 was never kept
+    assert cache.get_many([3, 0]) == {3: 30}
+    assert cache.get_many([1, 2, 3]) == {1: 10, 2: 20, 3: 30}
+    assert loads == [[0, 1, 2], [0, 3], [2]]
+
+    now = cache_helpers.time.time()
+    monkeypatch.setattr(cache_helpers.time, "time", lambda: now + 61)
+    cache.get(3)
+    assert loads[-1] == [3]
+    assert cache.stats() == dict(hits=3, misses=7, size=2, hit_rate=0.3)
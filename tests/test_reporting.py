@@ -0,0 +1,142 @@
+import datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+import pytest
+
+from conftest import app_module
+
+reporting = app_module("reporting")
+
+
+def order(db, customer, order_date, *lines):
+    """An order with lines of (product, quantity, discount), through the hooks"""
+    order_id = db.order.insert(
+        customer=customer, order_date=order_date, required_date=order_date
+    )
+    for product, quantity, discount in lines:
+        db.order_detail.insert(
+            order=order_id, product=product, quantity=quantity, discount=discount
+        )
+    return order_id
+
+
+@pytest.fixture
+def sales(db):
+    """Two districts, two categories and prices floats do not add up exactly"""
+    north = db.district.insert(name="North")
+    south = db.district.insert(name="South")
+    drinks = db.category.insert(name="Drinks")
+    food = db.category.insert(name="Food")
+    tea = db.product.insert(name="Tea", category=drinks, unit_price=Decimal("0.10"))
+    cake = db.product.insert(name="Cake", category=food, unit_price=Decimal("2.35"))
+    alfreds = db.customer.insert(name="Alfreds", district=north)
+    bottom = db.customer.insert(name="Bottom", district=south)
+    order(db, alfreds, datetime.date(2024, 1, 5), (tea, 3, "0.15"), (cake, 1, "0.05"))
+    order(db, alfreds, datetime.date(2024, 1, 20), (tea, 7, "0.00"))
+    order(db, bottom, datetime.date(2024, 2, 1), (cake, 3, "0.33"))
+    order(db, bottom, datetime.date(2024, 4, 30), (tea, 1, "0.25"))
+    db.commit()
+    return dict(north=north, south=south, drinks=drinks, food=food)
+
+
+def revenue(price, quantity, discount):
+    """The amount of a line in Decimal, to be rounded once summed"""
+    return Decimal(price) * quantity * (1 - Decimal(discount))
+
+
+def test_line_amounts_are_summed_in_exact_cents(db, sales):
+    january = reporting.revenue_report.aggregate([(2024, 1)])[(2024, 1)]
+    north = january[(sales["north"], sales["drinks"], None)]
+
+    # the sum is an integer of cents times percent paid
+    assert north == 3 * 10 * 85 + 7 * 10 * 100
+    assert reporting.to_amount(north) == Decimal("0.96")
+    assert reporting.to_amount(north) == (
+        revenue("0.10", 3, "0.15") + revenue("0.10", 7, "0")
+    ).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+
+
+@pytest.mark.parametrize(
+    "value, amount",
+    [
+        (None, "0.00"),
+        (12345, "1.23"),
+        # half up, not half even
+        (12250, "1.23"),
+        (12350, "1.24"),
+        (-12250, "-1.23"),
+    ],
+)
+def test_to_amount_rounds_half_up_to_cents(value, amount):
+    assert reporting.to_amount(value) == Decimal(amount)
+
+
+def test_pivot_totals(db, sales):
+    pivot = reporting.revenue_report.pivot("district", "month", (2024, 1), (2024, 3))
+
+    assert pivot["rows"] == [sales["north"], sales["south"]]
+    assert pivot["columns"] == [(2024, 1), (2024, 2)]
+    assert pivot["cells"] == {
+        (sales["north"], (2024, 1)): Decimal("3.19"),
+        (sales["south"], (2024, 2)): Decimal("4.72"),
+    }
+    assert pivot["row_totals"] == {
+        sales["north"]: Decimal("3.19"),
+        sales["south"]: Decimal("4.72"),
+    }
+    assert pivot["total"] == Decimal("7.91")
+
+
+def grouped_queries(db, f):
+    """The number of grouped statements run by f()"""
+    del db._timings[:]
+    f()
+    return len([sql for sql, _ in db._timings if "GROUP BY" in sql])
+
+
+def test_missing_months_are_aggregated_together(db, sales):
+    report = reporting.revenue_report
+
+    def pivot(first, last):
+        return report.pivot("month", "category", first, last)
+
+    assert grouped_queries(db, lambda: pivot((2024, 2), (2024, 2))) == 1
+    assert grouped_queries(db, lambda: pivot((2024, 1), (2024, 12))) == 1
+    assert grouped_queries(db, lambda: pivot((2024, 1), (2024, 12))) == 0
+    assert pivot((2024, 1), (2024, 12))["rows"] == [(2024, 1), (2024, 2), (2024, 4)]
+    # every month of the range is cached, the empty ones too
+    assert grouped_queries(db, lambda: pivot((2024, 3), (2024, 3))) == 0
+    assert report.month((2024, 3)) == {}
+
+
+def test_months_are_dropped_once_their_orders_are_written(db, sales):
+    report = reporting.revenue_report
+    assert report.pivot("category", "month", (2024, 4), (2024, 4))["total"] == Decimal("0.08")
+
+    tea = db(db.product.name == "Tea").select().first()
+    db(db.order_detail.product == tea.id).update(quantity=2)
+    db.commit()
+
+    assert report.pivot("category", "month", (2024, 4), (2024, 4))["total"] == Decimal("0.15")
+
+
+@pytest.mark.parametrize(
+    "value, period",
+    [
+        ("2024-03", (2024, 3)),
+        ("2024-13", None),
+        ("2024-0", None),
+        ("9999-12", None),
+        ("0001-01", (1, 1)),
+        ("march", None),
+        (None, None),
+    ],
+)
+def test_parse_period(value, period):
+    assert reporting.parse_period(value) == period
+
+
+def test_count_periods():
+    assert reporting.count_periods((2024, 1), (2024, 1)) == 1
+    assert reporting.count_periods((2023, 11), (2024, 2)) == 4
+    assert list(reporting.periods((2023, 11), (2024, 2)))[-1] == (2024, 2)
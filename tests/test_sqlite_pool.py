@@ -0,0 +1,72 @@
+import sqlite3
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+from py4web import request
+
+from conftest import app_module
+
+sqlite_pool = app_module("sqlite_pool")
+
+
+def serve(db, pool, method="GET", query=""):
+    """
+    Run the fixture around an action reading the connection and trying to write,
+    as the db fixture before it would, returns (connection, error of the write)
+    """
+    environ = dict(REQUEST_METHOD=method, QUERY_STRING=query)
+    setup_testing_defaults(environ)
+    request.__init__(environ)
+    db._adapter.reconnect()
+    pool.on_request({})
+    try:
+        connection = db._adapter.connection
+        db(db.district).count()
+        try:
+            db.district.insert(name="North")
+            error = None
+        except sqlite3.OperationalError as e:
+            error = str(e)
+        db.rollback()
+    finally:
+        pool.on_success({})
+    db._adapter.reconnect()
+    return connection, error
+
+
+@pytest.fixture
+def pool(db):
+    pool = sqlite_pool.ReadOnlyPool(db, size=1)
+    yield pool
+    for connection in pool.pool:
+        connection.close()
+
+
+@pytest.mark.parametrize("query", ["", "mode=details&id=1", "id=1"])
+def test_grid_reads_use_query_only_connections(db, pool, query):
+    connection, error = serve(db, pool, query=query)
+
+    assert error == "attempt to write a readonly database"
+    assert pool.pool == [connection]
+    assert connection.execute("PRAGMA query_only;").fetchone() == (1,)
+
+
+def test_read_connections_are_reused(db, pool):
+    first, _ = serve(db, pool)
+    second, _ = serve(db, pool, method="HEAD")
+
+    assert second is first
+    assert pool.pool == [first]
+    # the write connections are left alone
+    assert db._adapter.connection is not first
+
+
+@pytest.mark.parametrize(
+    "method, query", [("POST", ""), ("GET", "mode=edit&id=1"), ("GET", "mode=new")]
+)
+def test_other_requests_keep_the_db_connection(db, pool, method, query):
+    connection, error = serve(db, pool, method, query)
+
+    assert error is None
+    assert pool.pool == []
+    assert connection.execute("PRAGMA query_only;").fetchone() == (0,)